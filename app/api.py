@@ -3,10 +3,15 @@ API Routes for Torrent Search and Download Manager
 Separated from main Flask application for better organization
 """
 import os
+import json
 import time
+import uuid
+import queue
+import hashlib
 import threading
 import logging
-from flask import Blueprint, request, jsonify, send_file, current_app
+import urllib.parse
+from flask import Blueprint, Response, request, jsonify, send_file, current_app
 from flask_login import login_required, current_user
 
 # Import your existing utility functions
@@ -16,8 +21,27 @@ try:
         format_size, create_magnet_link, validate_info_hash, 
         get_default_trackers, get_file_list, search_torrents_json_api,
         search_torrents_html_scrape, extract_info_hash_from_link,
-        safe_int, parse_size, sanitize_filename
+        safe_int, parse_size, sanitize_filename,
+        decode_json_array, is_placeholder_row
     )
+    from .site_health import site_health, looks_like_challenge, SiteUnavailableError
+    from .mirrors import mirror_pool
+    from .deadline import Deadline, DeadlineExceeded
+    from .scrape_pool import scrape_pool
+    from .file_index import get_file_index, SORT_FIELDS, encode_cursor, decode_cursor
+    from .delete_jobs import delete_jobs
+    from .disk_space import disk_monitor
+    from .duplicates import get_duplicate_index
+    from .post_process import post_processor, POSTPROCESS_ENABLED
+    from .storage_mover import storage_mover
+    from .verify_scheduler import verify_scheduler, VERIFY_AFTER_MOVE
+    from .leader import is_leader, forward as forward_to_leader
+    from .download_store import download_store
+    from .download_queue import download_queue, DownloadJob
+    from .transmission_client import TransmissionUnavailable
+    from .live_updates import live_updates
+    from .metrics import SCRAPE_FETCH_SECONDS, SCRAPE_PARSE_SECONDS, count_cache
+    from .profiling import profiler, is_admin
 except ImportError:
     # Handle relative imports when running directly
     from transmission_client import get_transmission_client  # Your existing HTTP client
@@ -25,8 +49,27 @@ except ImportError:
         format_size, create_magnet_link, validate_info_hash, 
         get_default_trackers, get_file_list, search_torrents_json_api,
         search_torrents_html_scrape, extract_info_hash_from_link,
-        safe_int, parse_size, sanitize_filename
+        safe_int, parse_size, sanitize_filename,
+        decode_json_array, is_placeholder_row
     )
+    from site_health import site_health, looks_like_challenge, SiteUnavailableError
+    from mirrors import mirror_pool
+    from deadline import Deadline, DeadlineExceeded
+    from scrape_pool import scrape_pool
+    from file_index import get_file_index, SORT_FIELDS, encode_cursor, decode_cursor
+    from delete_jobs import delete_jobs
+    from disk_space import disk_monitor
+    from duplicates import get_duplicate_index
+    from post_process import post_processor, POSTPROCESS_ENABLED
+    from storage_mover import storage_mover
+    from verify_scheduler import verify_scheduler, VERIFY_AFTER_MOVE
+    from leader import is_leader, forward as forward_to_leader
+    from download_store import download_store
+    from download_queue import download_queue, DownloadJob
+    from transmission_client import TransmissionUnavailable
+    from live_updates import live_updates
+    from metrics import SCRAPE_FETCH_SECONDS, SCRAPE_PARSE_SECONDS, count_cache
+    from profiling import profiler, is_admin
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -34,8 +77,6 @@ logger = logging.getLogger(__name__)
 # Create Blueprint for API routes
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
-# Store active downloads (this could be moved to a database later)
-active_downloads = {}
 
 # Site configurations for multi-site support
 TORRENT_SITES = {
@@ -48,37 +89,176 @@ TORRENT_SITES = {
     '1337x': {
         'name': '1337x',
         'search_url': 'https://1337x.to/search/{query}/1/',
+        'mirrors': ['https://1337x.to', 'https://1337x.st', 'https://x1337x.ws', 'https://x1337x.eu'],
         'type': 'html_scrape',
         'enabled': True
     },
     'gog-games': {
         'name': 'GOG Games',
         'search_url': 'https://gog-games.to/search?query={query}',
+        'mirrors': ['https://gog-games.to'],
         'type': 'html_scrape',
         'enabled': True
     },
     'fitgirl': {
         'name': 'FitGirl Repacks',
         'search_url': 'https://fitgirl-repacks.site/?s={query}',
+        'mirrors': ['https://fitgirl-repacks.site'],
         'type': 'html_scrape',
         'enabled': True
     },
     'steamrip': {
         'name': 'SteamRIP',
         'search_url': 'https://steamrip.com/?s={query}',
+        'mirrors': ['https://steamrip.com'],
         'type': 'html_scrape',
         'enabled': True
     }
 }
 
+# Number of results returned per page by JSON API sites
+JSON_API_PAGE_SIZE = 20
+
+# Default and maximum page size of the file listing
+FILES_PAGE_SIZE = 100
+FILES_MAX_PAGE_SIZE = 1000
+# Default and maximum levels returned by /api/files/tree
+FILES_TREE_DEPTH = 1
+FILES_TREE_MAX_DEPTH = 8
+# Maximum paths accepted by one bulk deletion job
+DELETE_JOB_MAX_PATHS = 1000
+# Seconds to wait for a magnet's metadata before its size can be checked
+METADATA_WAIT_SECONDS = 120
+# Seconds a health check result is reused before Transmission is asked again
+HEALTH_CACHE_SECONDS = 5
+# Seconds browsers may cache the site list without health (/api/sites?health=0)
+SITES_MAX_AGE = 86400
+
+# The site configuration only changes with a deploy
+SITES_CONFIG_TAG = hashlib.sha1(json.dumps(TORRENT_SITES, sort_keys=True).encode()).hexdigest()[:16]
+
+for _site_key, _site_config in TORRENT_SITES.items():
+    site_health.register_site(_site_key, _site_config['search_url'])
+    mirror_pool.register_site(_site_key, _site_config.get('mirrors') or [_site_config['search_url']])
+
+
+delete_jobs.client_factory = get_transmission_client
+delete_jobs.on_torrent_removed = download_store.delete_by_hash
+# Downloads still waiting for disk space after a restart get a space waiter again
+download_store.on_waiting = lambda record: record.get("disk_path") and _ensure_space_waiter(record["disk_path"])
+delete_jobs.on_path_deleted = lambda root, relpath: get_file_index(root).refresh(relpath)
+post_processor.on_extracted = lambda root, relpath: get_file_index(root).refresh(relpath)
+
+
+def _torrent_in_use(torrent):
+    """Whether post-processing still needs a torrent's files where they are"""
+    if not POSTPROCESS_ENABLED:
+        return False
+    if torrent.hash_string and torrent.hash_string not in post_processor.done_hashes:
+        return True  # completion not yet seen, extraction may be about to start
+    return post_processor.busy_with(torrent.name)
+
+
+def _move_started(job):
+    """Mark a torrent's download as moving so status syncs leave it alone"""
+    download_store.update_by_hash(job.info_hash, status="moving", moving=True)
+
+
+def _move_finished(job, relpath):
+    """Refresh both locations in the file index and record where the download went"""
+    file_index = get_file_index(storage_mover.root)
+    file_index.refresh(job.name)
+    if relpath:
+        file_index.refresh(relpath)
+    if relpath:
+        download_store.update_by_hash(job.info_hash, status="seeding", moving=False, location=relpath)
+    else:
+        download_store.update_by_hash(job.info_hash, status="move_failed", moving=False, move_error=job.error)
+    # A copy to another volume is re-read once to catch corruption in transit
+    if relpath and VERIFY_AFTER_MOVE and not job.rename:
+        verify_scheduler.enqueue(job.torrent_id, job.name, 'moved')
+
+
+def _conditional(etag, build, cache_control='private, no-cache'):
+    """Answer 304 if the client already has `etag`, otherwise the response from `build()`.
+
+    Callers derive the tag from a cheap state version, so unchanged polls
+    skip building and serializing the body.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.make_response(build())
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+storage_mover.is_busy = _torrent_in_use
+storage_mover.on_move_started = _move_started
+storage_mover.on_move_finished = _move_finished
+
+# Endpoints whose jobs and state live in the process running background services
+LEADER_ENDPOINTS = {
+    'list_duplicates', 'scan_duplicates',
+    'create_delete_job', 'list_delete_jobs', 'get_delete_job', 'cancel_delete_job',
+    'list_postprocess_jobs', 'create_postprocess_job', 'cancel_postprocess_job',
+    'list_storage_moves', 'create_storage_move',
+    'list_verify_jobs', 'create_verify_job', 'cancel_verify_job',
+}
+
+
+@api_bp.before_request
+def _forward_leader_endpoints():
+    """In the other server processes, hand requests for background service state to the leader"""
+    if request.endpoint is None or is_leader():
+        return None
+    if request.endpoint.split('.')[-1] not in LEADER_ENDPOINTS:
+        return None
+    forwarded = forward_to_leader(request)
+    if forwarded is None:
+        response = jsonify({"error": "Background services are starting, try again shortly"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    return forwarded
+
 # ============================================================================
 # Health and Status API
 # ============================================================================
 
+# Last health check result, shared by concurrent requests
+_health_cache = {"checked": 0, "status": None, "code": None, "etag": None}
+_health_lock = threading.Lock()
+
 @api_bp.route('/health', methods=['GET'])
 @login_required
 def health_check():
-    """Check the health of the application and its dependencies"""
+    """Check the health of the application and its dependencies.
+
+    Results are reused for HEALTH_CACHE_SECONDS; a healthy result carries an
+    ETag so unchanged polls get 304.
+    """
+    config = current_app.config.get('TORRENT_CONFIG', {})
+    with _health_lock:
+        expired = time.time() - _health_cache["checked"] >= HEALTH_CACHE_SECONDS
+        count_cache('health_check', not expired)
+        if expired:
+            health_status, status_code = _check_health(config)
+            unchanged = {key: value for key, value in health_status.items() if key != "timestamp"}
+            _health_cache.update(
+                checked=time.time(),
+                status=health_status,
+                code=status_code,
+                etag=hashlib.sha1(json.dumps(unchanged, sort_keys=True, default=str).encode()).hexdigest()[:16]
+            )
+        health_status, status_code, etag = _health_cache["status"], _health_cache["code"], _health_cache["etag"]
+
+    if status_code != 200:
+        return jsonify(health_status), status_code
+    return _conditional(f"health-{etag}", lambda: jsonify(health_status))
+
+def _check_health(config):
+    """Run the health checks; returns (status dict, HTTP status code)"""
     health_status = {
         "app": "healthy",
         "transmission": "unknown",
@@ -86,9 +266,6 @@ def health_check():
         "timestamp": time.time()
     }
     
-    # Get config from main app
-    config = current_app.config.get('TORRENT_CONFIG', {})
-    
     # Check Transmission connection
     try:
         client = get_transmission_client()
@@ -111,6 +288,7 @@ def health_check():
         if os.path.exists(download_dir) and os.access(download_dir, os.W_OK):
             health_status["download_dir"] = "healthy"
             health_status["download_dir_path"] = download_dir
+            _, health_status["disk"] = disk_monitor.check(download_dir, 0, _committed_bytes())
         else:
             health_status["download_dir"] = "not accessible"
     except Exception as e:
@@ -123,7 +301,7 @@ def health_check():
         health_status["overall"] = "unhealthy"
     
     status_code = 200 if health_status["overall"] == "healthy" else 503
-    return jsonify(health_status), status_code
+    return health_status, status_code
 
 # ============================================================================
 # Search API - Multi-Site Support
@@ -135,6 +313,9 @@ def search():
     """Search torrents across multiple sites"""
     query = request.args.get('q', '').strip()
     site = request.args.get('site', 'piratebay').strip()
+    page = max(safe_int(request.args.get('page', 1), 1), 1)
+    # Overall time budget for this request, shared by every fetch below
+    deadline = Deadline.from_param(request.args.get('timeout'))
     
     if not query:
         return jsonify({"error": "Query parameter 'q' is required"}), 400
@@ -146,33 +327,74 @@ def search():
     if not site_config.get('enabled', False):
         return jsonify({"error": f"Site {site} is currently disabled"}), 400
 
+    # Skip sites whose circuit is open, falling back to cached results
+    trial = site_health.allow_request(site)
+    if not trial:
+        site_status = site_health.status(site)
+        cached = site_health.cached_results(site, query, page)
+        count_cache('search_fallback', cached is not None)
+        logger.info(f"Site {site} is temporarily disabled, cached results: {cached is not None}")
+        if cached is not None:
+            return jsonify({
+                "results": cached,
+                "query": query,
+                "site": site,
+                "site_name": site_config['name'],
+                "page": page,
+                "has_more": False,
+                "cached": True,
+                "site_status": site_status
+            })
+        return jsonify({
+            "error": f"{site_config['name']} is temporarily unavailable, retrying in {site_status['retry_in']}s",
+            "site_status": site_status
+        }), 503
+
     try:
         logger.info(f"Searching {site_config['name']} for: {query}")
         
         # Route to appropriate search function based on site type
         if site_config['type'] == 'json_api':
-            results = search_json_api(query, site_config['search_url'])
+            results, has_more = search_json_api(query, site_config['search_url'], page, site, deadline, trial)
         elif site_config['type'] == 'html_scrape':
-            results = search_html_scrape(query, site, site_config['search_url'])
+            results = search_html_scrape(query, site, site_config['search_url'], deadline, trial)
+            has_more = False
         else:
             return jsonify({"error": f"Invalid search type for site: {site}"}), 500
 
         logger.info(f"Found {len(results)} results on {site_config['name']} for query: {query}")
+        if deadline.exceeded:
+            logger.warning(f"Search deadline of {deadline.seconds}s reached, returning partial results")
+        elif results:
+            site_health.cache_results(site, query, page, results)
         return jsonify({
             "results": results, 
             "query": query, 
             "site": site,
-            "site_name": site_config['name']
+            "site_name": site_config['name'],
+            "page": page,
+            "has_more": has_more,
+            "incomplete": deadline.exceeded
         })
 
     except Exception as e:
         logger.error(f"Search error for query '{query}' on {site}: {str(e)}")
         return jsonify({"error": f"Search failed on {site_config['name']}: {str(e)}"}), 500
+    finally:
+        # A trial request that never reached the site must not keep its circuit half-open
+        site_health.release(site, trial)
 
-def search_json_api(query, search_url):
-    """Search using JSON API (PirateBay) - uses existing utils function"""
+def search_json_api(query, search_url, page=1, site='piratebay', deadline=None, trial=None):
+    """Search using JSON API (PirateBay), returning one page of results and whether more exist"""
     try:
-        results = search_torrents_json_api(query, search_url)
+        results, has_more = search_torrents_json_api(
+            query, search_url,
+            limit=JSON_API_PAGE_SIZE,
+            offset=(page - 1) * JSON_API_PAGE_SIZE,
+            site=site,
+            deadline=deadline,
+            trial=trial
+        )
         
         # Convert to expected format for multi-site compatibility
         formatted_results = []
@@ -188,10 +410,10 @@ def search_json_api(query, search_url):
                 'category': get_category_name(item.get('category', '0'))
             })
         
-        return formatted_results
+        return formatted_results, has_more
     except Exception as e:
         logger.error(f"JSON API search error: {e}")
-        return []
+        return [], False
 
 def get_category_name(category_id):
     """Convert PirateBay category ID to name"""
@@ -205,10 +427,10 @@ def get_category_name(category_id):
     }
     return categories.get(str(category_id), 'Other')
 
-def search_html_scrape(query, site, search_url):
-    """Search using HTML scraping for various sites"""
+def search_html_scrape(query, site, search_url, deadline=None, trial=None):
+    """Search using HTML scraping for various sites, within the request deadline"""
+    deadline = deadline or Deadline()
     import requests
-    from bs4 import BeautifulSoup
     import urllib.parse
     import time
     
@@ -226,31 +448,57 @@ def search_html_scrape(query, site, search_url):
         }
         
         # Add small delay to be respectful
-        time.sleep(1)
-        
-        response = requests.get(formatted_url, headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Site-specific parsing
-        if site == '1337x':
-            return parse_1337x(soup, formatted_url)
-        elif site == 'gog-games':
-            return parse_gog_games(soup, formatted_url)
-        elif site == 'fitgirl':
-            return parse_fitgirl(soup, formatted_url)
-        elif site == 'steamrip':
-            return parse_steamrip(soup, formatted_url)
-        else:
-            return []
+        deadline.sleep(1)
+        
+        # Fetched from the fastest mirror, hedged with a second one when slow
+        timeout = deadline.timeout(15)
+        with site_health.track(site, deadline, trial):
+            response = mirror_pool.get(site, formatted_url, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            if looks_like_challenge(response.text):
+                raise SiteUnavailableError("Site returned an anti-bot challenge page")
+        
+        # Parse in a worker process when the scrape pool is enabled
+        if scrape_pool.enabled:
+            return scrape_pool.parse(site, response.text, response.url, deadline)
+        return parse_search_page(site, response.text, response.url, deadline)
             
+    except DeadlineExceeded:
+        logger.warning(f"Deadline reached before scraping {site}")
+        return []
     except Exception as e:
         logger.error(f"HTML scraping error for {site}: {str(e)}")
         return []
 
-def parse_1337x(soup, base_url):
+def parse_search_page(site, html, base_url, deadline=None):
+    """Parse a search results page of a site, extracting magnets from detail pages"""
+    with SCRAPE_PARSE_SECONDS.labels(site).time():
+        soup = make_soup(html)
+    return extract_results(site, soup, base_url, deadline)
+
+def make_soup(html):
+    """Parse HTML into a BeautifulSoup tree"""
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, 'html.parser')
+
+def extract_results(site, soup, base_url, deadline=None):
+    """Extract the results of a parsed search page, fetching magnets from detail pages"""
+    # Site-specific parsing
+    if site == '1337x':
+        return parse_1337x(soup, base_url, deadline)
+    elif site == 'gog-games':
+        return parse_gog_games(soup, base_url, deadline)
+    elif site == 'fitgirl':
+        return parse_fitgirl(soup, base_url, deadline)
+    elif site == 'steamrip':
+        return parse_steamrip(soup, base_url, deadline)
+    else:
+        return []
+
+def parse_1337x(soup, base_url, deadline=None):
     """Parse 1337x search results"""
+    deadline = deadline or Deadline()
     results = []
     try:
         logger.info("Parsing 1337x search results")
@@ -265,6 +513,10 @@ def parse_1337x(soup, base_url):
         logger.info(f"Found {len(rows)} rows in 1337x table")
         
         for row in rows[:15]:  # Limit to first 15 results
+            if deadline.expired():
+                logger.warning(f"Deadline reached, returning {len(results)} partial results from 1337x")
+                break
+            
             try:
                 cells = row.find_all('td')
                 if len(cells) < 5:
@@ -291,7 +543,7 @@ def parse_1337x(soup, base_url):
                 if not detail_link or not name:
                     continue
                 
-                detail_url = f"https://1337x.to{detail_link['href']}"
+                detail_url = mirror_pool.rewrite_url('1337x', urllib.parse.urljoin(base_url, detail_link['href']))
                 
                 # Extract other details
                 seeders = seeders_cell.get_text(strip=True) if seeders_cell else '0'
@@ -308,7 +560,7 @@ def parse_1337x(soup, base_url):
                     leechers = 0
                 
                 # Try to extract magnet link from detail page
-                magnet = extract_1337x_magnet(detail_url)
+                magnet = extract_1337x_magnet(detail_url, deadline)
                 
                 if magnet:
                     results.append({
@@ -333,8 +585,9 @@ def parse_1337x(soup, base_url):
     logger.info(f"Successfully parsed {len(results)} results from 1337x")
     return results
 
-def parse_gog_games(soup, base_url):
+def parse_gog_games(soup, base_url, deadline=None):
     """Parse GOG Games search results"""
+    deadline = deadline or Deadline()
     results = []
     try:
         logger.info("Parsing GOG Games search results")
@@ -351,6 +604,10 @@ def parse_gog_games(soup, base_url):
         logger.info(f"Found {len(game_items)} potential game items on GOG Games")
         
         for item in game_items[:10]:  # Limit to first 10 results
+            if deadline.expired():
+                logger.warning(f"Deadline reached, returning {len(results)} partial results from GOG Games")
+                break
+            
             try:
                 # Try different ways to find the title and link
                 title_elem = None
@@ -387,17 +644,14 @@ def parse_gog_games(soup, base_url):
                 # Clean up the name
                 name = name.replace('Download', '').replace('Free', '').strip()
                 
-                # Ensure we have a full URL
+                # Ensure we have a full URL on the fastest mirror
                 if link_url:
-                    if link_url.startswith('/'):
-                        link_url = f"https://gog-games.to{link_url}"
-                    elif not link_url.startswith('http'):
-                        link_url = f"https://gog-games.to/{link_url}"
+                    link_url = mirror_pool.rewrite_url('gog-games', urllib.parse.urljoin(base_url, link_url))
                 
                 # Try to extract magnet from the post/detail page
                 magnet = None
                 if link_url:
-                    magnet = extract_gog_magnet(link_url)
+                    magnet = extract_gog_magnet(link_url, deadline)
                 
                 # If we found a magnet, add the result
                 if magnet:
@@ -423,8 +677,9 @@ def parse_gog_games(soup, base_url):
     logger.info(f"Successfully parsed {len(results)} results from GOG Games")
     return results
 
-def parse_fitgirl(soup, base_url):
+def parse_fitgirl(soup, base_url, deadline=None):
     """Parse FitGirl Repacks search results"""
+    deadline = deadline or Deadline()
     results = []
     try:
         logger.info("Parsing FitGirl Repacks search results")
@@ -443,6 +698,10 @@ def parse_fitgirl(soup, base_url):
         logger.info(f"Found {len(posts)} potential posts on FitGirl")
         
         for post in posts[:8]:  # Limit to first 8 results
+            if deadline.expired():
+                logger.warning(f"Deadline reached, returning {len(results)} partial results from FitGirl")
+                break
+            
             try:
                 # Find title and link
                 title_elem = None
@@ -481,17 +740,14 @@ def parse_fitgirl(soup, base_url):
                 if any(skip in name.lower() for skip in ['page', 'comment', 'reply', 'search']):
                     continue
                 
-                # Ensure full URL
+                # Ensure full URL on the fastest mirror
                 if post_url:
-                    if post_url.startswith('/'):
-                        post_url = f"https://fitgirl-repacks.site{post_url}"
-                    elif not post_url.startswith('http'):
-                        post_url = f"https://fitgirl-repacks.site/{post_url}"
+                    post_url = mirror_pool.rewrite_url('fitgirl', urllib.parse.urljoin(base_url, post_url))
                 
                 # Try to extract magnet from post content
                 magnet = None
                 if post_url:
-                    magnet = extract_fitgirl_magnet(post_url)
+                    magnet = extract_fitgirl_magnet(post_url, deadline)
                 
                 # Also try to find magnet in current page content
                 if not magnet:
@@ -522,8 +778,9 @@ def parse_fitgirl(soup, base_url):
     logger.info(f"Successfully parsed {len(results)} results from FitGirl")
     return results
 
-def parse_steamrip(soup, base_url):
+def parse_steamrip(soup, base_url, deadline=None):
     """Parse SteamRIP search results"""
+    deadline = deadline or Deadline()
     results = []
     try:
         logger.info("Parsing SteamRIP search results")
@@ -542,6 +799,10 @@ def parse_steamrip(soup, base_url):
         logger.info(f"Found {len(game_posts)} potential posts on SteamRIP")
         
         for post in game_posts[:8]:  # Limit to first 8 results
+            if deadline.expired():
+                logger.warning(f"Deadline reached, returning {len(results)} partial results from SteamRIP")
+                break
+            
             try:
                 # Find title and link
                 title_elem = None
@@ -580,17 +841,14 @@ def parse_steamrip(soup, base_url):
                 if any(skip in name.lower() for skip in ['page', 'comment', 'reply', 'search', 'home']):
                     continue
                 
-                # Ensure full URL
+                # Ensure full URL on the fastest mirror
                 if post_url:
-                    if post_url.startswith('/'):
-                        post_url = f"https://steamrip.com{post_url}"
-                    elif not post_url.startswith('http'):
-                        post_url = f"https://steamrip.com/{post_url}"
+                    post_url = mirror_pool.rewrite_url('steamrip', urllib.parse.urljoin(base_url, post_url))
                 
                 # Try to extract magnet from post
                 magnet = None
                 if post_url:
-                    magnet = extract_steamrip_magnet(post_url)
+                    magnet = extract_steamrip_magnet(post_url, deadline)
                 
                 # Also try to find magnet in current page content
                 if not magnet:
@@ -622,8 +880,9 @@ def parse_steamrip(soup, base_url):
     return results
 
 # Helper functions for magnet extraction
-def extract_1337x_magnet(detail_url):
+def extract_1337x_magnet(detail_url, deadline=None):
     """Extract magnet link from 1337x detail page"""
+    deadline = deadline or Deadline()
     try:
         import requests
         from bs4 import BeautifulSoup
@@ -634,14 +893,14 @@ def extract_1337x_magnet(detail_url):
         
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Referer': 'https://1337x.to/',
+            'Referer': urllib.parse.urljoin(detail_url, '/'),
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
         }
         
         # Add delay to avoid being blocked
-        time.sleep(2)
+        deadline.sleep(2)
         
-        response = requests.get(detail_url, headers=headers, timeout=10)
+        response = mirror_pool.get('1337x', detail_url, headers=headers, timeout=deadline.timeout(10))
         response.raise_for_status()
         
         # Method 1: Look for magnet link in HTML
@@ -682,12 +941,16 @@ def extract_1337x_magnet(detail_url):
         logger.warning(f"No magnet found for 1337x URL: {detail_url}")
         return None
         
+    except DeadlineExceeded:
+        logger.warning(f"Deadline reached before extracting 1337x magnet from {detail_url}")
+        return None
     except Exception as e:
         logger.error(f"Error extracting 1337x magnet from {detail_url}: {e}")
         return None
 
-def extract_gog_magnet(detail_url):
+def extract_gog_magnet(detail_url, deadline=None):
     """Extract magnet from GOG Games detail page"""
+    deadline = deadline or Deadline()
     try:
         import requests
         from bs4 import BeautifulSoup
@@ -704,9 +967,9 @@ def extract_gog_magnet(detail_url):
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
         }
         
-        time.sleep(1)
+        deadline.sleep(1)
         
-        response = requests.get(detail_url, headers=headers, timeout=10)
+        response = mirror_pool.get('gog-games', detail_url, headers=headers, timeout=deadline.timeout(10))
         response.raise_for_status()
         
         # Method 1: Direct regex search
@@ -741,12 +1004,16 @@ def extract_gog_magnet(detail_url):
         logger.warning(f"No magnet found for GOG Games URL: {detail_url}")
         return None
         
+    except DeadlineExceeded:
+        logger.warning(f"Deadline reached before extracting GOG magnet from {detail_url}")
+        return None
     except Exception as e:
         logger.error(f"Error extracting GOG magnet from {detail_url}: {e}")
         return None
 
-def extract_fitgirl_magnet(detail_url):
+def extract_fitgirl_magnet(detail_url, deadline=None):
     """Extract magnet from FitGirl post"""
+    deadline = deadline or Deadline()
     try:
         import requests
         from bs4 import BeautifulSoup
@@ -763,9 +1030,9 @@ def extract_fitgirl_magnet(detail_url):
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
         }
         
-        time.sleep(1)
+        deadline.sleep(1)
         
-        response = requests.get(detail_url, headers=headers, timeout=10)
+        response = mirror_pool.get('fitgirl', detail_url, headers=headers, timeout=deadline.timeout(10))
         response.raise_for_status()
         
         # Method 1: Direct regex search
@@ -801,12 +1068,16 @@ def extract_fitgirl_magnet(detail_url):
         logger.warning(f"No magnet found for FitGirl URL: {detail_url}")
         return None
         
+    except DeadlineExceeded:
+        logger.warning(f"Deadline reached before extracting FitGirl magnet from {detail_url}")
+        return None
     except Exception as e:
         logger.error(f"Error extracting FitGirl magnet from {detail_url}: {e}")
         return None
 
-def extract_steamrip_magnet(detail_url):
+def extract_steamrip_magnet(detail_url, deadline=None):
     """Extract magnet from SteamRIP post"""
+    deadline = deadline or Deadline()
     try:
         import requests
         from bs4 import BeautifulSoup
@@ -823,9 +1094,9 @@ def extract_steamrip_magnet(detail_url):
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
         }
         
-        time.sleep(1)
+        deadline.sleep(1)
         
-        response = requests.get(detail_url, headers=headers, timeout=10)
+        response = mirror_pool.get('steamrip', detail_url, headers=headers, timeout=deadline.timeout(10))
         response.raise_for_status()
         
         # Method 1: Direct regex search
@@ -868,6 +1139,9 @@ def extract_steamrip_magnet(detail_url):
         logger.warning(f"No magnet found for SteamRIP URL: {detail_url}")
         return None
         
+    except DeadlineExceeded:
+        logger.warning(f"Deadline reached before extracting SteamRIP magnet from {detail_url}")
+        return None
     except Exception as e:
         logger.error(f"Error extracting SteamRIP magnet from {detail_url}: {e}")
         return None
@@ -893,8 +1167,15 @@ def extract_hash_from_magnet(magnet_link):
         logger.error(f"Error extracting hash from magnet: {e}")
         return None
 
-def search_torrents_json_api(query, search_url):
-    """Search torrents using JSON API (for PirateBay)"""
+def search_torrents_json_api(query, search_url, limit=JSON_API_PAGE_SIZE, offset=0, site='piratebay', deadline=None,
+                             trial=None):
+    """Search torrents using JSON API (for PirateBay)
+
+    The response is decoded incrementally: filler rows are skipped unparsed,
+    the first `offset` results are skipped unparsed, and reading stops once
+    `limit` results are collected. Returns `(results, has_more)`.
+    """
+    deadline = deadline or Deadline()
     import requests
     import time
     
@@ -907,15 +1188,20 @@ def search_torrents_json_api(query, search_url):
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        response = requests.get(formatted_url, headers=headers, timeout=10)
-        response.raise_for_status()
+        timeout = deadline.timeout(10)
+        with site_health.track(site, deadline, trial), SCRAPE_FETCH_SECONDS.labels(site).time(), \
+                requests.get(formatted_url, headers=headers, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            data, has_more = decode_json_array(
+                response.iter_content(chunk_size=16384),
+                limit=limit, offset=offset, skip=is_placeholder_row
+            )
         
-        data = response.json()
         results = []
         
         # PirateBay API response format
         if isinstance(data, list):
-            for item in data[:20]:  # Limit to 20 results
+            for item in data:
                 try:
                     if item.get('name') and item.get('info_hash'):
                         # Convert size from bytes to human readable
@@ -945,11 +1231,11 @@ def search_torrents_json_api(query, search_url):
                     continue
         
         logger.info(f"Successfully parsed {len(results)} results from JSON API")
-        return results
+        return results, has_more
         
     except Exception as e:
         logger.error(f"JSON API search error: {e}")
-        return []
+        return [], False
 
 def format_size_bytes(size_bytes):
     """Convert bytes to human readable format"""
@@ -1022,7 +1308,9 @@ def validate_info_hash(info_hash):
     try:
         import re
         # Should be 32 or 40 character hex string
-        return bool(re.match(r'^[a-fA-F0-9]{32}$|^[a-fA-F0-9]{40}
+        return bool(re.match(r'^[a-fA-F0-9]{32}$|^[a-fA-F0-9]{40}$', info_hash))
+    except:
+        return False
 
 # ============================================================================
 # Downloads & Torrents API
@@ -1041,6 +1329,8 @@ def download_torrent():
     info_hash_or_magnet = data['info_hash'].strip()
     name = data['name'].strip()
     site = data.get('site', 'unknown')
+    # Projected size from the search result; 0 when unknown
+    projected_size = safe_int(data.get('size_bytes'), 0) or parse_size(data.get('size') or '')
     
     # Handle both info hashes and full magnet links
     if info_hash_or_magnet.startswith('magnet:'):
@@ -1052,88 +1342,325 @@ def download_torrent():
             return jsonify({"error": "Invalid info hash format"}), 400
         magnet_link = create_magnet_link(info_hash, name, get_default_trackers())
 
-    download_id = str(int(time.time() * 1000))
+    download_id = uuid.uuid4().hex
+    config = current_app.config.get('TORRENT_CONFIG', {})
+    disk_path = config.get("download_dir", "")
+    on_full = data.get('on_full') or config.get("disk_full_policy", "queue")
 
     try:
-        client = get_transmission_client()
-        if not client:
-            logger.error("[DOWNLOAD] Failed to connect to torrent client")
-            return jsonify({"error": "Failed to connect to torrent client."}), 500
+        # Use the exact same download path that Transmission uses
+        download_path = config.get("transmission_download_dir", "/data/downloads")
+        
+        # Admission control: the download must fit in the volume's headroom
+        allowed, disk = disk_monitor.check(disk_path, projected_size, _committed_bytes())
+        if not allowed:
+            reason = (f"Not enough disk space: needs {format_size(projected_size)}, "
+                      f"{format_size(disk['headroom'])} available")
+            if on_full != 'queue':
+                logger.warning(f"[DOWNLOAD] Rejected {name}: {reason}")
+                return jsonify({"error": reason, "disk": disk}), 507
+            
+            download_store.add(download_id, {
+                "name": name,
+                "info_hash": info_hash,
+                "status": "queued_for_space",
+                "progress": 0,
+                "started_at": time.time(),
+                "started_by": current_user.username,
+                "site": site,
+                "projected_size": projected_size,
+                "waiting_for_space": True,
+                "magnet_link": magnet_link,
+                "download_path": download_path,
+                "disk_path": disk_path
+            })
+            _ensure_space_waiter(disk_path)
+            logger.info(f"[DOWNLOAD] Queued {name} until disk space is free: {reason}")
+            return jsonify({
+                "success": True,
+                "queued": True,
+                "download_id": download_id,
+                "message": f"Queued until enough disk space is free. {reason}",
+                "disk": disk
+            }), 202
 
         logger.info(f"[DOWNLOAD] Created magnet link: {magnet_link[:100]}...")
 
-        # Use the exact same download path that Transmission uses
-        download_path = "/data/downloads"  # This is the path inside Transmission container
-        
-        active_downloads[download_id] = {
+        download_store.add(download_id, {
             "name": name,
             "info_hash": info_hash,
             "status": "starting",
             "progress": 0,
             "started_at": time.time(),
             "started_by": current_user.username,
-            "site": site
-        }
+            "site": site,
+            "projected_size": projected_size,
+            "magnet_link": magnet_link,
+            "download_path": download_path,
+            "disk_path": disk_path
+        })
 
-        download_thread = threading.Thread(
-            target=start_download_thread,
-            args=(client, magnet_link, name, download_id, download_path),
-            daemon=True
-        )
-        download_thread.start()
+        # A fixed pool of workers adds queued torrents to Transmission
+        try:
+            job = download_queue.submit(DownloadJob(download_id, magnet_link, name, download_path, disk_path))
+        except queue.Full as e:
+            download_store.delete(download_id)
+            logger.warning(f"[DOWNLOAD] Refused {name}: {e}")
+            response = jsonify({"error": f"Too many downloads are being added ({e}), try again shortly"})
+            response.headers['Retry-After'] = '30'
+            return response, 503
 
         return jsonify({
             "success": True,
             "download_id": download_id,
-            "message": "Download started"
-        })
+            "job": job.to_dict(),
+            "message": "Download queued"
+        }), 202
 
     except Exception as e:
         logger.error(f"[DOWNLOAD] Download error: {str(e)}")
         return jsonify({"error": f"Failed to start download: {str(e)}"}), 500
 
-def start_download_thread(client, magnet_link, name, download_id, download_path):
-    """Background thread function to handle torrent download"""
+def _add_download(job):
+    """Add a queued download to Transmission (runs in a download queue worker)"""
+    client = get_transmission_client()
+    if not client:
+        raise TransmissionUnavailable("Failed to connect to torrent client")
+    
+    logger.info(f"[QUEUE] Adding {job.name} to {job.download_path}")
+    torrent = client.add_torrent(job.magnet_link, download_dir=job.download_path)
+    download_store.update(job.download_id, torrent_id=torrent.id, status="downloading",
+                          transmission_name=torrent.name)
+    logger.info(f"[QUEUE] Download tracked successfully: {job.download_id}")
+    
+    if job.disk_path:
+        _watch_torrent_size(job.download_id, torrent.id, job.disk_path)
+
+def _download_job_state(job):
+    """Mirror a queue job's state into the download store"""
+    fields = {"job_state": job.state, "attempts": job.attempts, "next_attempt": job.next_attempt}
+    if job.state == 'adding':
+        fields["status"] = "adding"
+    elif job.state == 'failed':
+        fields.update(status="error", error=job.error)
+    download_store.update(job.download_id, **fields)
+
+def _requeue_interrupted(download_id, record):
+    """Queue a download again whose torrent was not added before a restart"""
     try:
-        logger.info(f"[THREAD] Starting download for: {name} to {download_path}")
-        torrent = client.add_torrent(magnet_link, download_dir=download_path)
-        
-        active_downloads[download_id].update({
-            "torrent_id": torrent.id,
-            "status": "downloading",
-            "transmission_name": torrent.name
-        })
-        
-        logger.info(f"[THREAD] Download tracked successfully: {download_id}")
+        download_queue.submit(DownloadJob(download_id, record["magnet_link"], record.get("name", ""),
+                                          record.get("download_path"), record.get("disk_path")))
+    except queue.Full:
+        download_store.update(download_id, status="error", error="Download queue full after restart")
+
+download_queue.handler = _add_download
+download_queue.on_state = _download_job_state
+download_store.on_interrupted = _requeue_interrupted
+
+def _committed_bytes(exclude=None):
+    """Bytes that admitted, unfinished downloads are still expected to write"""
+    committed = 0
+    for download_id, active_download in download_store.items(unfinished=True):
+        if download_id == exclude:
+            continue
+        if active_download.get("waiting_for_space") or active_download.get("status") == "error":
+            continue
+        progress = min(max(active_download.get("progress", 0), 0), 100)
+        committed += int(active_download.get("projected_size", 0) * (100 - progress) / 100)
+    return committed
+
+_size_checks = {}  # download id -> (torrent id, disk path, deadline)
+_size_checks_lock = threading.Lock()
+_size_watcher_thread = None
+
+def _watch_torrent_size(download_id, torrent_id, disk_path):
+    """Re-check admission once the torrent's real size is known from its metadata"""
+    global _size_watcher_thread
+    with _size_checks_lock:
+        _size_checks[download_id] = (torrent_id, disk_path, time.time() + METADATA_WAIT_SECONDS)
+        if _size_watcher_thread is None or not _size_watcher_thread.is_alive():
+            _size_watcher_thread = threading.Thread(target=_size_watcher, name='size-watcher', daemon=True)
+            _size_watcher_thread.start()
+
+def _size_watcher():
+    """Wait for metadata of newly added torrents, one torrent list request for all of them"""
+    while True:
+        time.sleep(2)
+        with _size_checks_lock:
+            if not _size_checks:
+                return
+            pending = dict(_size_checks)
+        client = get_transmission_client()
+        if not client:
+            continue
+        try:
+            sizes = {torrent.id: torrent.size for torrent in client.list_torrents()}
+        except Exception as e:
+            logger.error(f"[DOWNLOAD] Error checking torrent sizes: {e}")
+            continue
+        for download_id, (torrent_id, disk_path, deadline) in pending.items():
+            size = sizes.get(torrent_id)
+            if size or torrent_id not in sizes or time.time() > deadline:
+                with _size_checks_lock:
+                    _size_checks.pop(download_id, None)
+            if size:
+                try:
+                    _check_torrent_size(client, download_id, torrent_id, size, disk_path)
+                except Exception as e:
+                    logger.error(f"[DOWNLOAD] Error checking size of download {download_id}: {e}")
+
+def _check_torrent_size(client, download_id, torrent_id, size, disk_path):
+    """Stop a torrent that turns out not to fit; the space waiter resumes it when room is available"""
+    download = download_store.get(download_id)
+    if download is None or size == download.get("projected_size"):
+        return
+    
+    download_store.update(download_id, projected_size=size)
+    allowed, disk = disk_monitor.check(disk_path, size, _committed_bytes(exclude=download_id))
+    if allowed:
+        return
+    
+    client.stop_torrent(torrent_id)
+    download_store.update(download_id, status="waiting_for_space", waiting_for_space=True)
+    logger.warning(f"[DOWNLOAD] Stopped {download['name']}: needs {format_size(size)}, "
+                   f"{format_size(disk['headroom'])} available")
+    _ensure_space_waiter(disk_path)
+
+_space_waiter_lock = threading.Lock()
+_space_waiter_thread = None
+
+def _ensure_space_waiter(disk_path):
+    """Start the background thread that admits downloads waiting for disk space"""
+    global _space_waiter_thread
+    with _space_waiter_lock:
+        if _space_waiter_thread is None or not _space_waiter_thread.is_alive():
+            _space_waiter_thread = threading.Thread(
+                target=_space_waiter, args=(disk_path,), name='space-waiter', daemon=True
+            )
+            _space_waiter_thread.start()
+
+def _space_waiter(disk_path):
+    """Admit waiting downloads in arrival order as disk space becomes available"""
+    while True:
+        # Records come back in arrival order
+        waiting = [(download_id, download) for download_id, download in download_store.items(unfinished=True)
+                   if download.get("waiting_for_space")]
+        if not waiting:
+            return
+        
+        for download_id, download in waiting:
+            allowed, _ = disk_monitor.check(disk_path, download.get("projected_size", 0), _committed_bytes())
+            if not allowed:
+                break  # keep arrival order: later downloads wait behind this one
+            try:
+                client = get_transmission_client()
+                if not client:
+                    break
+                # Claim the download so a waiter in another process does not start it too
+                if not download_store.update(download_id, expect={"waiting_for_space": True},
+                                             waiting_for_space=False):
+                    continue
+                if download.get("torrent_id") is None:
+                    try:
+                        download_queue.submit(DownloadJob(download_id, download["magnet_link"], download["name"],
+                                                          download["download_path"], disk_path))
+                    except queue.Full:
+                        download_store.update(download_id, waiting_for_space=True)
+                        break
+                    download_store.update(download_id, status="starting")
+                elif client.start_torrent(download["torrent_id"]):
+                    download_store.update(download_id, status="downloading")
+                else:
+                    download_store.update(download_id, waiting_for_space=True)
+                    break
+                logger.info(f"[DOWNLOAD] Disk space available, starting {download['name']}")
+            except Exception as e:
+                logger.error(f"[DOWNLOAD] Error admitting {download['name']}: {e}")
+                break
         
+        time.sleep(disk_monitor.sample_interval)
+
+@api_bp.route('/download/jobs', methods=['GET'])
+@login_required
+def list_download_jobs():
+    """Downloads being added to Transmission by this process, newest first"""
+    return jsonify(download_queue.snapshot())
+
+@api_bp.route('/download/<download_id>', methods=['GET'])
+@login_required
+def get_download(download_id):
+    """State of one download, including its add job (queued, adding, added, failed)"""
+    download = download_store.get(download_id)
+    if download is None:
+        return jsonify({"error": "Download not found"}), 404
+    download.pop("magnet_link", None)
+    return jsonify(dict(download, download_id=download_id))
+
+@api_bp.route('/events', methods=['GET'])
+@login_required
+def stream_events():
+    """Server-Sent Events stream of torrent and file index changes.
+
+    The first event is a snapshot of the current state; after that only
+    changes are sent. Reconnecting browsers send Last-Event-ID (or ?since=)
+    and get just the events they missed. Answers 503 when the stream limit is
+    reached, and clients fall back to polling.
+    """
+    if not live_updates.subscribe():
+        response = jsonify({"error": "Too many live update streams, use polling"})
+        response.headers['Retry-After'] = '60'
+        return response, 503
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    response = Response(live_updates.stream(last_event_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # stop nginx from buffering the stream
+    })
+    # Runs when the server closes the stream, even if it never started
+    response.call_on_close(live_updates.unsubscribe)
+    return response
+
+@api_bp.route('/dashboard', methods=['GET'])
+@login_required
+def get_dashboard():
+    """Torrents, files summary and session stats in one response.
+
+    Pass the "version" of the previous response as ?since= to get only the
+    torrents added, changed or removed since then; files and session are null
+    when unchanged. Versions share the event ids of /events, so clients can
+    switch between polling and the live stream without a full reload.
+    """
+    try:
+        return jsonify(live_updates.dashboard(request.args.get('since')))
     except Exception as e:
-        logger.error(f"[THREAD] Error in download thread: {str(e)}")
-        active_downloads[download_id].update({
-            "status": "error",
-            "error": str(e)
-        })
+        logger.error(f"[API] Error building dashboard: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
 @api_bp.route('/current-torrents', methods=['GET'])
 @login_required
 def get_current_torrents():
-    """Get all current torrents with their progress"""
+    """Get all current torrents with their progress.
+
+    The list comes from the live update hub, which polls Transmission at most
+    once per interval; its version is the ETag.
+    """
     try:
-        client = get_transmission_client()
-        if not client:
+        torrent_list, etag = live_updates.current_torrents()
+        if torrent_list is None:
             return jsonify({"error": "Failed to connect to torrent client"}), 500
-
-        torrents = client.list_torrents()
-        torrent_list = [torrent.to_dict() for torrent in torrents]
         
-        # Sync with active_downloads
+        # Sync with the download store
+        tracked = {download.get("torrent_id"): (download_id, download)
+                   for download_id, download in download_store.items()}
         for torrent in torrent_list:
-            for download_id, active_download in active_downloads.items():
-                if active_download.get("torrent_id") == torrent["id"]:
-                    active_download["progress"] = torrent["progress"]
-                    active_download["status"] = torrent["status"]
+            if torrent["id"] in tracked:
+                download_id, download = tracked[torrent["id"]]
+                # Transmission reports a move as checking; keep showing it as moving
+                if download.get("moving"):
+                    download_store.update(download_id, progress=torrent["progress"])
+                elif (download.get("progress"), download.get("status")) != (torrent["progress"], torrent["status"]):
+                    download_store.update(download_id, progress=torrent["progress"], status=torrent["status"])
         
-        logger.info(f"[API] Returning {len(torrent_list)} torrents")
-        return jsonify({"torrents": torrent_list, "count": len(torrent_list)})
+        return _conditional(etag, lambda: jsonify({"torrents": torrent_list, "count": len(torrent_list)}))
 
     except Exception as e:
         logger.error(f"[API] Error getting current torrents: {str(e)}")
@@ -1152,14 +1679,15 @@ def remove_torrent():
         if not client:
             return jsonify({"error": "Failed to connect to torrent client"}), 500
             
+        # Its records are matched by hash, which outlives Transmission restarts
+        try:
+            info_hash = client.get_torrent(data['torrent_id']).hash_string
+        except Exception:
+            info_hash = None
         success = client.remove_torrent(data['torrent_id'], delete_data=False)
         
         if success:
-            # Remove from active_downloads
-            for download_id, active_download in list(active_downloads.items()):
-                if active_download.get("torrent_id") == data['torrent_id']:
-                    del active_downloads[download_id]
-                    break
+            download_store.delete_by_hash(info_hash)
                     
             logger.info(f"Torrent {data['torrent_id']} removed by {current_user.username}")
             return jsonify({"success": True})
@@ -1227,48 +1755,141 @@ def pause_torrent():
 @api_bp.route('/files', methods=['GET'])
 @login_required
 def list_files():
-    """List all downloaded files"""
+    """List downloaded files a page at a time from the download directory index
+
+    Query parameters: sort (size, mtime or name), order (asc or desc), limit,
+    cursor (from the previous page's next_cursor), folder (relative folder
+    prefix), q (name substring) and count_only.
+    """
     try:
-        files = []
         config = current_app.config.get('TORRENT_CONFIG', {})
         download_dir = config.get("download_dir", "")
         
         if not os.path.exists(download_dir):
             return jsonify({"files": [], "message": "Download directory not found"})
         
-        for root, dirs, filenames in os.walk(download_dir):
-            # Skip hidden directories and incomplete folders
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d != 'incomplete']
+        sort = request.args.get('sort', 'size')
+        if sort not in SORT_FIELDS:
+            return jsonify({"error": f"Invalid sort field: {sort}"}), 400
+        order = request.args.get('order', 'desc' if SORT_FIELDS[sort] else 'asc')
+        if order not in ('asc', 'desc'):
+            return jsonify({"error": f"Invalid order: {order}"}), 400
+        descending = order == 'desc'
+        
+        folder = request.args.get('folder', '').strip().strip('/')
+        query = request.args.get('q', '').strip()
+        limit = min(max(safe_int(request.args.get('limit', FILES_PAGE_SIZE), FILES_PAGE_SIZE), 1), FILES_MAX_PAGE_SIZE)
+        after = None
+        if request.args.get('cursor'):
+            try:
+                after = decode_cursor(request.args['cursor'], sort, descending)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        index = get_file_index(download_dir)
+        
+        def build():
+            # Count-only mode: no file entries at all. Unfiltered totals come
+            # from the index's maintained aggregates instead of a scan
+            if folder or query:
+                total, total_bytes = index.count(folder, query)
+            else:
+                total, total_bytes = index.totals()
+            summary = {
+                "total": total,
+                "total_size": format_size(total_bytes),
+                "total_size_bytes": total_bytes,
+                "version": index.version
+            }
+            if request.args.get('count_only', '').lower() in ('1', 'true', 'yes'):
+                return jsonify(summary)
             
-            for filename in filenames:
-                if filename.startswith('.') or filename == 'Thumbs.db' or filename.endswith('.part'):
-                    continue
-                    
-                filepath = os.path.join(root, filename)
-                relative_path = os.path.relpath(filepath, download_dir)
-                
-                try:
-                    stat = os.stat(filepath)
-                    files.append({
-                        "name": filename,
-                        "path": relative_path,
-                        "size": format_size(stat.st_size),
-                        "size_bytes": stat.st_size,
-                        "modified": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stat.st_mtime)),
-                        "folder": os.path.dirname(relative_path) if os.path.dirname(relative_path) else "/"
-                    })
-                except OSError:
-                    continue
+            files, next_key = index.page(sort, descending, after, limit, folder, query)
+            
+            return jsonify(dict(
+                summary,
+                files=files,
+                count=len(files),
+                sort=sort,
+                order=order,
+                next_cursor=encode_cursor(sort, descending, next_key) if next_key else None
+            ))
+        
+        # The index version changes with any file; the query string picks the page
+        query_tag = hashlib.sha1(request.query_string).hexdigest()[:12]
+        return _conditional(f"files-{index.version}-{query_tag}", build)
         
-        # Sort by modification time, newest first
-        files.sort(key=lambda x: x['size_bytes'], reverse=True)
+    except Exception as e:
+        logger.error(f"Error listing files: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/files/tree', methods=['GET'])
+@login_required
+def files_tree():
+    """Folder tree with total size, file count and newest mtime per folder
+
+    Query parameters: path (relative folder to start from, default the
+    download directory) and depth (levels of children to include).
+    """
+    try:
+        config = current_app.config.get('TORRENT_CONFIG', {})
+        download_dir = config.get("download_dir", "")
+        
+        if not os.path.exists(download_dir):
+            return jsonify({"error": "Download directory not found"}), 404
         
-        return jsonify({"files": files, "count": len(files)})
+        path = os.path.normpath(request.args.get('path', '').strip().strip('/') or '.')
+        if path == '.':
+            path = ''
+        if path.startswith('..'):
+            return jsonify({"error": "Invalid folder path"}), 400
+        depth = min(max(safe_int(request.args.get('depth', FILES_TREE_DEPTH), FILES_TREE_DEPTH), 0), FILES_TREE_MAX_DEPTH)
+        
+        index = get_file_index(download_dir)
+        tree = index.tree(path, depth)
+        if tree is None:
+            return jsonify({"error": "Folder not found"}), 404
+        
+        return jsonify({"tree": tree, "depth": depth, "version": index.version})
         
     except Exception as e:
-        logger.error(f"Error listing files: {e}")
+        logger.error(f"Error building file tree: {e}")
         return jsonify({"error": str(e)}), 500
 
+@api_bp.route('/files/duplicates', methods=['GET'])
+@login_required
+def list_duplicates():
+    """Groups of downloaded files with identical content, most wasted space first
+
+    Space can be reclaimed by passing all but one path of a group to
+    /api/files/delete-jobs.
+    """
+    try:
+        config = current_app.config.get('TORRENT_CONFIG', {})
+        download_dir = config.get("download_dir", "")
+        
+        if not os.path.exists(download_dir):
+            return jsonify({"error": "Download directory not found"}), 404
+        
+        return jsonify(get_duplicate_index(get_file_index(download_dir), is_leader()).snapshot())
+        
+    except Exception as e:
+        logger.error(f"Error listing duplicates: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/files/duplicates/scan', methods=['POST'])
+@login_required
+def scan_duplicates():
+    """Start a duplicate scan now instead of waiting for the next interval"""
+    config = current_app.config.get('TORRENT_CONFIG', {})
+    download_dir = config.get("download_dir", "")
+    
+    if not os.path.exists(download_dir):
+        return jsonify({"error": "Download directory not found"}), 404
+    
+    get_duplicate_index(get_file_index(download_dir), is_leader()).request_scan()
+    logger.info(f"Duplicate scan requested by {current_user.username}")
+    return jsonify({"success": True}), 202
+
 @api_bp.route('/files/delete', methods=['POST'])
 @login_required
 def delete_file():
@@ -1293,6 +1914,7 @@ def delete_file():
             
         if os.path.exists(full_path):
             os.remove(full_path)
+            get_file_index(download_dir).refresh(safe_path)
             logger.info(f"File deleted by {current_user.username}: {filepath}")
             return jsonify({"success": True, "message": "File deleted"})
         else:
@@ -1302,315 +1924,191 @@ def delete_file():
         logger.error(f"Error deleting file: {e}")
         return jsonify({"error": str(e)}), 500
 
-# ============================================================================
-# Debug and Utility API
-# ============================================================================
+@api_bp.route('/files/delete-jobs', methods=['POST'])
+@login_required
+def create_delete_job():
+    """Delete many files and/or whole folders in the background
 
-@api_bp.route('/debug/downloads', methods=['GET'])
+    JSON body: paths (list of relative file or folder paths) and
+    remove_torrents (also remove from the client any torrent whose
+    top-level folder or file is being deleted).
+    """
+    try:
+        data = request.json
+        if not data or not isinstance(data.get('paths'), list) or not data['paths']:
+            return jsonify({"error": "paths required"}), 400
+        if len(data['paths']) > DELETE_JOB_MAX_PATHS:
+            return jsonify({"error": f"At most {DELETE_JOB_MAX_PATHS} paths per job"}), 400
+        
+        config = current_app.config.get('TORRENT_CONFIG', {})
+        download_dir = os.path.abspath(config.get("download_dir", ""))
+        
+        paths = []
+        for filepath in data['paths']:
+            safe_path = os.path.normpath(str(filepath)).strip(os.sep)
+            if '..' in safe_path or str(filepath).startswith('/') or safe_path in ('', '.'):
+                return jsonify({"error": f"Invalid path: {filepath}"}), 400
+            if safe_path not in paths:
+                paths.append(safe_path)
+        
+        job = delete_jobs.submit(download_dir, paths, bool(data.get('remove_torrents')), current_user.username)
+        return jsonify({"success": True, "job": job.to_dict()}), 202
+        
+    except Exception as e:
+        logger.error(f"Error creating delete job: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@api_bp.route('/files/delete-jobs', methods=['GET'])
 @login_required
-def debug_downloads():
-    """Debug endpoint to see active downloads"""
-    config = current_app.config.get('TORRENT_CONFIG', {})
-    return jsonify({
-        "active_downloads": active_downloads,
-        "active_downloads_count": len(active_downloads),
-        "timestamp": time.time(),
-        "supported_sites": list(TORRENT_SITES.keys()),
-        "config_paths": {
-            "download_dir": config.get("download_dir", ""),
-            "temp_dir": config.get("temp_dir", "")
-        }
-    })
+def list_delete_jobs():
+    """List recent bulk deletion jobs, newest first"""
+    return jsonify({"jobs": delete_jobs.list()})
 
-@api_bp.route('/sites', methods=['GET'])
+@api_bp.route('/files/delete-jobs/<job_id>', methods=['GET'])
 @login_required
-def get_sites():
-    """Get available torrent sites"""
-    return jsonify({
-        "sites": TORRENT_SITES,
-        "default": "piratebay"
-    })
-, info_hash))
-    except:
-        return False
+def get_delete_job(job_id):
+    """Progress of one bulk deletion job"""
+    job = delete_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@api_bp.route('/files/delete-jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_delete_job(job_id):
+    """Stop a bulk deletion job after the file it is working on"""
+    if not delete_jobs.cancel(job_id):
+        return jsonify({"error": "Job not found or already finished"}), 404
+    logger.info(f"Delete job {job_id} cancelled by {current_user.username}")
+    return jsonify({"success": True})
 
 # ============================================================================
-# Downloads & Torrents API
+# Post-Processing API
 # ============================================================================
 
-@api_bp.route('/download', methods=['POST'])
+@api_bp.route('/postprocess/jobs', methods=['GET'])
 @login_required
-def download_torrent():
-    """Add a torrent for download"""
-    data = request.json
-    logger.info(f"[DOWNLOAD] Received download request: {data}")
-
-    if not data or 'info_hash' not in data or 'name' not in data:
-        return jsonify({"error": "Missing required fields: info_hash and name"}), 400
-
-    info_hash_or_magnet = data['info_hash'].strip()
-    name = data['name'].strip()
-    site = data.get('site', 'unknown')
-    
-    # Handle both info hashes and full magnet links
-    if info_hash_or_magnet.startswith('magnet:'):
-        magnet_link = info_hash_or_magnet
-        info_hash = extract_hash_from_magnet(magnet_link)
-    else:
-        info_hash = info_hash_or_magnet
-        if not validate_info_hash(info_hash):
-            return jsonify({"error": "Invalid info hash format"}), 400
-        magnet_link = create_magnet_link(info_hash, name, get_default_trackers())
-
-    download_id = str(int(time.time() * 1000))
+def list_postprocess_jobs():
+    """Extraction jobs for completed downloads, newest first, with throttle state"""
+    return jsonify(post_processor.snapshot())
 
+@api_bp.route('/postprocess/jobs', methods=['POST'])
+@login_required
+def create_postprocess_job():
+    """Queue extraction of the archives in a downloaded file or folder"""
     try:
-        client = get_transmission_client()
-        if not client:
-            logger.error("[DOWNLOAD] Failed to connect to torrent client")
-            return jsonify({"error": "Failed to connect to torrent client."}), 500
-
-        logger.info(f"[DOWNLOAD] Created magnet link: {magnet_link[:100]}...")
-
-        # Use the exact same download path that Transmission uses
-        download_path = "/data/downloads"  # This is the path inside Transmission container
+        data = request.json
+        if not data or 'path' not in data:
+            return jsonify({"error": "path required"}), 400
         
-        active_downloads[download_id] = {
-            "name": name,
-            "info_hash": info_hash,
-            "status": "starting",
-            "progress": 0,
-            "started_at": time.time(),
-            "started_by": current_user.username,
-            "site": site
-        }
-
-        download_thread = threading.Thread(
-            target=start_download_thread,
-            args=(client, magnet_link, name, download_id, download_path),
-            daemon=True
-        )
-        download_thread.start()
-
-        return jsonify({
-            "success": True,
-            "download_id": download_id,
-            "message": "Download started"
-        })
-
-    except Exception as e:
-        logger.error(f"[DOWNLOAD] Download error: {str(e)}")
-        return jsonify({"error": f"Failed to start download: {str(e)}"}), 500
-
-def start_download_thread(client, magnet_link, name, download_id, download_path):
-    """Background thread function to handle torrent download"""
-    try:
-        logger.info(f"[THREAD] Starting download for: {name} to {download_path}")
-        torrent = client.add_torrent(magnet_link, download_dir=download_path)
+        safe_path = os.path.normpath(str(data['path'])).strip(os.sep)
+        if '..' in safe_path or str(data['path']).startswith('/') or safe_path in ('', '.'):
+            return jsonify({"error": "Invalid path"}), 400
         
-        active_downloads[download_id].update({
-            "torrent_id": torrent.id,
-            "status": "downloading",
-            "transmission_name": torrent.name
-        })
+        config = current_app.config.get('TORRENT_CONFIG', {})
+        if post_processor.root is None:
+            post_processor.root = os.path.abspath(config.get("download_dir", ""))
+        if not os.path.exists(os.path.join(post_processor.root, safe_path)):
+            return jsonify({"error": "Path not found"}), 404
         
-        logger.info(f"[THREAD] Download tracked successfully: {download_id}")
+        jobs = post_processor.enqueue_path(safe_path)
+        if not jobs:
+            return jsonify({"error": "No archives found"}), 404
+        logger.info(f"Extraction of {safe_path} requested by {current_user.username}")
+        return jsonify({"success": True, "jobs": [job.to_dict() for job in jobs]}), 202
         
     except Exception as e:
-        logger.error(f"[THREAD] Error in download thread: {str(e)}")
-        active_downloads[download_id].update({
-            "status": "error",
-            "error": str(e)
-        })
+        logger.error(f"Error creating post-processing job: {e}")
+        return jsonify({"error": str(e)}), 500
 
-@api_bp.route('/current-torrents', methods=['GET'])
+@api_bp.route('/postprocess/jobs/<job_id>/cancel', methods=['POST'])
 @login_required
-def get_current_torrents():
-    """Get all current torrents with their progress"""
-    try:
-        client = get_transmission_client()
-        if not client:
-            return jsonify({"error": "Failed to connect to torrent client"}), 500
-
-        torrents = client.list_torrents()
-        torrent_list = [torrent.to_dict() for torrent in torrents]
-        
-        # Sync with active_downloads
-        for torrent in torrent_list:
-            for download_id, active_download in active_downloads.items():
-                if active_download.get("torrent_id") == torrent["id"]:
-                    active_download["progress"] = torrent["progress"]
-                    active_download["status"] = torrent["status"]
-        
-        logger.info(f"[API] Returning {len(torrent_list)} torrents")
-        return jsonify({"torrents": torrent_list, "count": len(torrent_list)})
+def cancel_postprocess_job(job_id):
+    """Stop an extraction job, removing its partial output"""
+    if not post_processor.cancel(job_id):
+        return jsonify({"error": "Job not found or already finished"}), 404
+    logger.info(f"Extraction job {job_id} cancelled by {current_user.username}")
+    return jsonify({"success": True})
 
-    except Exception as e:
-        logger.error(f"[API] Error getting current torrents: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+# ============================================================================
+# Storage Tiers API
+# ============================================================================
 
-@api_bp.route('/torrent/remove', methods=['POST'])
+@api_bp.route('/storage/moves', methods=['GET'])
 @login_required
-def remove_torrent():
-    """Remove a torrent"""
-    try:
-        data = request.json
-        if not data or 'torrent_id' not in data:
-            return jsonify({"error": "torrent_id required"}), 400
-            
-        client = get_transmission_client()
-        if not client:
-            return jsonify({"error": "Failed to connect to torrent client"}), 500
-            
-        success = client.remove_torrent(data['torrent_id'], delete_data=False)
-        
-        if success:
-            # Remove from active_downloads
-            for download_id, active_download in list(active_downloads.items()):
-                if active_download.get("torrent_id") == data['torrent_id']:
-                    del active_downloads[download_id]
-                    break
-                    
-            logger.info(f"Torrent {data['torrent_id']} removed by {current_user.username}")
-            return jsonify({"success": True})
-        else:
-            return jsonify({"error": "Failed to remove torrent"}), 500
-            
-    except Exception as e:
-        logger.error(f"Error removing torrent: {e}")
-        return jsonify({"error": str(e)}), 500
+def list_storage_moves():
+    """Moves of finished torrents to the library volume, newest first"""
+    return jsonify(storage_mover.snapshot())
 
-@api_bp.route('/torrent/start', methods=['POST'])
+@api_bp.route('/storage/moves', methods=['POST'])
 @login_required
-def start_torrent():
-    """Start a torrent"""
+def create_storage_move():
+    """Move a finished torrent to the library volume now"""
     try:
         data = request.json
         if not data or 'torrent_id' not in data:
             return jsonify({"error": "torrent_id required"}), 400
-            
-        client = get_transmission_client()
-        if not client:
-            return jsonify({"error": "Failed to connect to torrent client"}), 500
-            
-        success = client.start_torrent(data['torrent_id'])
+        if not storage_mover.enabled:
+            return jsonify({"error": "No library volume configured"}), 400
         
-        if success:
-            logger.info(f"Torrent {data['torrent_id']} started by {current_user.username}")
-            return jsonify({"success": True})
-        else:
-            return jsonify({"error": "Failed to start torrent"}), 500
-            
-    except Exception as e:
-        logger.error(f"Error starting torrent: {e}")
-        return jsonify({"error": str(e)}), 500
-
-@api_bp.route('/torrent/pause', methods=['POST'])
-@login_required
-def pause_torrent():
-    """Pause a torrent"""
-    try:
-        data = request.json
-        if not data or 'torrent_id' not in data:
-            return jsonify({"error": "torrent_id required"}), 400
-            
         client = get_transmission_client()
         if not client:
             return jsonify({"error": "Failed to connect to torrent client"}), 500
-            
-        success = client.stop_torrent(data['torrent_id'])
         
-        if success:
-            logger.info(f"Torrent {data['torrent_id']} paused by {current_user.username}")
-            return jsonify({"success": True})
-        else:
-            return jsonify({"error": "Failed to pause torrent"}), 500
-            
+        try:
+            torrent = client.get_torrent(safe_int(data['torrent_id'], -1))
+        except Exception:
+            return jsonify({"error": "Torrent not found"}), 404
+        if torrent.progress < 100:
+            return jsonify({"error": "Torrent is not complete"}), 409
+        if torrent.download_dir.rstrip('/') != storage_mover.remote_root.rstrip('/'):
+            return jsonify({"error": "Torrent is not on the scratch volume"}), 409
+        if _torrent_in_use(torrent):
+            return jsonify({"error": "Torrent files are still being post-processed"}), 409
+        
+        # Renames are handed to Transmission now and tracked in the background,
+        # copies are handed to the workers
+        job = storage_mover.submit(torrent, client=client)
+        logger.info(f"Move of {torrent.name} requested by {current_user.username}")
+        return jsonify({"success": True, "move": job.to_dict()}), 200 if job.finished else 202
+        
     except Exception as e:
-        logger.error(f"Error pausing torrent: {e}")
+        logger.error(f"Error moving torrent: {e}")
         return jsonify({"error": str(e)}), 500
 
 # ============================================================================
-# File Management API
+# Verification API
 # ============================================================================
 
-@api_bp.route('/files', methods=['GET'])
+@api_bp.route('/verify/jobs', methods=['GET'])
 @login_required
-def list_files():
-    """List all downloaded files"""
-    try:
-        files = []
-        config = current_app.config.get('TORRENT_CONFIG', {})
-        download_dir = config.get("download_dir", "")
-        
-        if not os.path.exists(download_dir):
-            return jsonify({"files": [], "message": "Download directory not found"})
-        
-        for root, dirs, filenames in os.walk(download_dir):
-            # Skip hidden directories and incomplete folders
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d != 'incomplete']
-            
-            for filename in filenames:
-                if filename.startswith('.') or filename == 'Thumbs.db' or filename.endswith('.part'):
-                    continue
-                    
-                filepath = os.path.join(root, filename)
-                relative_path = os.path.relpath(filepath, download_dir)
-                
-                try:
-                    stat = os.stat(filepath)
-                    files.append({
-                        "name": filename,
-                        "path": relative_path,
-                        "size": format_size(stat.st_size),
-                        "size_bytes": stat.st_size,
-                        "modified": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stat.st_mtime)),
-                        "folder": os.path.dirname(relative_path) if os.path.dirname(relative_path) else "/"
-                    })
-                except OSError:
-                    continue
-        
-        # Sort by modification time, newest first
-        files.sort(key=lambda x: x['size_bytes'], reverse=True)
-        
-        return jsonify({"files": files, "count": len(files)})
-        
-    except Exception as e:
-        logger.error(f"Error listing files: {e}")
-        return jsonify({"error": str(e)}), 500
+def list_verify_jobs():
+    """Queued, running and finished torrent verifications, newest first"""
+    return jsonify(verify_scheduler.snapshot())
 
-@api_bp.route('/files/delete', methods=['POST'])
+@api_bp.route('/verify/jobs', methods=['POST'])
 @login_required
-def delete_file():
-    """Delete a downloaded file"""
-    try:
-        data = request.json
-        if not data or 'filepath' not in data:
-            return jsonify({"error": "filepath required"}), 400
-            
-        filepath = data['filepath']
-        safe_path = os.path.normpath(filepath)
-        
-        if '..' in safe_path or safe_path.startswith('/'):
-            return jsonify({"error": "Invalid file path"}), 400
-        
-        config = current_app.config.get('TORRENT_CONFIG', {})
-        download_dir = config.get("download_dir", "")
-        full_path = os.path.join(download_dir, safe_path)
-        
-        if not full_path.startswith(os.path.abspath(download_dir)):
-            return jsonify({"error": "Access denied"}), 403
-            
-        if os.path.exists(full_path):
-            os.remove(full_path)
-            logger.info(f"File deleted by {current_user.username}: {filepath}")
-            return jsonify({"success": True, "message": "File deleted"})
-        else:
-            return jsonify({"error": "File not found"}), 404
-            
-    except Exception as e:
-        logger.error(f"Error deleting file: {e}")
-        return jsonify({"error": str(e)}), 500
+def create_verify_job():
+    """Queue a verification of a torrent's data"""
+    data = request.json
+    if not data or 'torrent_id' not in data:
+        return jsonify({"error": "torrent_id required"}), 400
+    
+    torrent_id = safe_int(data['torrent_id'], -1)
+    if torrent_id < 0:
+        return jsonify({"error": "Invalid torrent_id"}), 400
+    job = verify_scheduler.enqueue(torrent_id, str(data.get('name', '')), 'manual')
+    logger.info(f"Verification of torrent {torrent_id} requested by {current_user.username}")
+    return jsonify({"success": True, "job": job.to_dict()}), 202
+
+@api_bp.route('/verify/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_verify_job(job_id):
+    """Drop a queued verification"""
+    if not verify_scheduler.cancel(job_id):
+        return jsonify({"error": "Job not found or already started"}), 404
+    logger.info(f"Verification job {job_id} cancelled by {current_user.username}")
+    return jsonify({"success": True})
 
 # ============================================================================
 # Debug and Utility API
@@ -1622,8 +2120,8 @@ def debug_downloads():
     """Debug endpoint to see active downloads"""
     config = current_app.config.get('TORRENT_CONFIG', {})
     return jsonify({
-        "active_downloads": active_downloads,
-        "active_downloads_count": len(active_downloads),
+        "active_downloads": dict(download_store.items()),
+        "active_downloads_count": len(download_store),
         "timestamp": time.time(),
         "supported_sites": list(TORRENT_SITES.keys()),
         "config_paths": {
@@ -1632,11 +2130,53 @@ def debug_downloads():
         }
     })
 
+@api_bp.route('/debug/profiles', methods=['GET'])
+@login_required
+def list_profiles():
+    """Kept request profiles: slow requests and those profiled on demand (admins only)"""
+    if not is_admin(current_user):
+        return jsonify({"error": "Profiles are only available to admins"}), 403
+    return jsonify({"profiles": profiler.snapshot()})
+
+@api_bp.route('/debug/profiles/<profile_id>', methods=['GET'])
+@login_required
+def download_profile(profile_id):
+    """Download a kept profile as a speedscope JSON or pstats file (admins only)"""
+    if not is_admin(current_user):
+        return jsonify({"error": "Profiles are only available to admins"}), 403
+    exported = profiler.export(profile_id)
+    if exported is None:
+        return jsonify({"error": "Profile not found"}), 404
+    filename, body = exported
+    mimetype = 'application/json' if filename.endswith('.json') else 'application/octet-stream'
+    return Response(body, mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @api_bp.route('/sites', methods=['GET'])
 @login_required
 def get_sites():
-    """Get available torrent sites"""
-    return jsonify({
-        "sites": TORRENT_SITES,
-        "default": "piratebay"
-    })
\ No newline at end of file
+    """Get available torrent sites with their live health status.
+
+    With ?health=0 only the static configuration is returned, which browsers
+    may cache for SITES_MAX_AGE seconds.
+    """
+    if request.args.get('health', '').lower() in ('0', 'false', 'no'):
+        return _conditional(f"sites-{SITES_CONFIG_TAG}",
+                            lambda: jsonify({"sites": TORRENT_SITES, "default": "piratebay"}),
+                            cache_control=f"private, max-age={SITES_MAX_AGE}")
+
+    def build():
+        health = site_health.snapshot()
+        mirror_stats = mirror_pool.snapshot()
+        sites = {}
+        for site_key, site_config in TORRENT_SITES.items():
+            sites[site_key] = dict(
+                site_config,
+                health=health.get(site_key, {}),
+                mirror_stats=mirror_stats.get(site_key, [])
+            )
+        return jsonify({
+            "sites": sites,
+            "default": "piratebay"
+        })
+
+    return _conditional(f"sites-{SITES_CONFIG_TAG}-{site_health.state_version()}-{mirror_pool.version}", build)
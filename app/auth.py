@@ -32,6 +32,20 @@ class UserManager:
     def __init__(self, users_file='users.json'):
         self.users_file = users_file
         self.users = self._load_users()
+        self._mtime = self._file_mtime()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.users_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _reload_if_changed(self):
+        """Pick up users changed by another server process or manage_users.py"""
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self._mtime:
+            self._mtime = mtime
+            self.users = self._load_users()
 
     def _load_users(self):
         """Load users from JSON file"""
@@ -73,18 +87,24 @@ class UserManager:
                     'password_hash': user.password_hash
                 }
                 
-            with open(self.users_file, 'w') as f:
+            # Write a new file and rename it so other processes never read a partial one
+            tmp_file = f"{self.users_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
                 json.dump(users_data, f, indent=2)
+            os.replace(tmp_file, self.users_file)
+            self._mtime = self._file_mtime()
                 
         except Exception as e:
             print(f"Error saving users: {e}")
 
     def get_user(self, username):
         """Get user by username"""
+        self._reload_if_changed()
         return self.users.get(username)
 
     def get_user_by_id(self, user_id):
         """Get user by ID"""
+        self._reload_if_changed()
         for user in self.users.values():
             if user.id == user_id:
                 return user
@@ -0,0 +1,60 @@
+"""
+Request Deadline Module
+A time budget that is passed down through search, scraping and magnet
+extraction so that a single request cannot run for minutes
+"""
+import os
+import time
+
+# Default and maximum overall time budget for a search request, in seconds
+DEFAULT_SEARCH_DEADLINE = float(os.environ.get('SEARCH_DEADLINE_SECONDS', '30'))
+MAX_SEARCH_DEADLINE = float(os.environ.get('SEARCH_MAX_DEADLINE_SECONDS', '120'))
+# Shortest timeout worth starting a network request with
+MIN_REQUEST_TIMEOUT = 0.5
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there is not enough time left to start an operation"""
+
+
+class Deadline:
+    """Absolute deadline for a request; `seconds=None` means no limit"""
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+        # Set once any work was cut short, so callers can flag partial results
+        self.exceeded = False
+
+    @classmethod
+    def from_param(cls, value):
+        """Build a deadline from a query parameter, falling back to the server default"""
+        try:
+            seconds = float(value) if value not in (None, '') else DEFAULT_SEARCH_DEADLINE
+        except (TypeError, ValueError):
+            seconds = DEFAULT_SEARCH_DEADLINE
+        return cls(min(max(seconds, 1.0), MAX_SEARCH_DEADLINE))
+
+    def remaining(self):
+        """Seconds left before the deadline (infinite without a limit)"""
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        """Check whether the deadline has passed, remembering that it did"""
+        if self.remaining() <= 0:
+            self.exceeded = True
+        return self.exceeded
+
+    def timeout(self, cap):
+        """Network timeout for the next request: `cap` bounded by the time left"""
+        remaining = self.remaining()
+        if remaining < MIN_REQUEST_TIMEOUT:
+            self.exceeded = True
+            raise DeadlineExceeded("Request deadline exceeded")
+        return min(cap, remaining)
+
+    def sleep(self, seconds):
+        """Sleep for up to `seconds` without running past the deadline"""
+        time.sleep(max(0.0, min(seconds, self.remaining())))
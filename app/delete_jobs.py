@@ -0,0 +1,286 @@
+"""
+Bulk Deletion Jobs Module
+Deletes many files or whole folders in a background worker with progress
+reporting. Deletion is throttled and large files are shrunk in steps before
+being unlinked, so freeing space does not starve Transmission's disk writes.
+"""
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    from .utils import lower_thread_priority
+except ImportError:
+    from utils import lower_thread_priority
+
+logger = logging.getLogger(__name__)
+
+# Maximum files unlinked per second
+DELETE_FILES_PER_SECOND = float(os.environ.get('DELETE_FILES_PER_SECOND', '200'))
+# Maximum bytes freed per second (0 = unlimited)
+DELETE_BYTES_PER_SECOND = float(os.environ.get('DELETE_BYTES_PER_SECOND', str(512 * 1024 * 1024)))
+# Files larger than this are truncated step by step before the final unlink
+TRUNCATE_STEP = int(os.environ.get('DELETE_TRUNCATE_STEP', str(256 * 1024 * 1024)))
+# Finished jobs kept for status queries
+FINISHED_JOBS_KEPT = 50
+# Errors kept per job
+MAX_JOB_ERRORS = 20
+
+
+class Throttle:
+    """Paces operations so that neither the file rate nor the byte rate is exceeded"""
+
+    def __init__(self, files_per_second, bytes_per_second):
+        self.files_per_second = files_per_second
+        self.bytes_per_second = bytes_per_second
+        self.started = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+
+    def wait(self, files=0, nbytes=0, stop=None):
+        """Account for work just done and sleep until the rates allow more"""
+        self.files += files
+        self.bytes += nbytes
+        earliest = self.started
+        if self.files_per_second > 0:
+            earliest = max(earliest, self.started + self.files / self.files_per_second)
+        if self.bytes_per_second > 0:
+            earliest = max(earliest, self.started + self.bytes / self.bytes_per_second)
+        delay = earliest - time.monotonic()
+        if delay > 0:
+            if stop is not None:
+                stop.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+class DeleteJob:
+    """A bulk deletion request and its progress"""
+
+    def __init__(self, root, paths, remove_torrents=False, user=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.root = root
+        self.paths = paths
+        self.remove_torrents = remove_torrents
+        self.user = user
+        self.status = 'queued'
+        self.total_files = 0
+        self.deleted_files = 0
+        self.total_bytes = 0
+        self.deleted_bytes = 0
+        self.removed_dirs = 0
+        self.removed_torrents = []
+        self.errors = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = threading.Event()
+
+    def add_error(self, path, error):
+        logger.warning(f"[DELETE] {path}: {error}")
+        if len(self.errors) < MAX_JOB_ERRORS:
+            self.errors.append({"path": path, "error": str(error)})
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            "id": self.id,
+            "status": self.status,
+            "paths": self.paths,
+            "remove_torrents": self.remove_torrents,
+            "user": self.user,
+            "total_files": self.total_files,
+            "deleted_files": self.deleted_files,
+            "total_bytes": self.total_bytes,
+            "deleted_bytes": self.deleted_bytes,
+            "removed_dirs": self.removed_dirs,
+            "removed_torrents": self.removed_torrents,
+            "progress": round(self.deleted_files * 100 / self.total_files, 1) if self.total_files else
+                        (100.0 if self.status == 'completed' else 0.0),
+            "errors": self.errors,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+
+class DeleteJobManager:
+    """Runs deletion jobs one at a time in a background thread"""
+
+    def __init__(self, files_per_second=DELETE_FILES_PER_SECOND, bytes_per_second=DELETE_BYTES_PER_SECOND):
+        self.files_per_second = files_per_second
+        self.bytes_per_second = bytes_per_second
+        self.jobs = OrderedDict()   # job id -> DeleteJob, oldest first
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        # Hooks set by the web app: torrent client factory, torrent removal
+        # callback (called with the info hash) and file index refresh
+        self.client_factory = None
+        self.on_torrent_removed = None
+        self.on_path_deleted = None
+
+    def submit(self, root, paths, remove_torrents=False, user=None):
+        """Queue a deletion of relative paths (files or folders) below `root`"""
+        job = DeleteJob(root, paths, remove_torrents, user)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='delete-jobs', daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        logger.info(f"[DELETE] Job {job.id} queued by {user}: {len(paths)} paths")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.to_dict() for job in reversed(self.jobs.values())]
+
+    def cancel(self, job_id):
+        """Ask a queued or running job to stop after the current file"""
+        job = self.get(job_id)
+        if job is None or job.status not in ('queued', 'running'):
+            return False
+        job.cancelled.set()
+        return True
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond the retention limit (lock held)"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[job_id]
+
+    def _run(self):
+        lower_thread_priority(nice=False)
+        while True:
+            job = self._queue.get()
+            try:
+                self._execute(job)
+            except Exception as e:
+                job.add_error('', e)
+                job.status = 'failed'
+                logger.error(f"[DELETE] Job {job.id} failed: {e}")
+            finally:
+                job.finished = time.time()
+                with self.lock:
+                    self._prune()
+
+    def _plan(self, job):
+        """Expand the job's paths into files (with sizes) and directories, deepest first"""
+        files = []
+        dirs = []
+        for relpath in job.paths:
+            full_path = os.path.join(job.root, relpath)
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                for dirpath, dirnames, filenames in os.walk(full_path, topdown=False):
+                    # Symlinks to directories are listed with the directories
+                    # (and not followed); they are unlinked like files
+                    links = [name for name in dirnames if os.path.islink(os.path.join(dirpath, name))]
+                    for name in filenames + links:
+                        path = os.path.join(dirpath, name)
+                        try:
+                            files.append((path, os.lstat(path).st_size))
+                        except OSError as e:
+                            job.add_error(os.path.relpath(path, job.root), e)
+                    dirs.append(dirpath)
+            elif os.path.lexists(full_path):
+                files.append((full_path, os.lstat(full_path).st_size))
+            else:
+                job.add_error(relpath, "Not found")
+        return files, dirs
+
+    def _remove_torrents(self, job):
+        """Remove torrents whose data is being deleted, keeping their data for us to delete"""
+        client = self.client_factory() if self.client_factory else None
+        if not client:
+            job.add_error('', "Failed to connect to torrent client")
+            return
+        # A torrent's name is its top-level file or folder below the download
+        # dir; deleting only part of a torrent leaves the torrent alone
+        top_level = {relpath for relpath in job.paths if os.sep not in relpath}
+        for torrent in client.list_torrents():
+            if torrent.name in top_level:
+                if client.remove_torrent(torrent.id, delete_data=False):
+                    job.removed_torrents.append({"id": torrent.id, "name": torrent.name})
+                    if self.on_torrent_removed:
+                        self.on_torrent_removed(torrent.hash_string)
+
+    def _delete_file(self, job, path, size, throttle):
+        """Unlink one file, truncating large files gradually first"""
+        try:
+            stat = os.lstat(path)
+            # Truncating a hard-linked file would destroy the other links' data
+            if stat.st_nlink == 1 and size > TRUNCATE_STEP and not os.path.islink(path):
+                with open(path, 'r+b') as f:
+                    remaining = size
+                    while remaining > TRUNCATE_STEP and not job.cancelled.is_set():
+                        remaining -= TRUNCATE_STEP
+                        f.truncate(remaining)
+                        job.deleted_bytes += TRUNCATE_STEP
+                        throttle.wait(nbytes=TRUNCATE_STEP, stop=job.cancelled)
+                    if job.cancelled.is_set():
+                        return
+                size = remaining
+            os.unlink(path)
+            job.deleted_files += 1
+            job.deleted_bytes += size
+            throttle.wait(files=1, nbytes=size, stop=job.cancelled)
+        except FileNotFoundError:
+            job.deleted_files += 1
+        except OSError as e:
+            job.add_error(os.path.relpath(path, job.root), e)
+
+    def _execute(self, job):
+        if job.cancelled.is_set():
+            job.status = 'cancelled'
+            return
+        job.status = 'running'
+        job.started = time.time()
+
+        files, dirs = self._plan(job)
+        job.total_files = len(files)
+        job.total_bytes = sum(size for _, size in files)
+
+        if job.remove_torrents:
+            try:
+                self._remove_torrents(job)
+            except Exception as e:
+                job.add_error('', f"Torrent removal failed: {e}")
+
+        throttle = Throttle(self.files_per_second, self.bytes_per_second)
+        for path, size in files:
+            if job.cancelled.is_set():
+                break
+            self._delete_file(job, path, size, throttle)
+
+        if not job.cancelled.is_set():
+            for dirpath in dirs:
+                try:
+                    os.rmdir(dirpath)
+                    job.removed_dirs += 1
+                except OSError as e:
+                    job.add_error(os.path.relpath(dirpath, job.root), e)
+
+        if self.on_path_deleted:
+            for relpath in job.paths:
+                self.on_path_deleted(job.root, relpath)
+
+        if job.cancelled.is_set():
+            job.status = 'cancelled'
+        else:
+            job.status = 'completed_with_errors' if job.errors else 'completed'
+        logger.info(f"[DELETE] Job {job.id} {job.status}: {job.deleted_files}/{job.total_files} files, "
+                    f"{job.removed_dirs} folders, {len(job.removed_torrents)} torrents removed")
+
+
+# Global deletion job manager
+delete_jobs = DeleteJobManager()
@@ -0,0 +1,86 @@
+"""
+Disk Space Module
+Samples free space on the download volume (cached statvfs) and decides
+whether a new download fits in the remaining headroom
+"""
+import os
+import time
+import threading
+
+try:
+    from .metrics import count_cache
+except ImportError:
+    from metrics import count_cache
+
+# Seconds a statvfs sample stays valid
+DISK_SAMPLE_INTERVAL = float(os.environ.get('DISK_SAMPLE_INTERVAL', '5'))
+# Space that must stay free after all admitted downloads complete
+DISK_MIN_FREE_BYTES = int(float(os.environ.get('DISK_MIN_FREE_GB', '5')) * 1024 ** 3)
+DISK_MIN_FREE_PERCENT = float(os.environ.get('DISK_MIN_FREE_PERCENT', '2'))
+
+
+class DiskSpaceMonitor:
+    """Cached free-space samples and admission decisions for download volumes"""
+
+    def __init__(self, sample_interval=DISK_SAMPLE_INTERVAL, min_free_bytes=DISK_MIN_FREE_BYTES,
+                 min_free_percent=DISK_MIN_FREE_PERCENT):
+        self.sample_interval = sample_interval
+        self.min_free_bytes = min_free_bytes
+        self.min_free_percent = min_free_percent
+        self.lock = threading.Lock()
+        self._samples = {}  # path -> (sampled_at, usage dict)
+
+    def usage(self, path):
+        """Total, used and free (available to unprivileged users) bytes of a volume"""
+        now = time.monotonic()
+        with self.lock:
+            sample = self._samples.get(path)
+            fresh = sample is not None and now - sample[0] < self.sample_interval
+        count_cache('disk_usage', fresh)
+        if fresh:
+            return sample[1]
+        st = os.statvfs(path)
+        usage = {
+            "total": st.f_blocks * st.f_frsize,
+            "free": st.f_bavail * st.f_frsize,
+            "used": (st.f_blocks - st.f_bfree) * st.f_frsize
+        }
+        with self.lock:
+            self._samples[path] = (now, usage)
+        return usage
+
+    def invalidate(self, path=None):
+        """Force a fresh sample, e.g. after freeing space"""
+        with self.lock:
+            if path is None:
+                self._samples.clear()
+            else:
+                self._samples.pop(path, None)
+
+    def reserve(self, total):
+        """Bytes that must remain free on a volume of the given size"""
+        return max(self.min_free_bytes, int(total * self.min_free_percent / 100))
+
+    def check(self, path, projected_size, committed=0):
+        """Decide whether a download of `projected_size` bytes fits.
+
+        `committed` is what already admitted downloads still have to write.
+        An unknown size (0) is admitted while any headroom is left, so it can
+        be re-checked once the torrent metadata is known. Returns
+        `(allowed, details)`.
+        """
+        usage = self.usage(path)
+        reserve = self.reserve(usage["total"])
+        headroom = usage["free"] - committed - reserve
+        allowed = headroom > 0 and projected_size <= headroom
+        return allowed, dict(
+            usage,
+            reserve=reserve,
+            committed=committed,
+            headroom=max(headroom, 0),
+            projected=projected_size
+        )
+
+
+# Global disk space monitor instance
+disk_monitor = DiskSpaceMonitor()
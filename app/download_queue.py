@@ -0,0 +1,202 @@
+"""
+Download Queue Module
+Adds torrents to Transmission from a fixed pool of worker threads. New
+downloads are queued up to a limit (callers get backpressure beyond it) and
+adds that fail because Transmission is unreachable are retried with
+exponential backoff.
+"""
+import os
+import time
+import heapq
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    from .transmission_client import TransmissionUnavailable
+    from .metrics import DOWNLOAD_QUEUE_JOBS
+except ImportError:
+    from transmission_client import TransmissionUnavailable
+    from metrics import DOWNLOAD_QUEUE_JOBS
+
+logger = logging.getLogger(__name__)
+
+# Threads adding torrents to Transmission
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '4'))
+# Jobs waiting to be added before new downloads are refused
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get('DOWNLOAD_QUEUE_SIZE', '500'))
+# Attempts per job while Transmission is unreachable
+DOWNLOAD_RETRY_LIMIT = int(os.environ.get('DOWNLOAD_RETRY_LIMIT', '6'))
+# Delay before the first retry; doubled for each further one up to the maximum
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 120.0
+# Finished jobs kept for status queries
+FINISHED_JOBS_KEPT = 200
+
+
+class DownloadJob:
+    """Adding one download to Transmission"""
+
+    def __init__(self, download_id, magnet_link, name, download_path, disk_path=None):
+        self.download_id = download_id
+        self.magnet_link = magnet_link
+        self.name = name
+        self.download_path = download_path
+        self.disk_path = disk_path
+        self.state = 'queued'       # queued, adding, added, failed
+        self.attempts = 0
+        self.error = None
+        self.next_attempt = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            "download_id": self.download_id,
+            "name": self.name,
+            "state": self.state,
+            "attempts": self.attempts,
+            "error": self.error,
+            "next_attempt": self.next_attempt,
+            "created": self.created,
+            "finished": self.finished
+        }
+
+
+class DownloadQueue:
+    """Bounded queue of downloads served by a fixed worker pool"""
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, max_queued=DOWNLOAD_QUEUE_SIZE):
+        self.workers = max(workers, 1)
+        self.max_queued = max_queued
+        self.jobs = OrderedDict()   # download id -> DownloadJob, oldest first
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._delayed = []          # heap of (due time, sequence, job) waiting for a retry
+        self._delayed_ready = threading.Condition(self.lock)
+        self._sequence = 0
+        self._threads = []
+        # Hooks set by the web app: `handler(job)` adds the torrent, raising
+        # TransmissionUnavailable for retryable failures; `on_state(job)` is
+        # called after every state change
+        self.handler = None
+        self.on_state = None
+
+    def submit(self, job):
+        """Queue a job; raises queue.Full when too many are already waiting"""
+        with self.lock:
+            waiting = sum(1 for j in self.jobs.values() if j.state in ('queued', 'adding'))
+            if waiting >= self.max_queued:
+                raise queue.Full(f"{waiting} downloads are already queued")
+            self.jobs.pop(job.download_id, None)
+            self.jobs[job.download_id] = job
+            self._prune()
+            self._ensure_workers()
+        self._queue.put(job)
+        self._notify(job)
+        return job
+
+    def get(self, download_id):
+        with self.lock:
+            return self.jobs.get(download_id)
+
+    def snapshot(self):
+        with self.lock:
+            jobs = [job.to_dict() for job in reversed(self.jobs.values())]
+        counts = {state: sum(1 for job in jobs if job["state"] == state)
+                  for state in ('queued', 'adding', 'added', 'failed')}
+        return {
+            "jobs": jobs,
+            "counts": counts,
+            "workers": self.workers,
+            "max_queued": self.max_queued
+        }
+
+    def depth(self):
+        """Number of jobs per state, keyed for the queue depth gauge"""
+        with self.lock:
+            states = [job.state for job in self.jobs.values()]
+        return {(state,): states.count(state) for state in ('queued', 'adding', 'added', 'failed')}
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond the retention limit (lock held)"""
+        finished = [download_id for download_id, job in self.jobs.items() if job.finished]
+        for download_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[download_id]
+
+    def _ensure_workers(self):
+        """Start the worker pool and retry timer on first use (lock held)"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'download-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._release_delayed, name='download-retry', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _notify(self, job):
+        if self.on_state:
+            try:
+                self.on_state(job)
+            except Exception as e:
+                logger.error(f"[QUEUE] State update for {job.name} failed: {e}")
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.state = 'adding'
+            job.attempts += 1
+            job.next_attempt = None
+            self._notify(job)
+            try:
+                self.handler(job)
+                job.state = 'added'
+                job.error = None
+            except TransmissionUnavailable as e:
+                job.error = str(e)
+                if job.attempts < DOWNLOAD_RETRY_LIMIT:
+                    delay = min(RETRY_BASE_DELAY * 2 ** (job.attempts - 1), RETRY_MAX_DELAY)
+                    job.state = 'queued'
+                    job.next_attempt = time.time() + delay
+                    self._retry_later(job)
+                    logger.warning(f"[QUEUE] Adding {job.name} failed (attempt {job.attempts}), "
+                                   f"retrying in {delay:.0f}s: {e}")
+                else:
+                    job.state = 'failed'
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+            if job.state in ('added', 'failed'):
+                job.finished = time.time()
+                if job.state == 'failed':
+                    logger.error(f"[QUEUE] Adding {job.name} failed after {job.attempts} attempts: {job.error}")
+            self._notify(job)
+
+    def _retry_later(self, job):
+        with self.lock:
+            self._sequence += 1
+            heapq.heappush(self._delayed, (job.next_attempt, self._sequence, job))
+            self._delayed_ready.notify()
+
+    def _release_delayed(self):
+        """Move jobs whose backoff has expired back onto the queue"""
+        with self.lock:
+            while True:
+                if not self._delayed:
+                    self._delayed_ready.wait()
+                    continue
+                due = self._delayed[0][0] - time.time()
+                if due > 0:
+                    self._delayed_ready.wait(due)
+                    continue
+                _, _, job = heapq.heappop(self._delayed)
+                self._queue.put(job)
+
+
+# Global download queue instance
+download_queue = DownloadQueue()
+DOWNLOAD_QUEUE_JOBS.function = download_queue.depth
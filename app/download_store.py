@@ -0,0 +1,262 @@
+"""
+Download Store Module
+Tracks downloads started through the web app in SQLite (WAL mode), so the
+records survive restarts and are shared by all server processes. Finished
+records expire after a TTL, and the store is reconciled against
+Transmission's torrent list on startup and then periodically.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Hours finished downloads stay listed before they are evicted
+DOWNLOAD_HISTORY_TTL = float(os.environ.get('DOWNLOAD_HISTORY_TTL_HOURS', '72')) * 3600
+# Seconds between syncs with Transmission (progress, removed torrents, eviction)
+DOWNLOAD_SYNC_INTERVAL = float(os.environ.get('DOWNLOAD_SYNC_INTERVAL', '60'))
+# Seconds to wait for another process's write lock
+BUSY_TIMEOUT = 30
+
+# Statuses after which a record only remains as history
+FINISHED_STATUSES = ('seeding', 'completed', 'error', 'removed', 'move_failed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    id TEXT PRIMARY KEY,
+    info_hash TEXT,
+    torrent_id INTEGER,
+    status TEXT,
+    started_at REAL,
+    finished_at REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS downloads_info_hash ON downloads (info_hash);
+CREATE INDEX IF NOT EXISTS downloads_torrent_id ON downloads (torrent_id);
+CREATE INDEX IF NOT EXISTS downloads_finished_at ON downloads (finished_at);
+"""
+
+
+class DownloadStore:
+    """SQLite-backed map of download id -> download record (a JSON object)"""
+
+    def __init__(self):
+        self.path = None
+        self.on_waiting = None      # (record) called for records still waiting for space after a restart
+        self.on_interrupted = None  # (download id, record) called for records whose torrent was never added
+        self._local = threading.local()
+        self._thread = None
+
+    def open(self, path):
+        """Create the database if needed; connections are opened per thread"""
+        self.path = path
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return _Transaction(db)
+
+    # ------------------------------------------------------------------
+    # Records
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _columns(record):
+        status = record.get("status")
+        finished = record.get("progress", 0) >= 100 or status in FINISHED_STATUSES
+        return (
+            (record.get("info_hash") or '').lower() or None,
+            record.get("torrent_id"),
+            status,
+            record.get("started_at"),
+            record.get("finished_at") or (time.time() if finished else None)
+        )
+
+    def add(self, download_id, record):
+        with self._connect() as db:
+            db.execute("INSERT INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (download_id, *self._columns(record), json.dumps(record)))
+
+    def get(self, download_id):
+        with self._connect() as db:
+            row = db.execute("SELECT data FROM downloads WHERE id = ?", (download_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, download_id, expect=None, **fields):
+        """Merge fields into a record; with `expect`, only if those fields still match.
+
+        Returns whether the record was updated. The read and write happen in one
+        write transaction, so concurrent updates from other processes are not lost.
+        """
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT data, finished_at FROM downloads WHERE id = ?", (download_id,)).fetchone()
+            if row is None:
+                return False
+            record = json.loads(row[0])
+            if expect and any(record.get(key) != value for key, value in expect.items()):
+                return False
+            record.update(fields)
+            record["finished_at"] = record.get("finished_at") or row[1]
+            columns = self._columns(record)
+            record["finished_at"] = columns[4]
+            db.execute("UPDATE downloads SET info_hash = ?, torrent_id = ?, status = ?, started_at = ?, "
+                       "finished_at = ?, data = ? WHERE id = ?",
+                       (*columns, json.dumps(record), download_id))
+            return True
+
+    def update_by_hash(self, info_hash, **fields):
+        """Update every record of a torrent.
+
+        Torrents are matched by info hash, since Transmission numbers them
+        anew each time it starts.
+        """
+        for download_id in self.ids_for_hash(info_hash):
+            self.update(download_id, **fields)
+
+    def ids_for_hash(self, info_hash):
+        with self._connect() as db:
+            return [row[0] for row in db.execute("SELECT id FROM downloads WHERE info_hash = ?",
+                                                 ((info_hash or '').lower(),))]
+
+    def find_by_hash(self, info_hash):
+        """Records for an info hash, newest first"""
+        with self._connect() as db:
+            rows = db.execute("SELECT id, data FROM downloads WHERE info_hash = ? ORDER BY started_at DESC",
+                              ((info_hash or '').lower(),)).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def delete(self, download_id):
+        with self._connect() as db:
+            db.execute("DELETE FROM downloads WHERE id = ?", (download_id,))
+
+    def delete_by_hash(self, info_hash):
+        with self._connect() as db:
+            db.execute("DELETE FROM downloads WHERE info_hash = ?", ((info_hash or '').lower(),))
+
+    def items(self, unfinished=False):
+        """All (download id, record) pairs in start order"""
+        query = "SELECT id, data FROM downloads"
+        if unfinished:
+            query += " WHERE finished_at IS NULL"
+        with self._connect() as db:
+            rows = db.execute(query + " ORDER BY started_at").fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+    def __len__(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def evict(self, ttl=DOWNLOAD_HISTORY_TTL):
+        """Delete records finished more than `ttl` seconds ago; returns how many"""
+        with self._connect() as db:
+            return db.execute("DELETE FROM downloads WHERE finished_at < ?", (time.time() - ttl,)).rowcount
+
+    # ------------------------------------------------------------------
+    # Reconciliation with Transmission
+    # ------------------------------------------------------------------
+
+    def reconcile(self, torrents, startup=False):
+        """Bring records in line with Transmission's torrent list.
+
+        Records are matched to torrents by info hash (torrent ids change when
+        Transmission restarts, so they are refreshed from the match). Progress
+        and status are copied from the torrent, records whose torrent is gone
+        are marked removed, and on startup records interrupted before their
+        torrent was added are matched by info hash or queued again.
+        """
+        by_id = {torrent.id: torrent for torrent in torrents}
+        by_hash = {torrent.hash_string.lower(): torrent for torrent in torrents if torrent.hash_string}
+        changed = 0
+        for download_id, record in self.items():
+            torrent_id = record.get("torrent_id")
+            if record.get("status") in ('error', 'removed'):
+                continue
+            if torrent_id is None:
+                if record.get("waiting_for_space"):
+                    if startup and self.on_waiting:
+                        self.on_waiting(record)
+                    continue
+                torrent = by_hash.get((record.get("info_hash") or '').lower())
+                if torrent is not None:
+                    self.update(download_id, torrent_id=torrent.id, transmission_name=torrent.name,
+                                progress=torrent.progress, status=torrent.status)
+                    changed += 1
+                elif startup and record.get("magnet_link") and self.on_interrupted:
+                    self.on_interrupted(download_id, record)
+                    changed += 1
+                elif startup:
+                    self.update(download_id, status="error", error="Interrupted by a restart before the torrent was added")
+                    changed += 1
+                continue
+
+            info_hash = (record.get("info_hash") or '').lower()
+            torrent = by_hash.get(info_hash) if info_hash else by_id.get(torrent_id)
+            if torrent is None:
+                self.update(download_id, status="removed", moving=False)
+                changed += 1
+                continue
+
+            fields = {"torrent_id": torrent.id} if torrent.id != torrent_id else {}
+            if record.get("moving") and startup:
+                # A move cut short by the restart; the storage mover retries it
+                fields.update(moving=False, progress=torrent.progress, status=torrent.status)
+            elif record.get("waiting_for_space"):
+                if startup and self.on_waiting:
+                    self.on_waiting(record)
+            elif not record.get("moving") and (record.get("progress"), record.get("status")) != (torrent.progress, torrent.status):
+                fields.update(progress=torrent.progress, status=torrent.status)
+            if fields:
+                self.update(download_id, **fields)
+                changed += 1
+        return changed
+
+    def start(self, client_factory):
+        """Reconcile now, then keep syncing and evicting in the background"""
+        self._thread = threading.Thread(target=self._run, args=(client_factory,), name='download-store', daemon=True)
+        self._thread.start()
+
+    def _run(self, client_factory):
+        startup = True
+        while True:
+            try:
+                client = client_factory()
+                if client:
+                    changed = self.reconcile(client.list_torrents(), startup)
+                    if startup:
+                        logger.info(f"[DOWNLOADS] Reconciled {changed} tracked downloads with Transmission")
+                    startup = False
+                evicted = self.evict()
+                if evicted:
+                    logger.info(f"[DOWNLOADS] Evicted {evicted} finished downloads")
+            except Exception as e:
+                logger.error(f"[DOWNLOADS] Sync failed: {e}")
+            time.sleep(DOWNLOAD_SYNC_INTERVAL)
+
+
+class _Transaction:
+    """Context manager that commits or rolls back an explicit transaction"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.db.in_transaction:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# Global download store instance
+download_store = DownloadStore()
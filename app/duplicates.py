@@ -0,0 +1,256 @@
+"""
+Duplicate Detection Module
+Finds files with identical content in the download directory. Candidates
+are narrowed by size, then by a hash of the first and last blocks, and only
+the remaining ones are fully hashed. Digests are cached by (inode, size,
+mtime) and persisted, so each file is read at most once while it is unchanged.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .utils import format_size, lower_thread_priority
+    from .metrics import count_cache
+except ImportError:
+    from utils import format_size, lower_thread_priority
+    from metrics import count_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for index changes that need a new pass
+DUPLICATE_SCAN_INTERVAL = float(os.environ.get('DUPLICATE_SCAN_INTERVAL', '300'))
+# Files smaller than this are not worth deduplicating
+DUPLICATE_MIN_SIZE = int(os.environ.get('DUPLICATE_MIN_SIZE', str(1024 * 1024)))
+# Hashing threads; they run with idle I/O and lowest CPU priority
+DUPLICATE_HASH_WORKERS = int(os.environ.get('DUPLICATE_HASH_WORKERS', '2'))
+# Files modified more recently than this may still be written to
+SETTLE_SECONDS = 60
+# Bytes hashed from each end of a file for the partial hash
+PARTIAL_BLOCK = 64 * 1024
+# Read buffer for full hashes
+READ_BUFFER = 8 * 1024 * 1024
+# Cache file inside the download directory (hidden, so not indexed)
+CACHE_FILE = '.duplicate-hashes.json'
+
+
+def partial_hash(path, size):
+    """Hash of the first and last blocks of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_BLOCK))
+        if size > PARTIAL_BLOCK:
+            f.seek(max(PARTIAL_BLOCK, size - PARTIAL_BLOCK))
+            digest.update(f.read(PARTIAL_BLOCK))
+    return digest.hexdigest()
+
+
+def full_hash(path):
+    """Hash of a whole file, read into one reused large buffer"""
+    digest = hashlib.blake2b()
+    buffer = bytearray(READ_BUFFER)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])  # hashlib releases the GIL for large updates
+    return digest.hexdigest()
+
+
+class DuplicateIndex:
+    """Background hasher over a FileIndex that groups files with identical content"""
+
+    def __init__(self, file_index, workers=DUPLICATE_HASH_WORKERS, min_size=DUPLICATE_MIN_SIZE):
+        self.file_index = file_index
+        self.workers = max(workers, 1)
+        self.min_size = min_size
+        self.cache_path = os.path.join(file_index.root, CACHE_FILE)
+        self.lock = threading.Lock()
+        self.digests = {}        # (inode, size, mtime) -> {"partial": ..., "full": ...}
+        self.groups = []
+        self.scanned_version = -1
+        self.last_scan = None
+        self.scanning = False
+        self.progress = {"hashed": 0, "candidates": 0}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._load_cache()
+
+    # ------------------------------------------------------------------
+    # Digest cache
+    # ------------------------------------------------------------------
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                records = json.load(f)
+            self.digests = {(r[0], r[1], r[2]): {"partial": r[3], "full": r[4]} for r in records}
+            logger.info(f"[DUPES] Loaded {len(self.digests)} cached digests")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, IndexError, TypeError) as e:
+            logger.warning(f"[DUPES] Ignoring unreadable digest cache: {e}")
+
+    def _save_cache(self):
+        with self.lock:
+            records = [[key[0], key[1], key[2], d.get("partial"), d.get("full")] for key, d in self.digests.items()]
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(records, f, separators=(',', ':'))
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"[DUPES] Cannot save digest cache: {e}")
+
+    # ------------------------------------------------------------------
+    # Hashing pipeline
+    # ------------------------------------------------------------------
+
+    def _digest(self, entry, kind):
+        key = (entry.inode, entry.size, entry.mtime)
+        with self.lock:
+            cached = self.digests.get(key, {}).get(kind)
+        count_cache('duplicate_digests', bool(cached))
+        if cached:
+            return cached
+        path = os.path.join(self.file_index.root, entry.path)
+        try:
+            value = partial_hash(path, entry.size) if kind == 'partial' else full_hash(path)
+        except OSError as e:
+            logger.warning(f"[DUPES] Cannot hash {entry.path}: {e}")
+            return None
+        with self.lock:
+            self.digests.setdefault(key, {})[kind] = value
+            self.progress["hashed"] += 1
+        return value
+
+    def _refine(self, executor, groups, kind):
+        """Split candidate groups by a digest, keeping groups that still have several inodes"""
+        candidates = [entry for group in groups for entry in group]
+        with self.lock:
+            self.progress["candidates"] = len(candidates)
+        refined = defaultdict(list)
+        for entry, value in zip(candidates, executor.map(lambda e: self._digest(e, kind), candidates)):
+            if value is not None:
+                refined[(entry.size, value)].append(entry)
+        return [group for group in refined.values() if len({e.inode for e in group}) > 1]
+
+    def scan(self):
+        """Run one pass over the index and rebuild the duplicate groups"""
+        version = self.file_index.version
+        start = time.time()
+        with self.lock:
+            self.scanning = True
+            self.progress = {"hashed": 0, "candidates": 0}
+        try:
+            with self.file_index.lock:
+                entries = list(self.file_index.entries.values())
+            settled = start - SETTLE_SECONDS
+            by_size = defaultdict(list)
+            for entry in entries:
+                if entry.size >= self.min_size and entry.mtime <= settled:
+                    by_size[entry.size].append(entry)
+            # Hard links share an inode and so take no extra space
+            groups = [group for group in by_size.values() if len({e.inode for e in group}) > 1]
+
+            with ThreadPoolExecutor(self.workers, thread_name_prefix='dupe-hash',
+                                    initializer=lower_thread_priority) as executor:
+                groups = self._refine(executor, groups, 'partial')
+                groups = self._refine(executor, groups, 'full')
+
+            live = {(e.inode, e.size, e.mtime) for e in entries}
+            results = []
+            for group in groups:
+                group.sort(key=lambda e: (e.mtime, e.path))
+                size = group[0].size
+                copies = len({e.inode for e in group})
+                results.append({
+                    "hash": self.digests[(group[0].inode, size, group[0].mtime)]["full"],
+                    "size": format_size(size),
+                    "size_bytes": size,
+                    "count": len(group),
+                    "wasted_bytes": size * (copies - 1),
+                    "files": [e.to_dict() for e in group]
+                })
+            results.sort(key=lambda g: -g["wasted_bytes"])
+
+            with self.lock:
+                # Forget digests of files that no longer exist in that form
+                self.digests = {key: d for key, d in self.digests.items() if key in live}
+                self.groups = results
+                self.scanned_version = version
+                self.last_scan = time.time()
+            self._save_cache()
+            logger.info(f"[DUPES] Found {len(results)} duplicate groups in {time.time() - start:.1f}s "
+                        f"({self.progress['hashed']} files hashed)")
+        finally:
+            with self.lock:
+                self.scanning = False
+
+    # ------------------------------------------------------------------
+    # Background scanning and queries
+    # ------------------------------------------------------------------
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='duplicate-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def request_scan(self):
+        """Start a pass now instead of at the next interval"""
+        self.scanned_version = -1
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.file_index.version != self.scanned_version:
+                try:
+                    self.scan()
+                except Exception as e:
+                    logger.error(f"[DUPES] Scan failed: {e}")
+            self._wakeup.wait(DUPLICATE_SCAN_INTERVAL)
+            self._wakeup.clear()
+
+    def snapshot(self):
+        """Duplicate groups (largest waste first) and scanner status"""
+        with self.lock:
+            return {
+                "groups": self.groups,
+                "group_count": len(self.groups),
+                "wasted_bytes": sum(g["wasted_bytes"] for g in self.groups),
+                "wasted": format_size(sum(g["wasted_bytes"] for g in self.groups)),
+                "scanning": self.scanning,
+                "progress": dict(self.progress),
+                "last_scan": self.last_scan,
+                "stale": self.scanned_version != self.file_index.version
+            }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_duplicate_index(file_index, start=True):
+    """Get the duplicate index for a file index, creating it on first use.
+
+    Only the process running background services passes `start`; others get
+    an idle index so files are not hashed twice.
+    """
+    with _indexes_lock:
+        index = _indexes.get(file_index.root)
+        if index is None:
+            index = _indexes[file_index.root] = DuplicateIndex(file_index)
+        if start and index._thread is None:
+            index.start()
+        return index
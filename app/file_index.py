@@ -0,0 +1,601 @@
+"""
+Download Directory Index Module
+Keeps an in-memory index of the files in the download directory, built once
+and then maintained incrementally from inotify events (Linux) or, where
+inotify is unavailable, by rescanning directories whose mtime changed.
+Per-directory totals are kept alongside so folder sizes need no summing.
+"""
+import os
+import time
+import json
+import base64
+import bisect
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+
+try:
+    from .utils import format_size
+    from .metrics import count_cache
+except ImportError:
+    from utils import format_size
+    from metrics import count_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds between directory mtime checks when inotify is not available
+POLL_INTERVAL = float(os.environ.get('FILE_INDEX_POLL_INTERVAL', '5'))
+# Seconds between full rescans that catch anything the watcher missed
+FULL_RESCAN_INTERVAL = float(os.environ.get('FILE_INDEX_FULL_RESCAN_INTERVAL', '600'))
+# Seconds to let a burst of inotify events settle before applying it
+EVENT_DEBOUNCE = 0.5
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+# Sort orders supported by FileIndex.page(), with their default direction
+SORT_FIELDS = {
+    'size': True,    # largest first
+    'mtime': True,   # newest first
+    'name': False    # A to Z
+}
+
+
+def is_hidden_dir(name):
+    """Directories left out of the index (hidden and Transmission's incomplete dir)"""
+    return name.startswith('.') or name == 'incomplete'
+
+
+def is_hidden_file(name):
+    """Files left out of the index (hidden, thumbnails and partial downloads)"""
+    return name.startswith('.') or name == 'Thumbs.db' or name.endswith('.part')
+
+
+class FileEntry:
+    """A single indexed file"""
+
+    __slots__ = ('path', 'name', 'name_key', 'folder', 'size', 'mtime', 'inode', '_dict')
+
+    def __init__(self, path, size, mtime, inode=0):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.name_key = self.name.lower()
+        self.folder = os.path.dirname(path) or "/"
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self._dict = None
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization (cached)"""
+        if self._dict is None:
+            self._dict = {
+                "name": self.name,
+                "path": self.path,
+                "size": format_size(self.size),
+                "size_bytes": self.size,
+                "modified": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.mtime)),
+                "folder": self.folder
+            }
+        return self._dict
+
+    def sort_key(self, sort):
+        """Key used for a sort order; the path breaks ties so keys are unique"""
+        if sort == 'size':
+            return (self.size, self.path)
+        if sort == 'mtime':
+            return (self.mtime, self.path)
+        return (self.name_key, self.path)
+
+    def in_folder(self, folder):
+        """Check whether the file lies anywhere below a relative folder"""
+        return self.path.startswith(folder + '/')
+
+
+class DirTotals:
+    """Aggregated size, file count and newest mtime of a directory subtree"""
+
+    __slots__ = ('size', 'count', 'newest')
+
+    def __init__(self):
+        self.size = 0
+        self.count = 0
+        self.newest = 0  # None once a removal made it stale
+
+
+def _ancestors(reldir):
+    """A relative directory followed by each of its parents up to the root ('')"""
+    while reldir:
+        yield reldir
+        reldir = os.path.dirname(reldir)
+    yield ''
+
+
+def encode_cursor(sort, descending, key):
+    """Opaque pagination cursor pointing just past the entry with `key`"""
+    raw = json.dumps([sort, descending, list(key)], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort, descending):
+    """Decode a cursor, raising ValueError if it is malformed or for another ordering"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, cursor_descending, key = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or cursor_descending != descending or not isinstance(key, list) or len(key) != 2:
+        raise ValueError("Cursor does not match the requested sort order")
+    return tuple(key)
+
+
+class _Inotify:
+    """Minimal ctypes binding to the Linux inotify API"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """Wait up to `timeout` seconds and return a list of (wd, mask, name)"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileIndex:
+    """In-memory index of the files below a root directory"""
+
+    def __init__(self, root, use_inotify=True):
+        self.root = os.path.abspath(root)
+        self.entries = {}        # relative path -> FileEntry
+        self.dir_mtimes = {}     # relative dir ('' for root) -> st_mtime_ns
+        self.dir_files = {}      # relative dir -> set of file names
+        self.dir_subdirs = {}    # relative dir -> set of subdirectory names
+        self.dir_totals = {}     # relative dir -> DirTotals of its whole subtree
+        self.version = 0
+        self.lock = threading.RLock()
+        self.use_inotify = use_inotify
+        self._inotify = None
+        self._watches = {}       # wd -> relative dir
+        self._watch_by_dir = {}  # relative dir -> wd
+        self._snapshot = (-1, {})
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Building and maintaining the index
+    # ------------------------------------------------------------------
+
+    def _full_path(self, relpath):
+        return os.path.join(self.root, relpath) if relpath else self.root
+
+    def _changed(self):
+        """Bump the version after a modification (lock held)"""
+        self.version += 1
+
+    def _account(self, entry, sign):
+        """Add (sign=1) or subtract (sign=-1) a file in its directories' totals (lock held)"""
+        for reldir in _ancestors(os.path.dirname(entry.path)):
+            totals = self.dir_totals.get(reldir)
+            if totals is None:
+                totals = self.dir_totals[reldir] = DirTotals()
+            totals.size += sign * entry.size
+            totals.count += sign
+            if totals.count <= 0:
+                del self.dir_totals[reldir]
+            elif sign > 0:
+                if totals.newest is not None and entry.mtime > totals.newest:
+                    totals.newest = entry.mtime
+            elif totals.newest is not None and entry.mtime >= totals.newest:
+                # The newest file may be gone; recomputed on the next query
+                totals.newest = None
+
+    def _set_entry(self, relpath, stat):
+        entry = self.entries.get(relpath)
+        if entry and entry.size == stat.st_size and entry.mtime == stat.st_mtime and entry.inode == stat.st_ino:
+            return False
+        if entry:
+            self._account(entry, -1)
+        entry = self.entries[relpath] = FileEntry(relpath, stat.st_size, stat.st_mtime, stat.st_ino)
+        self._account(entry, 1)
+        return True
+
+    def _pop_entry(self, relpath):
+        """Forget a file, returning its entry or None (lock held)"""
+        entry = self.entries.pop(relpath, None)
+        if entry is not None:
+            self._account(entry, -1)
+        return entry
+
+    def _remove_subtree(self, reldir):
+        """Forget a directory and everything below it (lock held)"""
+        for name in self.dir_files.pop(reldir, ()):
+            self._pop_entry(os.path.join(reldir, name))
+        for name in self.dir_subdirs.pop(reldir, ()):
+            self._remove_subtree(os.path.join(reldir, name))
+        self.dir_mtimes.pop(reldir, None)
+        wd = self._watch_by_dir.pop(reldir, None)
+        if wd is not None:
+            self._watches.pop(wd, None)
+            if self._inotify:
+                self._inotify.rm_watch(wd)
+        self._changed()
+
+    def _watch(self, reldir):
+        if not self._inotify or reldir in self._watch_by_dir:
+            return
+        try:
+            wd = self._inotify.add_watch(self._full_path(reldir), WATCH_MASK)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                logger.warning("[FILES] inotify watch limit reached, falling back to mtime polling")
+                self._disable_inotify()
+            return
+        self._watches[wd] = reldir
+        self._watch_by_dir[reldir] = wd
+
+    def _disable_inotify(self):
+        if self._inotify:
+            self._inotify.close()
+        self._inotify = None
+        self._watches.clear()
+        self._watch_by_dir.clear()
+
+    def _scan_dir(self, reldir, recursive):
+        """Bring one directory (and optionally its subtree) up to date"""
+        path = self._full_path(reldir)
+        # Watch before listing so that nothing created in between is missed
+        with self.lock:
+            self._watch(reldir)
+        try:
+            dir_mtime = os.stat(path).st_mtime_ns
+            files = {}
+            subdirs = set()
+            with os.scandir(path) as it:
+                for dirent in it:
+                    try:
+                        if dirent.is_dir(follow_symlinks=False):
+                            if not is_hidden_dir(dirent.name):
+                                subdirs.add(dirent.name)
+                        elif dirent.is_file() and not is_hidden_file(dirent.name):
+                            files[dirent.name] = dirent.stat()
+                    except OSError:
+                        continue
+        except FileNotFoundError:
+            with self.lock:
+                if reldir in self.dir_mtimes:
+                    self._remove_subtree(reldir)
+            return
+        except OSError as e:
+            logger.warning(f"[FILES] Cannot scan {path}: {e}")
+            return
+
+        with self.lock:
+            changed = False
+            old_files = self.dir_files.get(reldir, set())
+            for name in old_files - files.keys():
+                self._pop_entry(os.path.join(reldir, name))
+                changed = True
+            for name, stat in files.items():
+                changed |= self._set_entry(os.path.join(reldir, name), stat)
+            old_subdirs = self.dir_subdirs.get(reldir, set())
+            for name in old_subdirs - subdirs:
+                self._remove_subtree(os.path.join(reldir, name))
+            new_subdirs = subdirs - old_subdirs
+            self.dir_files[reldir] = set(files)
+            self.dir_subdirs[reldir] = subdirs
+            self.dir_mtimes[reldir] = dir_mtime
+            if changed:
+                self._changed()
+
+        for name in (subdirs if recursive else new_subdirs):
+            self._scan_dir(os.path.join(reldir, name), recursive=True)
+
+    def rescan(self):
+        """Walk the whole tree, applying any differences to the index"""
+        start = time.time()
+        self._scan_dir('', recursive=True)
+        logger.info(f"[FILES] Indexed {len(self.entries)} files under {self.root} in {time.time() - start:.2f}s")
+
+    def refresh(self, relpath):
+        """Re-check a single file or directory, e.g. right after changing it"""
+        relpath = os.path.normpath(relpath).lstrip(os.sep)
+        if relpath == '.':
+            relpath = ''
+        path = self._full_path(relpath)
+        parent, name = os.path.split(relpath)
+
+        if os.path.isdir(path):
+            if relpath in self.dir_mtimes:
+                self._scan_dir(relpath, recursive=True)
+            elif parent in self.dir_mtimes:
+                # Rescanning the parent picks up the new directory (unless it is hidden)
+                self._scan_dir(parent, recursive=False)
+            return
+
+        with self.lock:
+            if relpath in self.dir_mtimes:
+                self._remove_subtree(relpath)
+                self.dir_subdirs.get(parent, set()).discard(name)
+                return
+            if parent not in self.dir_mtimes:
+                return
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if self._pop_entry(relpath) is not None:
+                    self.dir_files.get(parent, set()).discard(name)
+                    self._changed()
+                return
+            if is_hidden_file(name) or not os.path.isfile(path):
+                return
+            self.dir_files.setdefault(parent, set()).add(name)
+            if self._set_entry(relpath, stat):
+                self._changed()
+
+    # ------------------------------------------------------------------
+    # Background maintenance
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Build the index and start keeping it current in the background"""
+        if self.use_inotify:
+            try:
+                self._inotify = _Inotify()
+            except Exception as e:
+                logger.info(f"[FILES] inotify unavailable ({e}), using mtime polling")
+                self._inotify = None
+        self.rescan()
+        self._thread = threading.Thread(target=self._run, name='file-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        last_full = time.time()
+        while not self._stop.is_set():
+            try:
+                if self._inotify:
+                    self._process_events()
+                else:
+                    self._stop.wait(POLL_INTERVAL)
+                    self._poll_dirs()
+                if time.time() - last_full >= FULL_RESCAN_INTERVAL:
+                    self.rescan()
+                    last_full = time.time()
+            except Exception as e:
+                logger.error(f"[FILES] Index maintenance error: {e}")
+                self._stop.wait(POLL_INTERVAL)
+
+    def _poll_dirs(self):
+        """Rescan directories whose mtime changed since the last check"""
+        with self.lock:
+            dirs = list(self.dir_mtimes.items())
+        for reldir, mtime in dirs:
+            try:
+                current = os.stat(self._full_path(reldir)).st_mtime_ns
+            except FileNotFoundError:
+                current = None
+            if current != mtime:
+                self._scan_dir(reldir, recursive=False)
+
+    def _process_events(self):
+        events = self._inotify.read_events(timeout=POLL_INTERVAL)
+        if not events:
+            return
+        # Let a burst (e.g. a torrent moving out of incomplete/) settle first
+        time.sleep(EVENT_DEBOUNCE)
+        events.extend(self._inotify.read_events(timeout=0) if self._inotify else [])
+
+        dirty = set()
+        full_rescan = False
+        with self.lock:
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    full_rescan = True
+                    continue
+                reldir = self._watches.get(wd)
+                if reldir is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    self._watch_by_dir.pop(reldir, None)
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF) or not name:
+                    dirty.add(reldir)
+                else:
+                    dirty.add(os.path.join(reldir, name))
+
+        if full_rescan:
+            logger.warning("[FILES] inotify queue overflowed, rescanning")
+            self.rescan()
+            return
+        for relpath in sorted(dirty):
+            self.refresh(relpath)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def files(self):
+        """All indexed files as dictionaries, largest first (cached per version, do not modify)"""
+        _, entries = self.sorted_entries('size')
+        return [entry.to_dict() for entry in reversed(entries)]
+
+    def sorted_entries(self, sort):
+        """Entries in ascending order of a sort key, with the matching key list.
+
+        Both lists are computed once per index version and shared, so callers
+        must not modify them.
+        """
+        with self.lock:
+            if self._snapshot[0] != self.version:
+                self._snapshot = (self.version, {})
+            cache = self._snapshot[1]
+            count_cache('file_index_sort', sort in cache)
+            if sort not in cache:
+                entries = sorted(self.entries.values(), key=lambda e: e.sort_key(sort))
+                cache[sort] = ([entry.sort_key(sort) for entry in entries], entries)
+            return cache[sort]
+
+    def _matching(self, entries, folder, query):
+        """Filter entries by folder prefix and case-insensitive name substring"""
+        if folder:
+            entries = (entry for entry in entries if entry.in_folder(folder))
+        if query:
+            query = query.lower()
+            entries = (entry for entry in entries if query in entry.name_key)
+        return entries
+
+    def page(self, sort='size', descending=True, after=None, limit=100, folder=None, query=None):
+        """One page of files in a stable keyset order.
+
+        `after` is the sort key of the last entry of the previous page. Returns
+        `(files, next_key)`, where `next_key` is None on the last page.
+        """
+        keys, entries = self.sorted_entries(sort)
+        if descending:
+            end = bisect.bisect_left(keys, after) if after else len(keys)
+            candidates = (entries[i] for i in range(end - 1, -1, -1))
+        else:
+            start = bisect.bisect_right(keys, after) if after else 0
+            candidates = (entries[i] for i in range(start, len(entries)))
+
+        page = []
+        for entry in self._matching(candidates, folder, query):
+            if len(page) == limit:
+                return [e.to_dict() for e in page], page[-1].sort_key(sort)
+            page.append(entry)
+        return [e.to_dict() for e in page], None
+
+    def count(self, folder=None, query=None):
+        """Number and total size of the files matching the filters"""
+        _, entries = self.sorted_entries('size')
+        count = 0
+        total = 0
+        for entry in self._matching(entries, folder, query):
+            count += 1
+            total += entry.size
+        return count, total
+
+    def totals(self):
+        """Number and total size of all indexed files, from the maintained aggregates"""
+        with self.lock:
+            totals = self.dir_totals.get('')
+            return (totals.count, totals.size) if totals else (0, 0)
+
+    def folder_entries(self, folder):
+        """Entries anywhere below a relative folder, ordered by path"""
+        _, entries = self.sorted_entries('size')
+        return sorted(self._matching(entries, folder, None), key=lambda entry: entry.path)
+
+    def _newest(self, reldir):
+        """Newest mtime below a directory, recomputing stale totals (lock held)"""
+        totals = self.dir_totals.get(reldir)
+        if totals is None:
+            return 0
+        if totals.newest is None:
+            mtimes = [self.entries[path].mtime
+                      for path in (os.path.join(reldir, name) for name in self.dir_files.get(reldir, ()))
+                      if path in self.entries]
+            mtimes.extend(self._newest(os.path.join(reldir, name)) for name in self.dir_subdirs.get(reldir, ()))
+            totals.newest = max(mtimes, default=0)
+        return totals.newest
+
+    def _tree_node(self, reldir, depth):
+        totals = self.dir_totals.get(reldir) or DirTotals()
+        subdirs = self.dir_subdirs.get(reldir, ())
+        newest = self._newest(reldir)
+        node = {
+            "name": os.path.basename(reldir) or "/",
+            "path": reldir,
+            "size": format_size(totals.size),
+            "size_bytes": totals.size,
+            "file_count": totals.count,
+            "direct_files": len(self.dir_files.get(reldir, ())),
+            "dir_count": len(subdirs),
+            "modified": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(newest)) if newest else None
+        }
+        if depth > 0:
+            children = [self._tree_node(os.path.join(reldir, name), depth - 1) for name in subdirs]
+            children.sort(key=lambda child: (-child["size_bytes"], child["name"]))
+            node["children"] = children
+        return node
+
+    def tree(self, reldir='', depth=1):
+        """Folder tree below a relative directory with aggregated totals per node.
+
+        Only `depth` levels of children are included, so clients expand large
+        trees lazily one subtree at a time. Returns None for unknown folders.
+        """
+        with self.lock:
+            if reldir not in self.dir_mtimes:
+                return None
+            return self._tree_node(reldir, depth)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_file_index(root):
+    """Get the started index for a directory, building it on first use"""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = FileIndex(root)
+            index.start()
+        return index
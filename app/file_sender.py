@@ -0,0 +1,190 @@
+"""
+File Sending Module
+Serves downloaded files with byte ranges, conditional requests and
+zero-copy transfer, or hands the transfer off to a front proxy.
+Whole folders are served as streamed zip archives.
+"""
+import os
+import mimetypes
+import unicodedata
+import urllib.parse
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_date
+from werkzeug.wsgi import FileWrapper
+
+try:
+    from .zip_stream import ZipStream
+except ImportError:
+    from zip_stream import ZipStream
+
+# Read size used when the server cannot send the file itself
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_etag(stat):
+    """Strong validator derived from inode, size and modification time"""
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def content_disposition(download_name):
+    """Content-Disposition value for an attachment, with an RFC 5987 name if needed"""
+    try:
+        download_name.encode('ascii')
+        return 'attachment; filename="{}"'.format(download_name.replace('\\', '\\\\').replace('"', '\\"'))
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        quoted = urllib.parse.quote(download_name, safe="!#$&+^`|~")
+        simple = simple.replace('\\', '\\\\').replace('"', '\\"')
+        return f'attachment; filename="{simple}"; filename*=UTF-8\'\'{quoted}'
+
+
+def _not_modified(etag, mtime):
+    """Evaluate If-None-Match / If-Modified-Since against the current file"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag) or request.if_none_match.star_tag
+    if request.if_modified_since:
+        return int(mtime) <= request.if_modified_since.timestamp()
+    return False
+
+
+def _range_applies(etag, mtime):
+    """A Range header is honoured only if If-Range (when present) still matches"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == f'"{etag}"'
+    date = parse_date(if_range)
+    return date is not None and int(mtime) == int(date.timestamp())
+
+
+def _select_range(size, etag, mtime, headers):
+    """Pick the byte range to send and set Content-Range/Content-Length.
+
+    Returns (status, start, end), or None when the range is unsatisfiable.
+    """
+    start, end = 0, size
+    status = 200
+
+    byte_range = request.range
+    if byte_range and _range_applies(etag, mtime):
+        # Multiple ranges are answered with the whole file, which RFC 9110 allows
+        if len(byte_range.ranges) == 1:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                headers['Content-Range'] = f"bytes */{size}"
+                return None
+            start, end = bounds
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+
+    headers['Content-Length'] = str(end - start)
+    return status, start, end
+
+
+def _iter_range(f, length):
+    """Yield exactly `length` bytes from the current position of an open file"""
+    try:
+        while length > 0:
+            chunk = f.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def send_download(full_path, relative_path, offload=None, accel_prefix='/protected-downloads/'):
+    """Send a file as an attachment.
+
+    `offload` selects who transfers the bytes: None lets this process send
+    them (with single byte ranges, ETag/If-Range, If-None-Match and
+    If-Modified-Since support); 'x-accel-redirect' (nginx) and 'x-sendfile'
+    (Apache, lighttpd) return only headers and let the front proxy serve the
+    file, including ranges.
+    """
+    stat = os.stat(full_path)
+    download_name = os.path.basename(full_path)
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    etag = file_etag(stat)
+
+    headers = {
+        'Content-Disposition': content_disposition(download_name),
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache'
+    }
+
+    if offload == 'x-accel-redirect':
+        headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + urllib.parse.quote(relative_path)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+    if offload == 'x-sendfile':
+        headers['X-Sendfile'] = full_path
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    if _not_modified(etag, stat.st_mtime):
+        return Response(status=304, headers=headers)
+
+    size = stat.st_size
+    selected = _select_range(size, etag, stat.st_mtime, headers)
+    if selected is None:
+        return Response(status=416, headers=headers)
+    status, start, end = selected
+    length = end - start
+
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers, mimetype=mimetype)
+
+    f = open(full_path, 'rb')
+    f.seek(start)
+
+    # The server's file wrapper lets it use sendfile(2) from the current offset.
+    # gunicorn stops at Content-Length, so it can serve ranges that way too;
+    # other servers only get the wrapper when the whole file is sent.
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    server = request.environ.get('SERVER_SOFTWARE', '')
+    if file_wrapper and (end == size or server.startswith('gunicorn')):
+        body = file_wrapper(f, BLOCK_SIZE)
+    elif end == size:
+        body = FileWrapper(f, BLOCK_SIZE)
+    else:
+        body = _iter_range(f, length)
+
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+
+def send_folder_zip(full_path, files):
+    """Send a folder as a zip archive built while it is streamed.
+
+    `files` is a list of (full_path, archive_name). The archive layout is
+    deterministic, so it has a Content-Length, an ETag and supports single
+    byte ranges, letting interrupted downloads resume.
+    """
+    archive = ZipStream(files)
+    download_name = (os.path.basename(full_path.rstrip(os.sep)) or 'downloads') + '.zip'
+    etag = archive.etag
+
+    headers = {
+        'Content-Disposition': content_disposition(download_name),
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(archive.mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache'
+    }
+
+    if _not_modified(etag, archive.mtime):
+        return Response(status=304, headers=headers)
+
+    selected = _select_range(archive.size, etag, archive.mtime, headers)
+    if selected is None:
+        return Response(status=416, headers=headers)
+    status, start, end = selected
+
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers, mimetype='application/zip')
+
+    return Response(archive.iter_bytes(start, end), status=status, headers=headers,
+                    mimetype='application/zip', direct_passthrough=True)
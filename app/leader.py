@@ -0,0 +1,112 @@
+"""
+Background Leader Module
+When the app runs in several server processes, background services (hashing,
+extraction, storage moves, verifications) must run in only one of them. The
+process holding an exclusive lock on a shared file is the leader; the others
+keep trying, so a replacement takes over if the leader exits.
+
+Requests about the state of those services are forwarded by the other
+processes to the leader, which serves the app on a loopback port published
+in the lock file.
+"""
+import os
+import time
+import fcntl
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts of non-leader processes to take over
+LEADER_RETRY_INTERVAL = float(os.environ.get('LEADER_RETRY_INTERVAL', '10'))
+# Seconds a forwarded request may take on the leader
+FORWARD_TIMEOUT = 60
+
+# Request headers not passed on to the leader, and response headers not passed
+# back (the serving process adds its own Date and Server)
+SKIPPED_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'content-encoding',
+                   'host', 'accept-encoding', 'te', 'upgrade', 'date', 'server'}
+
+_lock_path = None
+_lock_file = None  # kept open for the life of the process to hold the lock
+
+
+def _try_lock(lock_path):
+    global _lock_file
+    f = open(lock_path, 'a')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _lock_file = f
+    return True
+
+
+def is_leader():
+    """Whether this process runs the background services"""
+    return _lock_file is not None
+
+
+def run_as_leader(lock_path, start):
+    """Call `start()` now if this process wins the lock, otherwise once it does"""
+    global _lock_path
+    _lock_path = lock_path
+    if _lock_file is not None or _try_lock(lock_path):
+        logger.info(f"[LEADER] Process {os.getpid()} runs the background services")
+        start()
+        return
+
+    def wait_for_lock():
+        while not _try_lock(lock_path):
+            time.sleep(LEADER_RETRY_INTERVAL)
+        logger.info(f"[LEADER] Process {os.getpid()} took over the background services")
+        start()
+
+    threading.Thread(target=wait_for_lock, name='leader-election', daemon=True).start()
+
+
+def serve_followers(app):
+    """Serve a WSGI app on a loopback port for requests forwarded by other processes"""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='leader-server', daemon=True).start()
+    # Published in the lock file, which only the leader writes
+    _lock_file.seek(0)
+    _lock_file.truncate()
+    _lock_file.write(f"http://127.0.0.1:{server.server_port}\n")
+    _lock_file.flush()
+    logger.info(f"[LEADER] Serving forwarded requests on port {server.server_port}")
+
+
+def leader_url():
+    """Base URL of the leader's loopback server, or None while there is none"""
+    if _lock_path is None:
+        return None
+    try:
+        with open(_lock_path) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def forward(request):
+    """Send a Flask request to the leader; returns (body, status, headers) or None if it is unreachable"""
+    base = leader_url()
+    if base is None:
+        return None
+    headers = {name: value for name, value in request.headers.items() if name.lower() not in SKIPPED_HEADERS}
+    headers['Accept-Encoding'] = 'identity'
+    try:
+        response = requests.request(request.method, base + request.full_path.rstrip('?'),
+                                    headers=headers, data=request.get_data(),
+                                    allow_redirects=False, timeout=FORWARD_TIMEOUT)
+    except requests.RequestException as e:
+        logger.warning(f"[LEADER] Cannot forward {request.method} {request.path} to {base}: {e}")
+        return None
+    headers = [(name, value) for name, value in response.raw.headers.iteritems()
+               if name.lower() not in SKIPPED_HEADERS]
+    return response.content, response.status_code, headers
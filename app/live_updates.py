@@ -0,0 +1,312 @@
+"""
+Live Updates Module
+One poller per process watches Transmission and the file index and turns
+changes into numbered events, which are pushed to browsers over Server-Sent
+Events. The poller only runs while someone is listening, reconnecting clients
+resume from the last event id they saw, and idle streams only carry a
+heartbeat comment. Polling clients get the same state from the dashboard,
+as the entries added, changed or removed since the version they last saw.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import deque, OrderedDict
+
+try:
+    from .utils import format_size
+    from .fast_json import dumps
+    from .metrics import count_cache
+except ImportError:
+    from utils import format_size
+    from fast_json import dumps
+    from metrics import count_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds between polls of Transmission while clients are connected
+LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', '2'))
+# Seconds between heartbeats on an idle stream
+LIVE_HEARTBEAT = float(os.environ.get('LIVE_HEARTBEAT', '15'))
+# Open streams per process; each holds a server thread, so keep this below
+# the thread count (further clients fall back to polling)
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', '8'))
+# Events kept for clients resuming after a reconnect, and removed torrents
+# remembered for dashboard deltas
+LIVE_HISTORY = 500
+# Milliseconds browsers wait before reconnecting a dropped stream
+RECONNECT_MS = 3000
+
+
+def format_event(event_id, name, data):
+    """Encode one Server-Sent Event"""
+    return f"id: {event_id}\nevent: {name}\ndata: {dumps(data)}\n\n"
+
+
+class LiveUpdates:
+    """Versioned view of torrents and the file index, shared by all streams"""
+
+    def __init__(self, poll_interval=LIVE_POLL_INTERVAL, max_streams=LIVE_MAX_STREAMS):
+        self.poll_interval = poll_interval
+        self.max_streams = max_streams
+        # Event ids are "<epoch>:<version>"; a new epoch (restart, other
+        # process) makes resuming clients start from a snapshot
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.events = deque(maxlen=LIVE_HISTORY)    # (version, name, data)
+        self.torrents = {}                          # torrent id -> dict
+        self.files = None                           # file index summary
+        self.session = None                         # Transmission session stats
+        # Versions at which each part last changed, for dashboard deltas
+        self.torrent_versions = {}                  # torrent id -> (added, changed)
+        self.removed = OrderedDict()                # torrent id -> version removed
+        self.torrents_version = 0
+        self.files_version = 0
+        self.session_version = 0
+        self.floor = 0                              # older versions get the full state
+        self.connected = False                      # last torrent poll succeeded
+        self.streams = 0
+        self.cond = threading.Condition()
+        self.file_index = None
+        self.client_factory = None
+        self._client = None
+        self._thread = None
+        self._poll_lock = threading.Lock()
+        self._polled = 0
+
+    def configure(self, file_index, client_factory):
+        self.file_index = file_index
+        self.client_factory = client_factory
+
+    # ------------------------------------------------------------------
+    # Polling
+    # ------------------------------------------------------------------
+
+    def _publish(self, name, data):
+        """Record an event and wake all streams (condition held)"""
+        self.version += 1
+        self.events.append((self.version, name, data))
+        self.cond.notify_all()
+
+    def _files_summary(self):
+        total, total_bytes = self.file_index.totals()
+        return {
+            "version": self.file_index.version,
+            "total": total,
+            "total_size": format_size(total_bytes),
+            "total_size_bytes": total_bytes
+        }
+
+    @staticmethod
+    def _session_summary(stats):
+        return {
+            "download_speed": stats.get("downloadSpeed", 0),
+            "upload_speed": stats.get("uploadSpeed", 0),
+            "active_torrents": stats.get("activeTorrentCount", 0),
+            "paused_torrents": stats.get("pausedTorrentCount", 0),
+            "torrent_count": stats.get("torrentCount", 0)
+        }
+
+    def _fetch_transmission(self):
+        """Torrent list and session summary, or (None, None) when Transmission is unreachable"""
+        # Keep one client; creating one costs an extra connection test
+        if self._client is None:
+            self._client = self.client_factory()
+            if self._client is None:
+                return None, None
+        try:
+            return self._client.list_torrents(), self._session_summary(self._client.session_stats())
+        except Exception as e:
+            logger.warning(f"[LIVE] Torrent poll failed: {e}")
+            self._client = None
+            return None, None
+
+    def poll(self, max_age=0):
+        """Compare current state with the last poll and publish what changed.
+
+        With `max_age`, skip the poll if one finished that recently, so
+        concurrent dashboard requests share a single round trip.
+        """
+        with self._poll_lock:
+            recent = time.time() - self._polled < max_age
+            if max_age:
+                count_cache('torrent_poll', recent)
+            if recent:
+                return
+            torrents, session = self._fetch_transmission()
+            files = None
+            if self.file_index is not None and (self.files is None or self.file_index.version != self.files["version"]):
+                files = self._files_summary()
+            with self.cond:
+                self.connected = torrents is not None
+                if torrents is not None:
+                    self._update_torrents({torrent.id: torrent.to_dict() for torrent in torrents})
+                if files is not None:
+                    self.files = files
+                    self._publish('files', files)
+                    self.files_version = self.version
+                if session is not None and session != self.session:
+                    self.session = session
+                    self._publish('session', session)
+                    self.session_version = self.version
+            self._polled = time.time()
+
+    def _update_torrents(self, current):
+        """Publish changed and removed torrents and record their versions (condition held)"""
+        changed = [data for torrent_id, data in current.items() if self.torrents.get(torrent_id) != data]
+        removed = [torrent_id for torrent_id in self.torrents if torrent_id not in current]
+        self.torrents = current
+        if not changed and not removed:
+            return
+        self._publish('torrents', {"changed": changed, "removed": removed})
+        self.torrents_version = self.version
+        for data in changed:
+            added, _ = self.torrent_versions.get(data["id"], (self.version, None))
+            self.torrent_versions[data["id"]] = (added, self.version)
+            self.removed.pop(data["id"], None)
+        for torrent_id in removed:
+            del self.torrent_versions[torrent_id]
+            self.removed[torrent_id] = self.version
+        while len(self.removed) > LIVE_HISTORY:
+            _, self.floor = self.removed.popitem(last=False)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if self.streams == 0:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"[LIVE] Poll failed: {e}")
+            time.sleep(self.poll_interval)
+
+    # ------------------------------------------------------------------
+    # Streams
+    # ------------------------------------------------------------------
+
+    def subscribe(self):
+        """Register a stream, starting the poller; False when the stream limit is reached"""
+        with self.cond:
+            if self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-updates', daemon=True)
+                self._thread.start()
+        return True
+
+    def unsubscribe(self):
+        with self.cond:
+            self.streams -= 1
+
+    def snapshot(self):
+        """Full current state for clients that cannot resume (condition held)"""
+        return {
+            "torrents": list(self.torrents.values()),
+            "files": self.files,
+            "session": self.session
+        }
+
+    def _parse_version(self, token):
+        """Version number of an "<epoch>:<version>" token from this process, or None"""
+        epoch, _, version = (token or '').partition(':')
+        if epoch != self.epoch or not version.isdigit() or int(version) > self.version:
+            return None
+        return int(version)
+
+    def _since(self, last_event_id):
+        """Version to resume after, or None when the client needs a snapshot"""
+        version = self._parse_version(last_event_id)
+        if version is None:
+            return None
+        oldest = self.events[0][0] if self.events else self.version + 1
+        if version < oldest - 1:
+            return None
+        return version
+
+    def stream(self, last_event_id=None):
+        """Generate the event stream of one subscribed client until it disconnects"""
+        yield f"retry: {RECONNECT_MS}\n\n"
+        with self.cond:
+            # A fresh client waits for the first poll instead of an empty snapshot
+            if self.files is None and not self.torrents:
+                self.cond.wait(self.poll_interval * 2)
+            since = self._since(last_event_id)
+            if since is None:
+                since = self.version
+                first = format_event(f"{self.epoch}:{since}", 'snapshot', self.snapshot())
+            else:
+                first = None
+        if first:
+            yield first
+
+        while True:
+            with self.cond:
+                if self.version == since:
+                    self.cond.wait(LIVE_HEARTBEAT)
+                pending = [event for event in self.events if event[0] > since]
+                if pending and pending[0][0] > since + 1:
+                    # Fell behind the history: start over from the current state
+                    since = self.version
+                    pending = []
+                    chunk = format_event(f"{self.epoch}:{since}", 'snapshot', self.snapshot())
+                else:
+                    chunk = ''.join(format_event(f"{self.epoch}:{version}", name, data)
+                                    for version, name, data in pending)
+                    if pending:
+                        since = pending[-1][0]
+            yield chunk or ": ping\n\n"
+
+    # ------------------------------------------------------------------
+    # Dashboard
+    # ------------------------------------------------------------------
+
+    def current_torrents(self):
+        """(torrent dicts, tag of the last torrent change), or (None, None) when Transmission is unreachable"""
+        self.poll(max_age=self.poll_interval)
+        with self.cond:
+            if not self.connected:
+                return None, None
+            return list(self.torrents.values()), f"torrents-{self.epoch}-{self.torrents_version}"
+
+    def dashboard(self, since=None):
+        """Torrents, files summary and session stats changed after version `since`.
+
+        Torrents come as added, changed and removed lists. Without a usable
+        version (none given, another epoch, or older than the remembered
+        removals) everything is returned as added, with "full" set. Files and
+        session are None when they did not change.
+        """
+        self.poll(max_age=self.poll_interval)
+        with self.cond:
+            version = self._parse_version(since)
+            full = version is None or version < self.floor
+            if full:
+                version = -1
+            added, changed = [], []
+            for torrent_id, data in self.torrents.items():
+                added_at, changed_at = self.torrent_versions[torrent_id]
+                if added_at > version:
+                    added.append(data)
+                elif changed_at > version:
+                    changed.append(data)
+            return {
+                "version": f"{self.epoch}:{self.version}",
+                "full": full,
+                "connected": self.connected,
+                "torrents": {
+                    "added": added,
+                    "changed": changed,
+                    "removed": [] if full else [torrent_id for torrent_id, removed_at in self.removed.items()
+                                                if removed_at > version]
+                },
+                "files": self.files if self.files_version > version else None,
+                "session": self.session if self.session_version > version else None
+            }
+
+
+# Global live update hub
+live_updates = LiveUpdates()
@@ -4,14 +4,29 @@ Torrent Search and Download Web Interface with File Browser
 APIs separated into api.py for better organization
 """
 import os
+import time
 import secrets
 import logging
 
-from flask import Flask, request, render_template, redirect, url_for, flash, send_file
+from flask import Flask, Response, request, render_template, redirect, url_for, flash
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 
 from .auth import user_manager
 from .api import api_bp  # Import the API blueprint
+from .file_index import get_file_index
+from .duplicates import get_duplicate_index
+from .post_process import post_processor, POSTPROCESS_ENABLED
+from .storage_mover import storage_mover
+from .verify_scheduler import verify_scheduler
+from .leader import run_as_leader, serve_followers
+from .download_store import download_store
+from .live_updates import live_updates
+from .transmission_client import get_transmission_client
+from .file_sender import send_download, send_folder_zip
+from . import fast_json
+from .compression import compress_response, ENCODINGS
+from .metrics import registry, track_requests, authorized as metrics_authorized
+from .profiling import profile_requests
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -20,6 +35,12 @@ logger = logging.getLogger(__name__)
 # Get paths - Docker environment
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(APP_ROOT)
+# Generated session key used when SECRET_KEY is not set (relative, like users.json)
+SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE', '.secret_key')
+# Lock file in the temp directory held by the process running background services
+BACKGROUND_LOCK_FILE = '.background.lock'
+# Database of downloads started from the web app, in the temp directory
+DOWNLOAD_DB_FILE = 'downloads.db'
 
 def create_app():
     """Application factory function"""
@@ -27,12 +48,31 @@ def create_app():
     # Initialize Flask app with correct template folder
     template_dir = find_template_directory()
     app = Flask(__name__, template_folder=template_dir)
-    app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(16))
+    app.secret_key = load_secret_key()
+    # Encode JSON with orjson when installed, and compress larger text responses
+    if fast_json.ENABLED:
+        app.json = fast_json.OrjsonProvider(app)
+    # Registered first, so its after_request hook also times the compression
+    track_requests(app)
+    # Admin-requested profiles and slow request capture
+    profile_requests(app)
+    app.after_request(compress_response)
 
     # Configuration
     app.config['TORRENT_CONFIG'] = {
         "download_dir": os.path.join(PROJECT_ROOT, "downloads"),
         "temp_dir": os.path.join(PROJECT_ROOT, "temp"),
+        # Let a front proxy send file bytes: '', 'x-accel-redirect' (nginx) or 'x-sendfile'
+        "download_offload": os.environ.get('DOWNLOAD_OFFLOAD', '').lower(),
+        # nginx internal location mapped onto the download directory
+        "download_accel_prefix": os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-downloads/'),
+        # What to do with downloads that do not fit on disk: 'queue' or 'reject'
+        "disk_full_policy": os.environ.get('DISK_FULL_POLICY', 'queue').lower(),
+        # Download directory as mounted in the Transmission container
+        "transmission_download_dir": os.environ.get('TRANSMISSION_DOWNLOAD_DIR', '/data/downloads'),
+        # Subdirectory of the download directory where the bulk library volume is
+        # mounted; finished torrents are moved there ('' disables moving)
+        "library_subdir": os.environ.get('STORAGE_LIBRARY_SUBDIR', '').strip('/'),
         "transmission": {
             "host": os.environ.get('TRANSMISSION_HOST', 'transmission'),
             "port": int(os.environ.get('TRANSMISSION_PORT', '9091')),
@@ -45,6 +85,14 @@ def create_app():
     os.makedirs(app.config['TORRENT_CONFIG']["download_dir"], exist_ok=True)
     os.makedirs(app.config['TORRENT_CONFIG']["temp_dir"], exist_ok=True)
 
+    # Downloads started from the web app, shared by all server processes
+    download_store.open(os.path.join(app.config['TORRENT_CONFIG']["temp_dir"], DOWNLOAD_DB_FILE))
+
+    # Build the download directory index once; it is kept current in the background
+    file_index = get_file_index(app.config['TORRENT_CONFIG']["download_dir"])
+    # Push torrent and file changes to connected browsers (polls only while any are)
+    live_updates.configure(file_index, get_transmission_client)
+
     # Initialize Flask-Login
     login_manager = LoginManager()
     login_manager.init_app(app)
@@ -97,6 +145,13 @@ def create_app():
     def index():
         return render_template('index.html')
 
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus metrics of this process, for logged-in users or the METRICS_TOKEN bearer"""
+        if not current_user.is_authenticated and not metrics_authorized(request.headers.get('Authorization')):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
     # ============================================================================
     # File Download Route (separate from API)
     # ============================================================================
@@ -120,13 +175,55 @@ def create_app():
             if not full_path.startswith(os.path.abspath(app.config['TORRENT_CONFIG']["download_dir"])):
                 return "Access denied", 403
                 
-            logger.info(f"File download requested by {current_user.username}: {filepath}")
-            return send_file(full_path, as_attachment=True)
+            logger.info(f"File download requested by {current_user.username}: {filepath} {request.headers.get('Range', '')}".rstrip())
+            # Supports Range/If-Range and conditional requests, or offloads to the proxy
+            config = app.config['TORRENT_CONFIG']
+            return send_download(
+                full_path, safe_path,
+                offload=config.get("download_offload") or None,
+                accel_prefix=config.get("download_accel_prefix", '/protected-downloads/')
+            )
             
         except Exception as e:
             logger.error(f"Error downloading file {filepath}: {e}")
             return f"Download failed: {str(e)}", 500
 
+    @app.route('/download-folder/<path:folderpath>')
+    @login_required
+    def download_folder(folderpath):
+        """Download a whole folder as a streamed zip archive"""
+        try:
+            safe_path = os.path.normpath(folderpath)
+            if '..' in safe_path or safe_path.startswith('/'):
+                return "Invalid folder path", 400
+
+            download_dir = app.config['TORRENT_CONFIG']["download_dir"]
+            full_path = os.path.join(download_dir, safe_path)
+
+            if not os.path.isdir(full_path):
+                return "Folder not found", 404
+
+            if not full_path.startswith(os.path.abspath(download_dir)):
+                return "Access denied", 403
+
+            entries = get_file_index(download_dir).folder_entries(safe_path)
+            if not entries:
+                return "Folder is empty", 404
+
+            # Archive names keep the folder itself as the top-level directory
+            parent = os.path.dirname(safe_path)
+            files = [
+                (os.path.join(download_dir, entry.path), os.path.relpath(entry.path, parent) if parent else entry.path)
+                for entry in entries
+            ]
+
+            logger.info(f"Folder download requested by {current_user.username}: {folderpath} ({len(files)} files) {request.headers.get('Range', '')}".rstrip())
+            return send_folder_zip(full_path, files)
+
+        except Exception as e:
+            logger.error(f"Error downloading folder {folderpath}: {e}")
+            return f"Download failed: {str(e)}", 500
+
     # ============================================================================
     # Error Handlers
     # ============================================================================
@@ -152,9 +249,56 @@ def create_app():
     logger.info(f"Template folder: {app.template_folder}")
     logger.info(f"Download directory: {app.config['TORRENT_CONFIG']['download_dir']}")
     logger.info(f"Transmission: {app.config['TORRENT_CONFIG']['transmission']['host']}:{app.config['TORRENT_CONFIG']['transmission']['port']}")
+    logger.info(f"JSON encoder: {'orjson' if fast_json.ENABLED else 'json'}, compression: {', '.join(ENCODINGS)}")
+
+    # Background services run in one process when the server runs several; the
+    # others forward requests about them to it, so it starts once routes exist
+    def start_leader():
+        start_background_services(app.config['TORRENT_CONFIG'], file_index)
+        serve_followers(app)
+
+    run_as_leader(os.path.join(app.config['TORRENT_CONFIG']["temp_dir"], BACKGROUND_LOCK_FILE), start_leader)
 
     return app
 
+def start_background_services(config, file_index):
+    """Start the workers that act on downloads outside of requests"""
+    # Reconcile tracked downloads with Transmission, then keep them synced
+    download_store.start(get_transmission_client)
+    # Hash candidate duplicates in the background at low priority
+    get_duplicate_index(file_index)
+    # Extract archives of completed torrents in the background
+    if POSTPROCESS_ENABLED:
+        post_processor.start(config["download_dir"], get_transmission_client)
+    # Move finished torrents from the scratch volume to the library volume
+    if config["library_subdir"]:
+        storage_mover.start(config["download_dir"], config["library_subdir"],
+                            config["transmission_download_dir"], get_transmission_client)
+    # Hand torrent verifications to Transmission one (or a few) at a time
+    verify_scheduler.start(config["download_dir"], get_transmission_client)
+
+def load_secret_key():
+    """SECRET_KEY, or a generated key stored beside users.json and shared by all server processes"""
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    try:
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logger.warning(f"Cannot store secret key, sessions will not survive restarts: {e}")
+        return secrets.token_hex(32)
+    # Another process may have created the file but not written it yet
+    for _ in range(50):
+        with open(SECRET_KEY_FILE) as f:
+            key = f.read().strip()
+        if key:
+            return key
+        time.sleep(0.1)
+    raise RuntimeError(f"Secret key file {SECRET_KEY_FILE} is empty")
+
 def find_template_directory():
     """Find the templates directory"""
     possible_template_dirs = [
@@ -0,0 +1,302 @@
+"""
+Metrics Module
+Prometheus-style counters, gauges and histograms, rendered in the text
+exposition format for /metrics. Every thread updates its own shard of a time
+series without taking a lock; shards are only summed when metrics are
+scraped, so instrumentation adds no contention between request threads.
+The shard of a finished thread is folded into a per-series base total.
+Metrics are per process: with several server workers each one reports its
+own numbers.
+"""
+import os
+import hmac
+import time
+import bisect
+import threading
+import weakref
+
+# Bearer token that lets a scraper read /metrics without logging in
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Histogram bucket bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _ThreadShard:
+    """Owner of one thread's shard, dropped with the thread's locals when it ends"""
+
+    def __init__(self, size):
+        self.values = [0] * size
+
+
+class _Series:
+    """One labelled time series: a list of numbers, sharded per thread"""
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = {}           # id -> values of live threads' shards
+        self._base = [0] * size     # folded in shards of finished threads
+        self._lock = threading.RLock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _ThreadShard(self._size)
+            with self._lock:
+                self._shards[id(shard.values)] = shard.values
+            weakref.finalize(shard, self._retire, shard.values)
+        return shard.values
+
+    def _retire(self, values):
+        with self._lock:
+            del self._shards[id(values)]
+            self._base = [total + value for total, value in zip(self._base, values)]
+
+    def _totals(self):
+        with self._lock:
+            shards = [self._base] + list(self._shards.values())
+        return [sum(values) for values in zip(*shards)]
+
+
+class _CounterSeries(_Series):
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    def dec(self, amount=1):
+        self._shard()[0] -= amount
+
+    def value(self):
+        return self._totals()[0]
+
+
+class _HistogramSeries(_Series):
+
+    def __init__(self, buckets):
+        super().__init__(len(buckets) + 2)   # bucket counts, +Inf count, sum
+        self._buckets = buckets
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect.bisect_left(self._buckets, value)] += 1
+        shard[-1] += value
+
+    def time(self):
+        """Context manager observing the time spent in its block"""
+        return _Timer(self)
+
+
+class _Timer:
+
+    def __init__(self, series):
+        self.series = series
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.series.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values):
+        """The time series for these label values, created on first use"""
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.get(values)
+                if series is None:
+                    series = self._series[values] = self._new_series()
+        return series
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def _label_text(self, values, extra=()):
+        pairs = list(zip(self.label_names, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        """(suffix, label text, value) triples of every series"""
+        with self._lock:
+            series = list(self._series.items())
+        return [('', self._label_text(values), s.value()) for values, s in series]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, or is read from `function` at scrape time.
+
+    `function` returns a number, or for labelled gauges a dict of label value
+    tuples to numbers.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', self._label_text(labels), value) for labels, value in values.items()]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (e.g. latencies) in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels)
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        with self._lock:
+            series = list(self._series.items())
+        samples = []
+        for values, s in series:
+            totals = s._totals()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), totals):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append(('_bucket', self._label_text(values, [('le', le)]), cumulative))
+            samples.append(('_sum', self._label_text(values), totals[-1]))
+            samples.append(('_count', self._label_text(values), cumulative))
+        return samples
+
+
+class Registry:
+    """All metrics of the process"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def render(self):
+        """Text exposition format (version 0.0.4)"""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {_escape(str(e))}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{labels} {_format(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def count_cache(cache, hit):
+    """Count a lookup in one of the app's caches"""
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def authorized(header):
+    """Whether an Authorization header carries the metrics token"""
+    if not METRICS_TOKEN or not header:
+        return False
+    return hmac.compare_digest(header.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+
+def track_requests(app):
+    """Record latency, status and in-flight count of every request of a Flask app"""
+    from flask import request
+
+    @app.before_request
+    def _start_timer():
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        request.environ['metrics.start'] = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        start = request.environ.get('metrics.start')
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(route, request.method).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(route, request.method, str(response.status_code)).inc()
+        return response
+
+    @app.teardown_request
+    def _finish(exc):
+        if request.environ.pop('metrics.start', None) is not None:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+
+
+# Global registry; metrics below register themselves on creation
+registry = Registry()
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route, method and status',
+                        ('route', 'method', 'status'))
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time to produce a response, by route',
+                                 ('route', 'method'))
+HTTP_REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests currently being handled')
+TRANSMISSION_RPC_SECONDS = Histogram('transmission_rpc_duration_seconds',
+                                     'Transmission RPC round trips by method', ('method',))
+TRANSMISSION_RPC_ERRORS = Counter('transmission_rpc_errors_total',
+                                  'Failed Transmission RPC attempts by method', ('method',))
+SCRAPE_FETCH_SECONDS = Histogram('scrape_fetch_duration_seconds',
+                                 'Time to fetch a page from a search site (search and detail pages)', ('site',))
+SCRAPE_PARSE_SECONDS = Histogram('scrape_parse_duration_seconds',
+                                 'Time to parse the HTML of a search results page', ('site',))
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by cache and result (hit or miss)',
+                         ('cache', 'result'))
+DOWNLOAD_QUEUE_JOBS = Gauge('download_queue_jobs', 'Download jobs by state', ('state',))
@@ -0,0 +1,206 @@
+"""
+Mirror Domain Module
+Keeps latency statistics per mirror domain of each scraped site, sends
+requests to the fastest mirror and hedges slow requests with a second
+mirror, using whichever answers first
+"""
+import os
+import time
+import threading
+import logging
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+try:
+    from .metrics import SCRAPE_FETCH_SECONDS
+except ImportError:
+    from metrics import SCRAPE_FETCH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Latency percentile of the primary mirror after which a hedged request is sent
+HEDGE_PERCENTILE = float(os.environ.get('MIRROR_HEDGE_PERCENTILE', '0.9'))
+# Hedge delay used until a mirror has enough latency samples
+DEFAULT_HEDGE_DELAY = float(os.environ.get('MIRROR_DEFAULT_HEDGE_DELAY', '3.0'))
+MIN_HEDGE_DELAY = 0.25
+MIN_SAMPLES = 5
+SAMPLE_WINDOW = 50
+
+# Shared pool for mirror requests; losing hedged requests finish in the background
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('MIRROR_FETCH_WORKERS', '16')),
+                               thread_name_prefix='mirror-fetch')
+
+
+def _origin(url):
+    parsed = urllib.parse.urlsplit(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+class MirrorStats:
+    """Latency samples and failure count for a single mirror"""
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+        self.failures = 0
+
+    def percentile(self, fraction):
+        """Latency at the given percentile, or None without enough samples"""
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def rank(self):
+        """Sort key: mirrors with recent failures and high median latency go last"""
+        if not self.samples:
+            return (self.failures, DEFAULT_HEDGE_DELAY)
+        ordered = sorted(self.samples)
+        return (self.failures, ordered[len(ordered) // 2])
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        p50 = self.percentile(0.5)
+        p90 = self.percentile(0.9)
+        return {
+            "origin": self.origin,
+            "samples": len(self.samples),
+            "failures": self.failures,
+            "latency_p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "latency_p90_ms": round(p90 * 1000) if p90 is not None else None
+        }
+
+
+class MirrorPool:
+    """Selects mirrors per site and performs hedged GET requests"""
+
+    def __init__(self):
+        self.sites = {}
+        self.lock = threading.Lock()
+        self.version = 0    # bumped whenever mirror statistics change
+
+    def register_site(self, site, mirrors):
+        """Register the mirror origins (scheme://host) of a site, primary first"""
+        with self.lock:
+            self.sites[site] = [MirrorStats(_origin(mirror)) for mirror in mirrors]
+
+    def ranked_mirrors(self, site):
+        """Mirrors of a site, fastest first"""
+        with self.lock:
+            mirrors = list(self.sites.get(site, []))
+        # sorted() is stable, so the configured order breaks ties
+        return sorted(mirrors, key=lambda m: m.rank())
+
+    def fastest_origin(self, site):
+        """Origin of the currently fastest mirror, or None for unknown sites"""
+        mirrors = self.ranked_mirrors(site)
+        return mirrors[0].origin if mirrors else None
+
+    def rewrite_url(self, site, url):
+        """Point a URL of one of the site's mirrors at the fastest mirror"""
+        mirrors = self.ranked_mirrors(site)
+        if not mirrors or _origin(url) not in {m.origin for m in mirrors}:
+            return url
+        parsed = urllib.parse.urlsplit(url)
+        fastest = urllib.parse.urlsplit(mirrors[0].origin)
+        return urllib.parse.urlunsplit(parsed._replace(scheme=fastest.scheme, netloc=fastest.netloc))
+
+    def _record(self, mirror, latency, ok):
+        with self.lock:
+            self.version += 1
+            if ok:
+                mirror.samples.append(latency)
+                mirror.failures = max(0, mirror.failures - 1)
+            else:
+                mirror.failures += 1
+
+    def _fetch(self, mirror, url, kwargs):
+        start = time.time()
+        try:
+            response = requests.get(url, **kwargs)
+            response.raise_for_status()
+        except Exception:
+            self._record(mirror, time.time() - start, ok=False)
+            raise
+        self._record(mirror, time.time() - start, ok=True)
+        return response
+
+    def get(self, site, url, **kwargs):
+        """GET a URL from the fastest mirror, hedging with a second mirror if it is slow.
+
+        The first successful response is returned. If every attempted mirror
+        fails, the last error is raised. A numeric `timeout` bounds the whole
+        call: backups get only the time left and are not sent when less than
+        the hedge delay remains.
+        """
+        with SCRAPE_FETCH_SECONDS.labels(site).time():
+            return self._get(site, url, kwargs)
+
+    def _get(self, site, url, kwargs):
+        mirrors = self.ranked_mirrors(site)
+        if len(mirrors) < 2 or _origin(url) not in {m.origin for m in mirrors}:
+            return requests.get(url, **kwargs)
+
+        parsed = urllib.parse.urlsplit(url)
+
+        def url_for(mirror):
+            target = urllib.parse.urlsplit(mirror.origin)
+            return urllib.parse.urlunsplit(parsed._replace(scheme=target.scheme, netloc=target.netloc))
+
+        primary, backups = mirrors[0], iter(mirrors[1:])
+        hedge_delay = primary.percentile(HEDGE_PERCENTILE)
+        hedge_delay = max(MIN_HEDGE_DELAY, hedge_delay) if hedge_delay is not None else DEFAULT_HEDGE_DELAY
+
+        timeout = kwargs.get('timeout')
+        ends_at = time.monotonic() + timeout if isinstance(timeout, (int, float)) else None
+
+        def time_left():
+            return None if ends_at is None else max(0.0, ends_at - time.monotonic())
+
+        pending = {_executor.submit(self._fetch, primary, url_for(primary), kwargs): primary}
+        last_error = None
+        hedged = False
+
+        while pending:
+            left = time_left()
+            wait_for = left if hedged else hedge_delay if left is None else min(hedge_delay, left)
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done and hedged:
+                raise requests.Timeout(f"No mirror of {site} answered within {timeout}s")
+
+            for future in done:
+                mirror = pending.pop(future)
+                try:
+                    response = future.result()
+                    if hedged:
+                        logger.info(f"[MIRROR] {site}: {mirror.origin} answered first")
+                    return response
+                except Exception as e:
+                    logger.warning(f"[MIRROR] {site}: {mirror.origin} failed: {e}")
+                    last_error = e
+
+            # Hedge when the primary is slower than its usual latency, or fail over when it errored
+            if not hedged or (not pending and last_error is not None):
+                left = time_left()
+                backup = next(backups, None) if left is None or left >= hedge_delay else None
+                if backup is None:
+                    hedged = True
+                    continue
+                if not hedged and not done:
+                    logger.info(f"[MIRROR] {site}: no answer after {hedge_delay:.2f}s, hedging with {backup.origin}")
+                hedged = True
+                backup_kwargs = kwargs if left is None else dict(kwargs, timeout=left)
+                pending[_executor.submit(self._fetch, backup, url_for(backup), backup_kwargs)] = backup
+
+        raise last_error or Exception(f"No mirror of {site} answered")
+
+    def snapshot(self):
+        """Get the mirror statistics of all sites, fastest first"""
+        return {site: [m.to_dict() for m in self.ranked_mirrors(site)] for site in list(self.sites)}
+
+
+# Global mirror pool instance
+mirror_pool = MirrorPool()
@@ -0,0 +1,511 @@
+"""
+Post-Processing Module
+Extracts archives from completed downloads in background worker processes.
+Workers run with idle I/O and lowest CPU priority, at most a few at a time,
+and are paused or slowed down while Transmission is downloading.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import shutil
+import signal
+import logging
+import tarfile
+import tempfile
+import zipfile
+import threading
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+
+try:
+    from .utils import lower_thread_priority
+except ImportError:
+    from utils import lower_thread_priority
+
+logger = logging.getLogger(__name__)
+
+# Extract archives of completed downloads automatically (opt-in: extraction
+# writes a second copy of every archive's contents)
+POSTPROCESS_ENABLED = os.environ.get('POSTPROCESS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Extraction processes running at the same time
+POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS', '1'))
+# Seconds between checks of Transmission for completed torrents and activity
+POSTPROCESS_POLL_INTERVAL = float(os.environ.get('POSTPROCESS_POLL_INTERVAL', '30'))
+# Transmission counts as busy above this download rate (bytes/s)
+POSTPROCESS_BUSY_RATE = int(float(os.environ.get('POSTPROCESS_BUSY_RATE_KB', '512')) * 1024)
+# Extraction write rate while busy (bytes/s); 0 pauses extraction instead
+POSTPROCESS_BUSY_LIMIT = int(float(os.environ.get('POSTPROCESS_BUSY_LIMIT_MB', '0')) * 1024 * 1024)
+# Delete archive files after a successful extraction (stops seeding them)
+POSTPROCESS_DELETE_ARCHIVES = os.environ.get('POSTPROCESS_DELETE_ARCHIVES', 'false').lower() in ('1', 'true', 'yes')
+# Finished jobs kept for status queries
+FINISHED_JOBS_KEPT = 100
+# Seconds a cancelled extraction gets to exit before it is killed
+CANCEL_GRACE_SECONDS = 5
+# Hashes of torrents already handled, kept in the download directory (hidden)
+STATE_FILE = '.postprocess-done.json'
+
+COPY_CHUNK = 1024 * 1024
+# Shared rate value meaning "paused"
+PAUSED = -1.0
+
+# First volume of each supported archive type
+ARCHIVE_TYPES = [
+    (re.compile(r'\.zip$', re.I), 'zip'),
+    (re.compile(r'\.(tar|tar\.gz|tgz|tar\.bz2|tbz2|tar\.xz|txz)$', re.I), 'tar'),
+    (re.compile(r'(?<!\.part)(\.part0*1)?\.rar$', re.I), 'rar'),
+    (re.compile(r'\.7z(\.0*1)?$', re.I), '7z'),
+]
+# Later volumes of multi-part archives, which are extracted through the first one
+VOLUME_PATTERN = re.compile(r'\.part0*(?:[2-9]|[1-9]\d+)\.rar$|\.r\d{2}$|\.7z\.0*(?:[2-9]|[1-9]\d+)$', re.I)
+EXTERNAL_TOOLS = {
+    'rar': [('unrar', ['x', '-o+', '-y', '{archive}', '{dest}/']),
+            ('7z', ['x', '-y', '-o{dest}', '{archive}']),
+            ('bsdtar', ['-xf', '{archive}', '-C', '{dest}'])],
+    '7z': [('7z', ['x', '-y', '-o{dest}', '{archive}']),
+           ('7zz', ['x', '-y', '-o{dest}', '{archive}']),
+           ('7za', ['x', '-y', '-o{dest}', '{archive}']),
+           ('bsdtar', ['-xf', '{archive}', '-C', '{dest}'])],
+}
+
+
+def archive_type(name):
+    """Archive type of a file name, or None for non-archives and later volumes"""
+    if VOLUME_PATTERN.search(name):
+        return None
+    for pattern, kind in ARCHIVE_TYPES:
+        if pattern.search(name):
+            return kind
+    return None
+
+
+def archive_volumes(path):
+    """All files belonging to the archive whose first volume is `path`"""
+    directory, name = os.path.split(path)
+    stem = re.sub(r'(\.part0*1)?\.rar$|\.7z(\.0*1)?$', '', name, flags=re.I)
+    if stem == name:
+        return [path]
+    volume = re.compile(re.escape(stem) + r'(\.part\d+\.rar|\.rar|\.r\d{2}|\.7z(\.\d+)?)$', re.I)
+    return sorted(os.path.join(directory, n) for n in os.listdir(directory) if volume.match(n))
+
+
+def find_external_tool(kind):
+    """Command template for the first installed extractor of an archive type"""
+    for program, args in EXTERNAL_TOOLS.get(kind, []):
+        executable = shutil.which(program)
+        if executable:
+            return [executable] + args
+    return None
+
+
+# ----------------------------------------------------------------------
+# Worker process
+# ----------------------------------------------------------------------
+
+def _safe_target(dest, member_name):
+    """Destination path of an archive member, refusing paths that escape `dest`"""
+    target = os.path.realpath(os.path.join(dest, member_name))
+    if os.path.commonpath([target, os.path.realpath(dest)]) != os.path.realpath(dest):
+        raise ValueError(f"Unsafe path in archive: {member_name}")
+    return target
+
+
+def _pace(nbytes, rate_limit):
+    """Wait while extraction is paused, or long enough to respect the rate limit"""
+    while rate_limit.value == PAUSED:
+        time.sleep(1)
+    limit = rate_limit.value
+    if limit > 0:
+        time.sleep(nbytes / limit)
+
+
+def _copy_member(source, target, advance, rate_limit):
+    """Copy one archive member, reporting each written chunk to `advance`"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as out:
+        while True:
+            chunk = source.read(COPY_CHUNK)
+            if not chunk:
+                break
+            out.write(chunk)
+            advance(len(chunk))
+            _pace(len(chunk), rate_limit)
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _extract_external(command, archive, dest, progress, rate_limit):
+    """Run an external extractor, stopping it with SIGSTOP while paused.
+
+    External tools cannot be rate limited, so they keep running (at idle
+    priority) when extraction is only slowed down.
+    """
+    args = [arg.format(archive=archive, dest=dest) for arg in command]
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr)
+        stopped = False
+        while proc.poll() is None:
+            paused = rate_limit.value == PAUSED
+            if paused != stopped:
+                proc.send_signal(signal.SIGSTOP if paused else signal.SIGCONT)
+                stopped = paused
+            progress.value = _dir_size(dest)
+            time.sleep(2)
+        progress.value = _dir_size(dest)
+        if proc.returncode != 0:
+            stderr.seek(0)
+            error = stderr.read().decode(errors='replace').strip().splitlines()
+            raise RuntimeError(f"{os.path.basename(args[0])} exited with {proc.returncode}: {error[-1] if error else ''}")
+
+
+def _signal_group(pgid, sig):
+    """Send a signal to an extraction's process group; False if the group is gone"""
+    try:
+        os.killpg(pgid, sig)
+        if sig == signal.SIGTERM:
+            # An extractor stopped while paused only handles SIGTERM once continued
+            os.killpg(pgid, signal.SIGCONT)
+        return True
+    except ProcessLookupError:
+        return False
+
+
+def _extract_worker(kind, archive, dest, command, progress, rate_limit):
+    """Worker process entry point: extract one archive into `dest`"""
+    # Own process group, so cancelling also stops an external extractor
+    os.setpgrp()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    lower_thread_priority()
+    os.makedirs(dest, exist_ok=True)
+
+    try:
+        if kind == 'zip':
+            # Progress counts uncompressed bytes, matching the total from the zip directory
+            def advance(n):
+                progress.value += n
+
+            with zipfile.ZipFile(archive) as zf:
+                for info in zf.infolist():
+                    target = _safe_target(dest, info.filename)
+                    if info.is_dir():
+                        os.makedirs(target, exist_ok=True)
+                        continue
+                    with zf.open(info) as source:
+                        _copy_member(source, target, advance, rate_limit)
+        elif kind == 'tar':
+            # Progress counts archive bytes read, as the uncompressed size is unknown
+            with open(archive, 'rb') as raw, tarfile.open(fileobj=raw, mode='r|*') as tf:
+                def advance(n):
+                    progress.value = raw.tell()
+
+                for member in tf:
+                    target = _safe_target(dest, member.name)
+                    if member.isdir():
+                        os.makedirs(target, exist_ok=True)
+                    elif member.isfile():
+                        _copy_member(tf.extractfile(member), target, advance, rate_limit)
+                    # Links and special files are skipped
+                progress.value = raw.tell()
+        else:
+            _extract_external(command, archive, dest, progress, rate_limit)
+    except Exception as e:
+        logger.error(f"[POSTPROC] Extracting {archive} failed: {e}")
+        raise SystemExit(1)
+
+
+# ----------------------------------------------------------------------
+# Jobs and scheduling
+# ----------------------------------------------------------------------
+
+class PostProcessJob:
+    """Extraction of one archive and its progress"""
+
+    def __init__(self, root, archive, kind, torrent=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.root = root
+        self.archive = archive      # relative to root
+        self.kind = kind
+        self.torrent = torrent      # {"id", "name", "hash"} or None
+        self.dest = re.sub(r'(\.part0*1)?\.rar$|\.7z(\.0*1)?$|\.zip$|\.(tar(\.\w+)?|tgz|tbz2|txz)$',
+                           '', archive, flags=re.I)
+        self.status = 'queued'
+        self.total_bytes = 0
+        self.progress = None        # shared multiprocessing.Value while running
+        self.done_bytes = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.process = None
+        self.cancelled = False
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        done = self.progress.value if self.progress is not None else self.done_bytes
+        return {
+            "id": self.id,
+            "archive": self.archive,
+            "type": self.kind,
+            "destination": self.dest,
+            "torrent": self.torrent,
+            "status": self.status,
+            "total_bytes": self.total_bytes,
+            "done_bytes": done,
+            "progress": round(min(done * 100 / self.total_bytes, 100), 1) if self.total_bytes else 0.0,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+
+class PostProcessor:
+    """Finds completed torrents, queues their archives and runs extractions"""
+
+    def __init__(self, workers=POSTPROCESS_WORKERS):
+        self.workers = max(workers, 1)
+        self.jobs = OrderedDict()   # job id -> PostProcessJob, oldest first
+        self.lock = threading.Lock()
+        self.root = None
+        self.client_factory = None
+        self.on_extracted = None    # called with (root, relpath) after each job
+        self.busy = False
+        self.done_hashes = set()
+        # Without saved state, torrents completed before the first poll are not processed
+        self._seeded = False
+        self._queue = queue.Queue()
+        self._context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        )
+        # Write rate shared with all workers: 0 unlimited, >0 bytes/s, PAUSED
+        self.rate_limit = self._context.Value('d', 0.0, lock=False)
+        self._threads = []
+
+    # -- persistence of handled torrents -------------------------------
+
+    def _state_path(self):
+        return os.path.join(self.root, STATE_FILE)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path()) as f:
+                self.done_hashes = set(json.load(f))
+            self._seeded = True
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"[POSTPROC] Ignoring unreadable state file: {e}")
+
+    def _save_state(self):
+        try:
+            tmp_path = self._state_path() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(sorted(self.done_hashes), f)
+            os.replace(tmp_path, self._state_path())
+        except OSError as e:
+            logger.warning(f"[POSTPROC] Cannot save state: {e}")
+
+    # -- queueing -------------------------------------------------------
+
+    def enqueue_path(self, relpath, torrent=None):
+        """Queue every archive found at a relative file or folder path; returns the jobs"""
+        full_path = os.path.join(self.root, relpath)
+        archives = []
+        if os.path.isdir(full_path):
+            for dirpath, dirnames, filenames in os.walk(full_path):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                archives.extend(os.path.join(dirpath, name) for name in sorted(filenames))
+        elif os.path.isfile(full_path):
+            archives.append(full_path)
+
+        jobs = []
+        for path in archives:
+            kind = archive_type(os.path.basename(path))
+            if kind is None:
+                continue
+            job = PostProcessJob(self.root, os.path.relpath(path, self.root), kind, torrent)
+            with self.lock:
+                if any(j.archive == job.archive and not j.finished for j in self.jobs.values()):
+                    continue
+                self.jobs[job.id] = job
+            self._queue.put(job)
+            jobs.append(job)
+            logger.info(f"[POSTPROC] Queued {job.archive}")
+        self._ensure_workers()
+        return jobs
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancelled = True
+        process = job.process
+        if process is not None and process.is_alive():
+            if not _signal_group(process.pid, signal.SIGTERM):
+                process.terminate()  # not yet in its own group
+        return True
+
+    def busy_with(self, relpath):
+        """Whether unfinished jobs read or write below a relative path"""
+        prefix = relpath.rstrip(os.sep) + os.sep
+        with self.lock:
+            return any(not job.finished and (job.archive == relpath or job.archive.startswith(prefix))
+                       for job in self.jobs.values())
+
+    def snapshot(self):
+        with self.lock:
+            jobs = [job.to_dict() for job in reversed(self.jobs.values())]
+        return {
+            "enabled": POSTPROCESS_ENABLED,
+            "workers": self.workers,
+            "transmission_busy": self.busy,
+            "rate_limit": "paused" if self.rate_limit.value == PAUSED else self.rate_limit.value or None,
+            "jobs": jobs
+        }
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond the retention limit (lock held)"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[job_id]
+
+    # -- running jobs ---------------------------------------------------
+
+    def _ensure_workers(self):
+        with self.lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='postprocess', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run_job(job)
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+                logger.error(f"[POSTPROC] {job.archive} failed: {e}")
+            finally:
+                if job.progress is not None:
+                    job.done_bytes = job.progress.value
+                    job.progress = None
+                job.finished = time.time()
+                with self.lock:
+                    self._prune()
+                if self.on_extracted:
+                    self.on_extracted(self.root, job.dest)
+
+    def _run_job(self, job):
+        if job.cancelled:
+            job.status = 'cancelled'
+            return
+        archive = os.path.join(self.root, job.archive)
+        dest = os.path.join(self.root, job.dest)
+        if os.path.exists(dest):
+            job.status = 'skipped'
+            job.error = "Destination already exists"
+            return
+
+        command = None
+        if job.kind == 'zip':
+            with zipfile.ZipFile(archive) as zf:
+                job.total_bytes = sum(info.file_size for info in zf.infolist())
+        else:
+            # Compressed tar and external formats: estimate from the archive size
+            job.total_bytes = sum(os.path.getsize(v) for v in archive_volumes(archive))
+            if job.kind in EXTERNAL_TOOLS:
+                command = find_external_tool(job.kind)
+                if command is None:
+                    raise RuntimeError(f"No extractor installed for {job.kind} archives")
+
+        job.status = 'running'
+        job.started = time.time()
+        job.progress = self._context.Value('q', 0)
+        job.process = self._context.Process(
+            target=_extract_worker,
+            args=(job.kind, archive, dest, command, job.progress, self.rate_limit),
+            name=f'extract-{job.id}',
+            daemon=True
+        )
+        job.process.start()
+        job.process.join()
+
+        if job.cancelled:
+            job.status = 'cancelled'
+            # The extractor may outlive the worker briefly; it must not write after the cleanup
+            deadline = time.time() + CANCEL_GRACE_SECONDS
+            while _signal_group(job.process.pid, 0):
+                if time.time() >= deadline:
+                    _signal_group(job.process.pid, signal.SIGKILL)
+                    break
+                time.sleep(0.1)
+            shutil.rmtree(dest, ignore_errors=True)
+        elif job.process.exitcode != 0:
+            shutil.rmtree(dest, ignore_errors=True)
+            raise RuntimeError(f"Extraction process exited with {job.process.exitcode}")
+        else:
+            job.status = 'completed'
+            logger.info(f"[POSTPROC] Extracted {job.archive} to {job.dest}")
+            if POSTPROCESS_DELETE_ARCHIVES:
+                for volume in archive_volumes(archive):
+                    os.remove(volume)
+        job.process = None
+
+    # -- watching Transmission -----------------------------------------
+
+    def start(self, root, client_factory):
+        """Start watching Transmission for completed torrents"""
+        self.root = os.path.abspath(root)
+        self.client_factory = client_factory
+        self._load_state()
+        threading.Thread(target=self._watch, name='postprocess-watch', daemon=True).start()
+
+    def _watch(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"[POSTPROC] Poll failed: {e}")
+            time.sleep(POSTPROCESS_POLL_INTERVAL)
+
+    def poll(self):
+        """Throttle workers by Transmission activity and queue newly completed torrents"""
+        client = self.client_factory() if self.client_factory else None
+        if not client:
+            return
+
+        stats = client.session_stats()
+        self.busy = stats.get("downloadSpeed", 0) > POSTPROCESS_BUSY_RATE
+        self.rate_limit.value = (POSTPROCESS_BUSY_LIMIT or PAUSED) if self.busy else 0.0
+
+        changed = False
+        for torrent in client.list_torrents():
+            if torrent.progress < 100 or not torrent.hash_string or torrent.hash_string in self.done_hashes:
+                continue
+            self.done_hashes.add(torrent.hash_string)
+            changed = True
+            if self._seeded and os.path.exists(os.path.join(self.root, torrent.name)):
+                self.enqueue_path(torrent.name, {"id": torrent.id, "name": torrent.name, "hash": torrent.hash_string})
+        if changed or not self._seeded:
+            self._seeded = True
+            self._save_state()
+
+
+# Global post-processor instance
+post_processor = PostProcessor()
@@ -0,0 +1,265 @@
+"""
+Request Profiling Module
+Admins can profile a single request by sending an `X-Profile` header or a
+`_profile` query parameter: `1` (or `speedscope`) samples the request
+thread's stack, `pstats` runs cProfile. Independently, every request is
+stack-sampled at a low rate and kept, with a log line naming the hottest
+functions, when it takes longer than SLOW_REQUEST_SECONDS. Kept profiles can
+be downloaded as speedscope JSON or pstats files.
+"""
+import os
+import sys
+import time
+import uuid
+import marshal
+import cProfile
+import logging
+import threading
+from collections import OrderedDict, Counter
+
+try:
+    from .fast_json import dumps
+except ImportError:
+    from fast_json import dumps
+
+logger = logging.getLogger(__name__)
+
+# Requests taking longer than this are kept with their stack samples (0 disables)
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '5'))
+# Seconds between stack samples of a profiled request
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.005'))
+# Seconds between stack samples of other requests, watched for slowness;
+# coarser, since every request is sampled
+SLOW_SAMPLE_INTERVAL = float(os.environ.get('SLOW_SAMPLE_INTERVAL', '0.05'))
+# Users allowed to profile requests and download profiles
+PROFILE_ADMINS = {name.strip() for name in os.environ.get('PROFILE_ADMINS', 'admin').split(',') if name.strip()}
+# Profiles kept for download
+PROFILES_KEPT = 50
+# Deepest stack recorded per sample
+MAX_STACK_DEPTH = 128
+# Functions named in the slow request log line
+SLOW_LOG_TOP = 5
+
+SAMPLED_MODES = ('1', 'true', 'yes', 'sample', 'speedscope')
+PSTATS_MODES = ('pstats', 'cprofile')
+
+
+def is_admin(user):
+    """Whether a (Flask-Login) user may profile requests"""
+    return bool(getattr(user, 'is_authenticated', False)) and user.username in PROFILE_ADMINS
+
+
+def _stack(frame):
+    """Stack of a frame as (function, file, first line) tuples, outermost first"""
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+class RequestProfile:
+    """Samples or cProfile statistics of one request"""
+
+    def __init__(self, method, path, mode=None, interval=SLOW_SAMPLE_INTERVAL):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.mode = mode                # None (slow request watch), 'sampled' or 'pstats'
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.samples = Counter()        # stack -> count
+        self.next_sample = time.monotonic()
+        self.started = time.time()
+        self.duration = None
+        self.stats = None               # marshalled cProfile stats
+        self._cprofile = None
+
+    @property
+    def format(self):
+        return 'pstats' if self.mode == 'pstats' else 'speedscope'
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": "slow" if self.mode is None else "requested",
+            "format": self.format,
+            "samples": sum(self.samples.values()),
+            "started": self.started,
+            "duration": self.duration
+        }
+
+    def hottest(self, count=SLOW_LOG_TOP):
+        """Functions most often on top of the stack, with their share of samples"""
+        # Copied first: the sampler may still be adding a last sample
+        samples = list(self.samples.items())
+        total = sum(n for _, n in samples)
+        leaves = Counter()
+        for stack, n in samples:
+            if stack:
+                leaves[stack[-1]] += n
+        return [(f"{name} ({os.path.basename(filename)}:{line})", n / total)
+                for (name, filename, line), n in leaves.most_common(count)]
+
+    def speedscope(self):
+        """Sampled profile in the speedscope file format"""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, n in list(self.samples.items()):
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(n * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "tor-web-app",
+            "name": f"{self.method} {self.path}",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.method} {self.path}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights
+            }]
+        }
+
+
+class Profiler:
+    """Stack sampler for in-flight requests and store of kept profiles"""
+
+    def __init__(self, slow_seconds=SLOW_REQUEST_SECONDS):
+        self.slow_seconds = slow_seconds
+        self.active = {}                # thread id -> RequestProfile being sampled
+        self.kept = OrderedDict()       # profile id -> RequestProfile, oldest first
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def begin(self, method, path, mode=None):
+        """Start profiling the current thread's request; None when nothing is to be recorded"""
+        if mode in PSTATS_MODES:
+            profile = RequestProfile(method, path, 'pstats')
+            try:
+                profile._cprofile = cProfile.Profile()
+                profile._cprofile.enable()
+                return profile
+            except ValueError as e:
+                # Another profiler is active in this thread; sample instead
+                logger.warning(f"[PROFILE] cProfile unavailable, sampling {path} instead: {e}")
+                mode = 'sample'
+        if mode in SAMPLED_MODES:
+            profile = RequestProfile(method, path, 'sampled', PROFILE_SAMPLE_INTERVAL)
+        elif self.slow_seconds > 0:
+            profile = RequestProfile(method, path)
+        else:
+            return None
+        with self.lock:
+            self.active[profile.thread_id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+                self._thread.start()
+        return profile
+
+    def end(self, profile):
+        """Stop profiling; returns the profile id if it was kept"""
+        profile.duration = time.time() - profile.started
+        if profile._cprofile is not None:
+            profile._cprofile.disable()
+            profile._cprofile.create_stats()
+            profile.stats = marshal.dumps(profile._cprofile.stats)
+            profile._cprofile = None
+        else:
+            with self.lock:
+                self.active.pop(profile.thread_id, None)
+
+        if profile.mode is None:
+            if profile.duration < self.slow_seconds:
+                return None
+            hottest = ', '.join(f"{name} {share:.0%}" for name, share in profile.hottest())
+            logger.warning(f"[PROFILE] Slow request {profile.method} {profile.path} took {profile.duration:.2f}s "
+                           f"(profile {profile.id}): {hottest or 'no samples'}")
+        with self.lock:
+            self.kept[profile.id] = profile
+            while len(self.kept) > PROFILES_KEPT:
+                self.kept.popitem(last=False)
+        return profile.id
+
+    def _sample(self):
+        while True:
+            with self.lock:
+                if not self.active:
+                    self._thread = None
+                    return
+                now = time.monotonic()
+                due = [profile for profile in self.active.values() if profile.next_sample <= now]
+                if due:
+                    frames = sys._current_frames()
+                    for profile in due:
+                        frame = frames.get(profile.thread_id)
+                        if frame is not None:
+                            profile.samples[_stack(frame)] += 1
+                        profile.next_sample = max(profile.next_sample + profile.interval, now)
+                    del frames, frame
+                wake = min(profile.next_sample for profile in self.active.values())
+            time.sleep(max(wake - time.monotonic(), 0.001))
+
+    def snapshot(self):
+        with self.lock:
+            return [profile.to_dict() for profile in reversed(self.kept.values())]
+
+    def export(self, profile_id):
+        """(file name, body bytes) of a kept profile, or None"""
+        with self.lock:
+            profile = self.kept.get(profile_id)
+        if profile is None:
+            return None
+        if profile.format == 'pstats':
+            return f"profile-{profile.id}.pstats", profile.stats
+        return f"profile-{profile.id}.speedscope.json", dumps(profile.speedscope()).encode()
+
+
+def profile_requests(app):
+    """Profile requests of a Flask app on demand and keep slow ones"""
+    from flask import request
+    from flask_login import current_user
+
+    @app.before_request
+    def _start_profile():
+        mode = (request.headers.get('X-Profile') or request.args.get('_profile') or '').lower() or None
+        if mode and not is_admin(current_user):
+            mode = None
+        profile = profiler.begin(request.method, request.path, mode)
+        if profile is not None:
+            request.environ['profiling.profile'] = profile
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = request.environ.pop('profiling.profile', None)
+        if profile is not None:
+            profile_id = profiler.end(profile)
+            if profile_id and profile.mode is not None:
+                response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.teardown_request
+    def _abort_profile(exc):
+        # Requests that raised skip after_request
+        profile = request.environ.pop('profiling.profile', None)
+        if profile is not None:
+            profiler.end(profile)
+
+
+# Global profiler instance
+profiler = Profiler()
@@ -0,0 +1,140 @@
+"""
+Scrape Worker Pool Module
+Optionally runs search page parsing and magnet extraction in worker
+processes, so BeautifulSoup's CPU-bound work does not hold the GIL of the
+web process while it serves other requests
+"""
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+try:
+    from .deadline import Deadline, DeadlineExceeded
+    from .metrics import SCRAPE_PARSE_SECONDS
+except ImportError:
+    from deadline import Deadline, DeadlineExceeded
+    from metrics import SCRAPE_PARSE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes; 0 keeps parsing in the request thread
+SCRAPE_WORKERS = int(os.environ.get('SCRAPE_WORKERS', '0'))
+# Maximum pages queued or in progress across all workers
+SCRAPE_QUEUE_SIZE = int(os.environ.get('SCRAPE_QUEUE_SIZE', str(max(SCRAPE_WORKERS, 1) * 4)))
+# Extra time allowed for a worker to hand back results after the deadline
+RESULT_GRACE_SECONDS = 2.0
+
+# Result dictionaries travel between processes as plain tuples in this order
+RESULT_FIELDS = ('name', 'size', 'seeders', 'leechers', 'magnet', 'info_hash', 'url', 'category', 'added')
+
+
+def pack_results(results):
+    """Convert result dictionaries into compact tuples"""
+    return [tuple(result.get(field) for field in RESULT_FIELDS) for result in results]
+
+
+def unpack_results(records):
+    """Convert compact tuples back into result dictionaries"""
+    return [dict(zip(RESULT_FIELDS, record)) for record in records]
+
+
+def _init_worker():
+    """Configure logging in a freshly started worker process"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def _parse_in_worker(site, html, base_url, seconds):
+    """Worker entry point: parse a search page and extract magnets for one site.
+
+    Metrics are per process, so the HTML parse time is handed back for the
+    web process to record.
+    """
+    try:
+        from .api import make_soup, extract_results
+    except ImportError:
+        from api import make_soup, extract_results
+
+    deadline = Deadline(seconds)
+    start = time.perf_counter()
+    soup = make_soup(html)
+    parse_seconds = time.perf_counter() - start
+    results = extract_results(site, soup, base_url, deadline)
+    return pack_results(results), deadline.exceeded, parse_seconds
+
+
+class ScrapePool:
+    """Process pool with a bounded number of queued pages"""
+
+    def __init__(self, workers=SCRAPE_WORKERS, queue_size=SCRAPE_QUEUE_SIZE):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_executor(self):
+        with self.lock:
+            if self._executor is None:
+                # forkserver avoids forking a web process that already runs threads
+                context = multiprocessing.get_context(
+                    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                )
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context, initializer=_init_worker
+                )
+                logger.info(f"[SCRAPE] Started scrape pool with {self.workers} worker processes")
+            return self._executor
+
+    def parse(self, site, html, base_url, deadline):
+        """Parse a search page in a worker process within the request deadline.
+
+        Waits for a free queue slot for at most the time left, then returns the
+        worker's results. Partial results flag the deadline as exceeded.
+        """
+        remaining = deadline.remaining()
+        if not self.slots.acquire(timeout=None if remaining == float('inf') else remaining):
+            deadline.exceeded = True
+            raise DeadlineExceeded("Scrape queue is full")
+
+        try:
+            future = self._get_executor().submit(
+                _parse_in_worker, site, html, base_url,
+                None if deadline.seconds is None else deadline.remaining()
+            )
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+
+        remaining = deadline.remaining()
+        try:
+            records, exceeded, parse_seconds = future.result(
+                timeout=None if remaining == float('inf') else remaining + RESULT_GRACE_SECONDS
+            )
+        except FutureTimeoutError:
+            future.cancel()
+            deadline.exceeded = True
+            logger.warning(f"[SCRAPE] Worker for {site} did not finish before the deadline")
+            return []
+
+        SCRAPE_PARSE_SECONDS.labels(site).observe(parse_seconds)
+        if exceeded:
+            deadline.exceeded = True
+        return unpack_results(records)
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self.lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# Global scrape pool instance
+scrape_pool = ScrapePool()
@@ -0,0 +1,375 @@
+"""
+Site Health Tracking Module
+Records latency and error rates per torrent site and temporarily disables
+sites that keep failing (circuit breaker), with background recovery probes
+"""
+import os
+import time
+import threading
+import logging
+import urllib.parse
+from collections import OrderedDict, deque
+
+import requests
+
+try:
+    from .deadline import MAX_SEARCH_DEADLINE
+except ImportError:
+    from deadline import MAX_SEARCH_DEADLINE
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failures before a site's circuit opens
+FAILURE_THRESHOLD = int(os.environ.get('SITE_FAILURE_THRESHOLD', '3'))
+# Seconds a site stays disabled after its circuit opens (doubles on each failed probe)
+COOLDOWN_SECONDS = float(os.environ.get('SITE_COOLDOWN_SECONDS', '120'))
+MAX_COOLDOWN_SECONDS = float(os.environ.get('SITE_MAX_COOLDOWN_SECONDS', '1800'))
+# How often the background prober looks for sites to re-check
+PROBE_INTERVAL = float(os.environ.get('SITE_PROBE_INTERVAL', '30'))
+PROBE_TIMEOUT = 10
+# Seconds a trial request may hold a half-open circuit before the site goes
+# back to open and another trial is allowed; never shorter than the longest
+# search deadline, so a slow but live trial is not replaced
+HALF_OPEN_TIMEOUT = max(float(os.environ.get('SITE_HALF_OPEN_TIMEOUT', str(MAX_SEARCH_DEADLINE + 30))),
+                        MAX_SEARCH_DEADLINE + 5)
+# Number of recent requests used for error rate and latency figures
+WINDOW_SIZE = 20
+# Cached search results served while a site is disabled
+RESULT_CACHE_SIZE = 200
+RESULT_CACHE_TTL = float(os.environ.get('SITE_RESULT_CACHE_TTL', '3600'))
+
+# Markers of anti-bot interstitials that come back with a 200 status
+CHALLENGE_MARKERS = (
+    'cf-chl',
+    'challenge-platform',
+    '<title>Just a moment...</title>',
+    'Checking your browser before accessing',
+    'DDoS-Guard',
+)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class SiteUnavailableError(Exception):
+    """Raised when a site responds with something other than usable results"""
+
+
+def looks_like_challenge(text):
+    """Check whether an HTML page is an anti-bot challenge instead of content"""
+    head = text[:20000]
+    return any(marker in head for marker in CHALLENGE_MARKERS)
+
+
+class SiteHealth:
+    """Health record and circuit state for a single site"""
+
+    def __init__(self, site):
+        self.site = site
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.recent = deque(maxlen=WINDOW_SIZE)  # (ok, latency) pairs
+        self.last_error = None
+        self.last_success_at = None
+        self.last_failure_at = None
+        self.opened_at = None
+        self.cooldown = COOLDOWN_SECONDS
+        self.probing = False
+        self.trial = None           # token of the request holding the half-open circuit
+        self.half_opened_at = None
+
+    def retry_at(self):
+        """Time after which the site may be tried again"""
+        if self.opened_at is None:
+            return None
+        return self.opened_at + self.cooldown
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        latencies = sorted(latency for ok, latency in self.recent if ok)
+        errors = sum(1 for ok, _ in self.recent if not ok)
+        retry_at = self.retry_at() if self.state != STATE_CLOSED else None
+        return {
+            "state": self.state,
+            "available": self.state != STATE_OPEN,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+            "error_rate": round(errors / len(self.recent), 3) if self.recent else 0.0,
+            "latency_avg_ms": round(sum(latencies) / len(latencies) * 1000) if latencies else None,
+            "latency_p90_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))] * 1000) if latencies else None,
+            "last_error": self.last_error,
+            "last_success_at": self.last_success_at,
+            "last_failure_at": self.last_failure_at,
+            "retry_in": max(0, round(retry_at - time.time())) if retry_at else None
+        }
+
+
+class SiteHealthTracker:
+    """Tracks per-site health and decides whether a site may be queried"""
+
+    def __init__(self, probe_urls=None):
+        self.sites = {}
+        self.probe_urls = dict(probe_urls or {})
+        self.result_cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = 0    # bumped whenever a health record changes
+        self._probe_thread = None
+
+    def _get(self, site):
+        health = self.sites.get(site)
+        if health is None:
+            health = self.sites[site] = SiteHealth(site)
+        return health
+
+    def register_site(self, site, search_url):
+        """Register a site and derive the URL used for recovery probes"""
+        parsed = urllib.parse.urlsplit(search_url)
+        with self.lock:
+            self._get(site)
+            self.probe_urls[site] = f"{parsed.scheme}://{parsed.netloc}/"
+
+    def allow_request(self, site):
+        """Check whether a request to the site should be attempted now.
+
+        Returns False, True, or for the single trial request of a half-open
+        circuit a trial token, which the caller passes to track() and
+        release(). Only the trial's outcome closes or reopens the circuit.
+        """
+        with self.lock:
+            health = self._get(site)
+            if health.state == STATE_CLOSED:
+                return True
+            now = time.time()
+            self._expire_trial(health, now)
+            if health.state == STATE_OPEN and now >= health.retry_at():
+                # Cooldown over: let a single trial request through
+                return self._half_open(health, now)
+            return False
+
+    def release(self, site, trial):
+        """Give up a trial request that recorded no outcome, reopening the circuit"""
+        with self.lock:
+            health = self._get(site)
+            if self._holds_trial(health, trial):
+                self._reopen(health)
+
+    def _holds_trial(self, health, trial):
+        return health.state == STATE_HALF_OPEN and trial is not None and trial is health.trial
+
+    def record_success(self, site, latency, trial=None):
+        """Record a successful request to a site"""
+        with self.lock:
+            health = self._get(site)
+            self.version += 1
+            health.total_requests += 1
+            health.recent.append((True, latency))
+            health.consecutive_failures = 0
+            health.last_success_at = time.time()
+            if health.state == STATE_HALF_OPEN and not self._holds_trial(health, trial):
+                return  # an older request; the trial decides
+            if health.state != STATE_CLOSED:
+                logger.info(f"[HEALTH] Site {site} recovered, closing circuit")
+            health.state = STATE_CLOSED
+            health.trial = None
+            health.opened_at = None
+            health.cooldown = COOLDOWN_SECONDS
+
+    def record_failure(self, site, latency, error, trial=None):
+        """Record a failed request to a site and open its circuit if needed"""
+        with self.lock:
+            health = self._get(site)
+            self.version += 1
+            health.total_requests += 1
+            health.total_failures += 1
+            health.recent.append((False, latency))
+            health.consecutive_failures += 1
+            health.last_error = str(error)[:200]
+            health.last_failure_at = time.time()
+
+            if self._holds_trial(health, trial):
+                # Trial request failed, back off further
+                health.cooldown = min(health.cooldown * 2, MAX_COOLDOWN_SECONDS)
+                self._open(health)
+            elif health.state == STATE_CLOSED and health.consecutive_failures >= FAILURE_THRESHOLD:
+                self._open(health)
+
+        self._ensure_prober()
+
+    def _half_open(self, health, now):
+        health.state = STATE_HALF_OPEN
+        health.trial = object()
+        health.half_opened_at = now
+        self.version += 1
+        return health.trial
+
+    def _reopen(self, health):
+        # Back to open without a new cooldown: the next request is the trial
+        health.state = STATE_OPEN
+        health.trial = None
+        health.half_opened_at = None
+        self.version += 1
+
+    def _expire_trial(self, health, now):
+        if (health.state == STATE_HALF_OPEN and not health.probing
+                and now - health.half_opened_at >= HALF_OPEN_TIMEOUT):
+            logger.warning(f"[HEALTH] Trial request to {health.site} timed out, reopening circuit")
+            self._reopen(health)
+
+    def _open(self, health):
+        health.state = STATE_OPEN
+        health.trial = None
+        health.opened_at = time.time()
+        logger.warning(
+            f"[HEALTH] Disabling site {health.site} for {int(health.cooldown)}s "
+            f"after {health.consecutive_failures} failures: {health.last_error}"
+        )
+
+    def track(self, site, deadline=None, trial=None):
+        """Context manager that times a request and records its outcome.
+
+        `trial` is the token from allow_request() of a half-open circuit's
+        trial request. Failures caused by the caller's own `deadline` running
+        out are not held against the site; a trial request ending that way
+        releases the half-open circuit instead.
+        """
+        return _TrackedRequest(self, site, deadline, trial)
+
+    def status(self, site):
+        """Get the health record of a site as a dictionary"""
+        with self.lock:
+            return self._get(site).to_dict()
+
+    def state_version(self):
+        """Token that changes whenever snapshot() would.
+
+        Includes the current second while a circuit is open, since the
+        snapshot then carries a retry countdown.
+        """
+        with self.lock:
+            if any(health.state != STATE_CLOSED for health in self.sites.values()):
+                return f"{self.version}.{int(time.time())}"
+            return str(self.version)
+
+    def snapshot(self):
+        """Get the health records of all known sites"""
+        with self.lock:
+            return {site: health.to_dict() for site, health in self.sites.items()}
+
+    # ------------------------------------------------------------------
+    # Result cache used as a fallback while a site is disabled
+    # ------------------------------------------------------------------
+
+    def cache_results(self, site, query, page, results):
+        """Remember the results of a successful search"""
+        key = (site, query.lower(), page)
+        with self.lock:
+            self.result_cache[key] = (time.time(), results)
+            self.result_cache.move_to_end(key)
+            while len(self.result_cache) > RESULT_CACHE_SIZE:
+                self.result_cache.popitem(last=False)
+
+    def cached_results(self, site, query, page):
+        """Get previously cached results for a search, or None"""
+        key = (site, query.lower(), page)
+        with self.lock:
+            entry = self.result_cache.get(key)
+            if entry is None:
+                return None
+            cached_at, results = entry
+            if time.time() - cached_at > RESULT_CACHE_TTL:
+                del self.result_cache[key]
+                return None
+            return results
+
+    # ------------------------------------------------------------------
+    # Background recovery probes
+    # ------------------------------------------------------------------
+
+    def _ensure_prober(self):
+        with self.lock:
+            if self._probe_thread and self._probe_thread.is_alive():
+                return
+            self._probe_thread = threading.Thread(target=self._probe_loop, name='site-health-prober', daemon=True)
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        """Re-check disabled sites once their cooldown expires"""
+        while True:
+            time.sleep(PROBE_INTERVAL)
+            now = time.time()
+            with self.lock:
+                for health in self.sites.values():
+                    self._expire_trial(health, now)
+                due = [
+                    health for health in self.sites.values()
+                    if health.state == STATE_OPEN and not health.probing and now >= health.retry_at()
+                ]
+                idle = all(health.state == STATE_CLOSED for health in self.sites.values())
+                trials = []
+                for health in due:
+                    health.probing = True
+                    trials.append(self._half_open(health, now))
+
+            for health, trial in zip(due, trials):
+                self._probe(health, trial)
+
+            if idle:
+                # Nothing left to watch; a new failure restarts the prober
+                return
+
+    def _probe(self, health, trial):
+        url = self.probe_urls.get(health.site)
+        if not url:
+            with self.lock:
+                health.probing = False
+            self.release(health.site, trial)
+            return
+        start = time.time()
+        try:
+            response = requests.get(url, timeout=PROBE_TIMEOUT, headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+            })
+            response.raise_for_status()
+            if looks_like_challenge(response.text):
+                raise SiteUnavailableError("challenge page")
+            logger.info(f"[HEALTH] Probe of {health.site} succeeded")
+            self.record_success(health.site, time.time() - start, trial)
+        except Exception as e:
+            logger.info(f"[HEALTH] Probe of {health.site} failed: {e}")
+            self.record_failure(health.site, time.time() - start, e, trial)
+        finally:
+            with self.lock:
+                health.probing = False
+
+
+class _TrackedRequest:
+    """Context manager returned by SiteHealthTracker.track()"""
+
+    def __init__(self, tracker, site, deadline=None, trial=None):
+        self.tracker = tracker
+        self.site = site
+        self.deadline = deadline
+        self.trial = trial
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        latency = time.time() - self.start
+        if exc is None:
+            self.tracker.record_success(self.site, latency, self.trial)
+        elif self.deadline is None or not self.deadline.expired():
+            self.tracker.record_failure(self.site, latency, exc, self.trial)
+        else:
+            self.tracker.release(self.site, self.trial)
+        return False
+
+
+# Global site health tracker instance
+site_health = SiteHealthTracker()
@@ -0,0 +1,251 @@
+"""
+Storage Mover Module
+Relocates finished torrents from the scratch volume Transmission downloads
+to onto a bulk library volume, using torrent-set-location with move=true.
+The library volume is mounted at a subdirectory of the download directory,
+so the web app serves and indexes both tiers as one tree.
+"""
+import os
+import time
+import queue
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for finished torrents to move
+STORAGE_POLL_INTERVAL = float(os.environ.get('STORAGE_POLL_INTERVAL', '60'))
+# Seconds a torrent must have been complete before it is moved
+STORAGE_MOVE_AFTER = float(os.environ.get('STORAGE_MOVE_AFTER', '0'))
+# Cross-filesystem moves (full copies) running at the same time
+STORAGE_MOVE_CONCURRENCY = int(os.environ.get('STORAGE_MOVE_CONCURRENCY', '1'))
+# Give up waiting for Transmission to finish a move after this many seconds
+STORAGE_MOVE_TIMEOUT = float(os.environ.get('STORAGE_MOVE_TIMEOUT', str(6 * 3600)))
+# Finished moves kept for status queries
+FINISHED_MOVES_KEPT = 100
+
+
+class MoveJob:
+    """Relocation of one torrent and its outcome"""
+
+    def __init__(self, torrent, rename):
+        self.torrent_id = torrent.id
+        self.info_hash = torrent.hash_string
+        self.name = torrent.name
+        self.size = torrent.size
+        self.rename = rename        # same filesystem: Transmission only renames
+        self.status = 'queued'
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            "torrent_id": self.torrent_id,
+            "name": self.name,
+            "size": self.size,
+            "method": "rename" if self.rename else "copy",
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "duration": round(self.finished - self.started, 1) if self.finished and self.started else None
+        }
+
+
+class StorageMover:
+    """Moves completed torrents from the scratch directory into the library subdirectory"""
+
+    def __init__(self, concurrency=STORAGE_MOVE_CONCURRENCY):
+        self.concurrency = max(concurrency, 1)
+        self.root = None                 # local download directory
+        self.library_subdir = None       # library mount point, relative to root
+        self.remote_root = None          # download directory as Transmission sees it
+        self.client_factory = None
+        # Hooks set by the web app
+        self.is_busy = None              # (torrent) -> True while other work uses its files
+        self.on_move_started = None      # (job)
+        self.on_move_finished = None     # (job, new relpath or None)
+        self.jobs = OrderedDict()        # torrent id -> MoveJob
+        self.lock = threading.Lock()
+        self._copy_queue = queue.Queue()
+        self._threads = []
+
+    @property
+    def enabled(self):
+        return bool(self.library_subdir)
+
+    @property
+    def library_path(self):
+        return os.path.join(self.root, self.library_subdir)
+
+    @property
+    def remote_library_path(self):
+        return self.remote_root.rstrip('/') + '/' + self.library_subdir
+
+    def same_filesystem(self):
+        """Whether scratch and library share a filesystem, making moves plain renames"""
+        return os.stat(self.root).st_dev == os.stat(self.library_path).st_dev
+
+    def start(self, root, library_subdir, remote_root, client_factory):
+        """Start moving finished torrents in the background"""
+        self.root = os.path.abspath(root)
+        self.library_subdir = library_subdir.strip('/')
+        self.remote_root = remote_root
+        self.client_factory = client_factory
+        os.makedirs(self.library_path, exist_ok=True)
+        for _ in range(self.concurrency):
+            thread = threading.Thread(target=self._copy_worker, name='storage-mover', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._watch, name='storage-watch', daemon=True).start()
+        logger.info(f"[MOVER] Moving finished torrents to {self.library_path} "
+                    f"({'rename' if self.same_filesystem() else 'copy'}, {self.concurrency} at a time)")
+
+    def _watch(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"[MOVER] Poll failed: {e}")
+            time.sleep(STORAGE_POLL_INTERVAL)
+
+    def eligible(self, torrent):
+        """A torrent is moved once it is complete, settled, on scratch and not in use"""
+        if torrent.progress < 100 or torrent.download_dir.rstrip('/') != self.remote_root.rstrip('/'):
+            return False
+        if torrent.name == self.library_subdir or torrent.status in ('checking', 'check pending'):
+            return False
+        if torrent.done_date and time.time() - torrent.done_date < STORAGE_MOVE_AFTER:
+            return False
+        if self.is_busy and self.is_busy(torrent):
+            return False
+        with self.lock:
+            job = self.jobs.get(torrent.id)
+        return job is None or job.status == 'failed' and time.time() - job.finished > STORAGE_POLL_INTERVAL * 10
+
+    def poll(self):
+        """Queue every eligible torrent; renames are handed over right away, copies go to the workers"""
+        client = self.client_factory() if self.client_factory else None
+        if not client:
+            return
+        rename = self.same_filesystem()
+        for torrent in client.list_torrents():
+            if self.eligible(torrent):
+                self.submit(torrent, rename, client)
+
+    def submit(self, torrent, rename=None, client=None):
+        """Move one torrent; returns its job"""
+        job = MoveJob(torrent, self.same_filesystem() if rename is None else rename)
+        with self.lock:
+            current = self.jobs.get(torrent.id)
+            if current is not None and current.status in ('queued', 'moving'):
+                return current
+            self.jobs.pop(torrent.id, None)
+            self.jobs[torrent.id] = job
+            finished = [tid for tid, j in self.jobs.items() if j.finished]
+            for tid in finished[:max(0, len(finished) - FINISHED_MOVES_KEPT)]:
+                del self.jobs[tid]
+        if job.rename:
+            # Only the hand-over runs in the caller (a request or the poll
+            # thread); Transmission may still copy if its mounts differ from ours
+            if self._hand_over(job, client or self.client_factory()):
+                threading.Thread(target=self._complete, args=(job, self.client_factory()),
+                                 name='storage-rename', daemon=True).start()
+        else:
+            self._copy_queue.put(job)
+        return job
+
+    def _copy_worker(self):
+        while True:
+            job = self._copy_queue.get()
+            try:
+                client = self.client_factory()
+                if self._hand_over(job, client):
+                    self._complete(job, client)
+            except Exception as e:
+                logger.error(f"[MOVER] Move of {job.name} failed: {e}")
+
+    def _hand_over(self, job, client):
+        """Ask Transmission to relocate a torrent; False (and the job failed) if it cannot"""
+        job.status = 'moving'
+        job.started = time.time()
+        if self.on_move_started:
+            self.on_move_started(job)
+        try:
+            if not client:
+                raise RuntimeError("Failed to connect to torrent client")
+            if not client.set_torrent_location(job.torrent_id, self.remote_library_path, move=True):
+                raise RuntimeError("Transmission refused the new location")
+            return True
+        except Exception as e:
+            self._fail(job, e)
+            self._finish(job)
+            return False
+
+    def _complete(self, job, client):
+        """Wait for Transmission to finish relocating a torrent, then move what it left behind"""
+        try:
+            if not client:
+                raise RuntimeError("Failed to connect to torrent client")
+            # Transmission reports the new directory once the data has moved
+            deadline = time.time() + STORAGE_MOVE_TIMEOUT
+            while True:
+                torrent = client.get_torrent(job.torrent_id)
+                if torrent.download_dir.rstrip('/') == self.remote_library_path.rstrip('/'):
+                    break
+                if torrent.error:
+                    raise RuntimeError(torrent.error_string or "Transmission reported an error")
+                if time.time() > deadline:
+                    raise RuntimeError("Timed out waiting for Transmission to move the data")
+                # Renames finish quickly; one still running is really a copy
+                time.sleep(1 if job.rename and time.time() - job.started < 60 else 5)
+
+            # Files Transmission does not know about (e.g. extracted archives) stay behind
+            leftover = os.path.join(self.root, job.name)
+            target = os.path.join(self.library_path, job.name)
+            if os.path.exists(leftover):
+                if os.path.isdir(leftover) and os.path.isdir(target):
+                    for name in os.listdir(leftover):
+                        shutil.move(os.path.join(leftover, name), os.path.join(target, name))
+                    os.rmdir(leftover)
+                elif not os.path.exists(target):
+                    shutil.move(leftover, target)
+
+            job.status = 'completed'
+            logger.info(f"[MOVER] Moved {job.name} to the library in {time.time() - job.started:.1f}s")
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            self._finish(job)
+
+    def _fail(self, job, error):
+        job.status = 'failed'
+        job.error = str(error)
+        logger.error(f"[MOVER] Moving {job.name} failed: {error}")
+
+    def _finish(self, job):
+        job.finished = time.time()
+        if self.on_move_finished:
+            relpath = os.path.join(self.library_subdir, job.name) if job.status == 'completed' else None
+            self.on_move_finished(job, relpath)
+
+    def snapshot(self):
+        with self.lock:
+            jobs = [job.to_dict() for job in reversed(self.jobs.values())]
+        return {
+            "enabled": self.enabled,
+            "library": self.library_subdir,
+            "same_filesystem": self.same_filesystem() if self.enabled else None,
+            "concurrency": self.concurrency,
+            "moves": jobs
+        }
+
+
+# Global storage mover instance
+storage_mover = StorageMover()
@@ -7,8 +7,16 @@ import logging
 import time
 import os
 
+try:
+    from .metrics import TRANSMISSION_RPC_SECONDS, TRANSMISSION_RPC_ERRORS
+except ImportError:
+    from metrics import TRANSMISSION_RPC_SECONDS, TRANSMISSION_RPC_ERRORS
+
 logger = logging.getLogger(__name__)
 
+class TransmissionUnavailable(Exception):
+    """Transmission could not be reached; the request may succeed when retried"""
+
 class TransmissionHTTPClient:
     """Custom HTTP client for Transmission RPC"""
     
@@ -41,7 +49,9 @@ class TransmissionHTTPClient:
 
     def _make_request(self, data, max_retries=3):
         """Make a request to Transmission with proper session handling"""
+        method = data.get("method", "unknown")
         for attempt in range(max_retries):
+            start = time.perf_counter()
             try:
                 if not self.session_id:
                     self._get_session_id()
@@ -70,12 +80,16 @@ class TransmissionHTTPClient:
                     )
 
                 response.raise_for_status()
-                return response.json()
+                result = response.json()
+                TRANSMISSION_RPC_SECONDS.labels(method).observe(time.perf_counter() - start)
+                return result
 
             except Exception as e:
+                TRANSMISSION_RPC_SECONDS.labels(method).observe(time.perf_counter() - start)
+                TRANSMISSION_RPC_ERRORS.labels(method).inc()
                 logger.error(f"Request attempt {attempt + 1} failed: {e}")
                 if attempt == max_retries - 1:
-                    raise Exception(f"Request failed after {max_retries} attempts: {e}")
+                    raise TransmissionUnavailable(f"Request failed after {max_retries} attempts: {e}")
                 time.sleep(1)  # Brief delay before retry
 
     def add_torrent(self, magnet_link, download_dir=None):
@@ -115,7 +129,7 @@ class TransmissionHTTPClient:
             "method": "torrent-get",
             "arguments": {
                 "ids": [torrent_id],
-                "fields": ["id", "name", "status", "percentDone", "downloadDir", "error", "errorString", "rateDownload", "rateUpload"]
+                "fields": ["id", "name", "status", "percentDone", "downloadDir", "error", "errorString", "rateDownload", "rateUpload", "sizeWhenDone", "hashString", "doneDate", "recheckProgress"]
             }
         }
 
@@ -132,7 +146,7 @@ class TransmissionHTTPClient:
         data = {
             "method": "torrent-get",
             "arguments": {
-                "fields": ["id", "name", "status", "percentDone", "downloadDir", "error", "errorString", "rateDownload", "rateUpload"]
+                "fields": ["id", "name", "status", "percentDone", "downloadDir", "error", "errorString", "rateDownload", "rateUpload", "sizeWhenDone", "hashString", "doneDate", "recheckProgress"]
             }
         }
 
@@ -286,6 +300,13 @@ class TransmissionTorrent:
         self.error_string = data.get("errorString", "")
         self.download_rate = data.get("rateDownload", 0)
         self.upload_rate = data.get("rateUpload", 0)
+        # Bytes of the selected files; 0 until a magnet's metadata has arrived
+        self.size = data.get("sizeWhenDone", 0)
+        self.hash_string = data.get("hashString", "")
+        # Unix time the download finished; 0 while incomplete
+        self.done_date = data.get("doneDate", 0)
+        # Fraction of the data checked by a running verification
+        self.recheck_progress = data.get("recheckProgress", 0)
 
     def _convert_status(self, status_code):
         """Convert numeric status to string"""
@@ -311,7 +332,8 @@ class TransmissionTorrent:
             "error": self.error,
             "error_string": self.error_string,
             "download_rate": self.download_rate,
-            "upload_rate": self.upload_rate
+            "upload_rate": self.upload_rate,
+            "size": self.size
         }
 
 
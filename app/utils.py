@@ -5,6 +5,12 @@ Common helper functions used across the application
 import os
 import time
 import re
+import json
+import codecs
+import platform
+import threading
+import ctypes
+import ctypes.util
 import urllib.parse
 import requests
 from bs4 import BeautifulSoup
@@ -27,24 +33,25 @@ def format_size(size_bytes):
 def parse_size(size_str):
     """Convert a human-readable size string to bytes"""
     try:
-        size_str = size_str.upper().replace(" ", "")
+        size_str = size_str.upper().replace(" ", "").replace(",", "").replace("IB", "B")
         multipliers = {
-            'B': 1,
             'KB': 1024,
             'MB': 1024 * 1024,
             'GB': 1024 * 1024 * 1024,
-            'TB': 1024 * 1024 * 1024 * 1024
+            'TB': 1024 * 1024 * 1024 * 1024,
+            'B': 1
         }
         
+        # Longer units first, so "GB" is not mistaken for "B"
         for unit, multiplier in multipliers.items():
-            if unit in size_str:
-                size_value = float(size_str.replace(unit, ""))
+            if size_str.endswith(unit):
+                size_value = float(size_str[:-len(unit)])
                 return int(size_value * multiplier)
         
         # If no unit found, assume bytes
         return int(float(size_str))
         
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, AttributeError):
         return 0
 
 
@@ -106,16 +113,138 @@ def get_file_list(directory):
         return []
 
 
-def search_torrents_json_api(query, search_url):
+def iter_json_array(chunks):
+    """Yield the raw text of each element of a top-level JSON array.
+
+    `chunks` is any iterable of bytes or str (e.g. `response.iter_content()`).
+    Elements are located by scanning brackets and strings only, so nothing is
+    decoded until the caller asks for it and reading stops as soon as the
+    caller stops iterating.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = ''
+    pos = 0
+    started = False
+    depth = 0
+    in_string = False
+    escaped = False
+    item_start = None
+
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if not chunk:
+            continue
+
+        # Drop text that has already been consumed before appending
+        if item_start is None:
+            buffer = buffer[pos:] + chunk
+            pos = 0
+        else:
+            buffer = buffer[item_start:] + chunk
+            pos -= item_start
+            item_start = 0
+
+        while pos < len(buffer):
+            char = buffer[pos]
+
+            if not started:
+                if char == '[':
+                    started = True
+                elif not char.isspace():
+                    raise ValueError("JSON payload is not an array")
+                pos += 1
+                continue
+
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                pos += 1
+                continue
+
+            if item_start is None:
+                if char.isspace() or char == ',':
+                    pos += 1
+                    continue
+                if char == ']':
+                    return
+                item_start = pos
+
+            if char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            elif char in ']}':
+                if depth == 0:
+                    # Closing bracket of the outer array ends a scalar element
+                    yield buffer[item_start:pos].strip()
+                    return
+                depth -= 1
+                if depth == 0:
+                    yield buffer[item_start:pos + 1]
+                    item_start = None
+            elif char == ',' and depth == 0:
+                yield buffer[item_start:pos].strip()
+                item_start = None
+
+            pos += 1
+
+    if not started:
+        raise ValueError("Empty JSON payload")
+    raise ValueError("Truncated JSON array")
+
+
+def decode_json_array(chunks, limit=None, offset=0, skip=None):
+    """Decode a bounded slice of a streamed JSON array.
+
+    Elements for which `skip(raw_text)` is true are dropped without being
+    decoded and do not count towards `offset` or `limit`. The first `offset`
+    kept elements are skipped the same way. Returns `(items, has_more)`, where
+    `has_more` tells whether another kept element follows the slice.
+    """
+    items = []
+    kept = 0
+
+    for raw in iter_json_array(chunks):
+        if skip and skip(raw):
+            continue
+        if kept < offset:
+            kept += 1
+            continue
+        if limit is not None and len(items) >= limit:
+            return items, True
+        items.append(json.loads(raw))
+        kept += 1
+
+    return items, False
+
+
+# apibay answers an empty search with a single filler row whose id is "0"
+_placeholder_row = re.compile(r'^\{\s*"id"\s*:\s*"?0"?\s*[,}]').match
+
+
+def is_placeholder_row(raw_item):
+    """Check whether a raw PirateBay API row is the 'no results' filler"""
+    return _placeholder_row(raw_item) is not None
+
+
+def search_torrents_json_api(query, search_url, limit=None, offset=0):
     """Search torrents using JSON API (like ThePirateBay API)"""
     try:
         encoded_query = urllib.parse.quote(query)
         url = search_url.format(query=encoded_query)
         
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        
-        results = response.json()
+        with requests.get(url, timeout=15, stream=True) as response:
+            response.raise_for_status()
+            results, _ = decode_json_array(
+                response.iter_content(chunk_size=16384),
+                limit=limit, offset=offset, skip=is_placeholder_row
+            )
+
         processed_results = []
         
         for item in results:
@@ -233,4 +362,29 @@ def get_default_trackers():
         "udp://tracker.torrent.eu.org:451/announce",
         "udp://tracker.tiny-vps.com:6969/announce",
         "udp://retracker.lanta-net.ru:2710/announce"
-    ]
\ No newline at end of file
+    ]
+
+
+# ioprio_set(2) syscall numbers; the idle class only gets disk time nobody else wants
+IOPRIO_SYSCALLS = {'x86_64': 251, 'aarch64': 30, 'armv7l': 314, 'i686': 289}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+
+
+def lower_thread_priority(nice=True):
+    """Put the calling thread in the idle I/O class and optionally lowest CPU priority (Linux, best effort)"""
+    lowered = False
+    number = IOPRIO_SYSCALLS.get(platform.machine())
+    if number is not None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            lowered = libc.syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << 13) == 0
+        except Exception:
+            pass
+    if nice and hasattr(os, 'setpriority'):
+        try:
+            # On Linux the priority of a thread id applies to that thread only
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except OSError:
+            pass
+    return lowered
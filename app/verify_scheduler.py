@@ -0,0 +1,274 @@
+"""
+Torrent Verification Scheduler
+Queues Transmission verify requests (manual, after moves between volumes and
+periodic re-checks of old seeds) and hands them to Transmission one or a few
+at a time, holding them back while downloads are active so integrity checks
+do not compete with download writes for the disk.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Verifications running at the same time while downloads are idle
+VERIFY_CONCURRENCY = int(os.environ.get('VERIFY_CONCURRENCY', '1'))
+# Verifications running at the same time while downloads are active (0 holds them)
+VERIFY_BUSY_CONCURRENCY = int(os.environ.get('VERIFY_BUSY_CONCURRENCY', '0'))
+# Transmission counts as busy above this download rate (bytes/s)
+VERIFY_BUSY_RATE = int(float(os.environ.get('VERIFY_BUSY_RATE_KB', '512')) * 1024)
+# Seconds between scheduler passes
+VERIFY_POLL_INTERVAL = float(os.environ.get('VERIFY_POLL_INTERVAL', '5'))
+# Re-check complete torrents not verified for this many days (0 disables)
+VERIFY_PERIODIC_DAYS = float(os.environ.get('VERIFY_PERIODIC_DAYS', '0'))
+# Verify torrents copied to another volume by the storage mover
+VERIFY_AFTER_MOVE = os.environ.get('VERIFY_AFTER_MOVE', 'true').lower() in ('1', 'true', 'yes')
+# Seconds to wait for Transmission to report a requested check
+START_TIMEOUT = 60
+# Seconds between periodic sweeps for torrents due a re-check
+SWEEP_INTERVAL = 3600
+# Finished verifications kept for status queries
+FINISHED_JOBS_KEPT = 100
+# Time of each torrent's last verification, kept in the download directory (hidden)
+STATE_FILE = '.verify-state.json'
+
+CHECKING = ('checking', 'check pending')
+# Lower runs first; periodic checks wait behind requested ones
+PRIORITY = {'manual': 0, 'moved': 1, 'periodic': 2}
+
+
+class VerifyJob:
+    """One verification of a torrent and its progress"""
+
+    def __init__(self, torrent_id, name, reason, hash_string=''):
+        self.id = uuid.uuid4().hex[:12]
+        self.torrent_id = torrent_id
+        self.name = name
+        self.hash_string = hash_string
+        self.reason = reason
+        self.status = 'queued'
+        self.progress = 0.0         # recheckProgress, in percent
+        self.complete = None        # percentDone after the check
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.seen_checking = False
+
+    def to_dict(self):
+        """Convert to dictionary for JSON serialization"""
+        return {
+            "id": self.id,
+            "torrent_id": self.torrent_id,
+            "name": self.name,
+            "reason": self.reason,
+            "status": self.status,
+            "progress": round(self.progress, 1),
+            "complete": self.complete,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+
+class VerifyScheduler:
+    """Serializes Transmission verifications according to download activity"""
+
+    def __init__(self, concurrency=VERIFY_CONCURRENCY, busy_concurrency=VERIFY_BUSY_CONCURRENCY):
+        self.concurrency = max(concurrency, 1)
+        self.busy_concurrency = max(busy_concurrency, 0)
+        self.jobs = OrderedDict()   # job id -> VerifyJob, oldest first
+        self.lock = threading.Lock()
+        self.root = None
+        self.client_factory = None
+        self.busy = False
+        self.verified = {}          # torrent hash -> time of last completed check
+        self._last_sweep = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    # -- state ----------------------------------------------------------
+
+    @property
+    def _state_path(self):
+        return os.path.join(self.root, STATE_FILE)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path) as f:
+                self.verified = {str(k): float(v) for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            logger.warning(f"[VERIFY] Ignoring unreadable state: {e}")
+
+    def _save_state(self):
+        with self.lock:
+            verified = dict(self.verified)
+        tmp_path = self._state_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(verified, f, separators=(',', ':'))
+            os.replace(tmp_path, self._state_path)
+        except OSError as e:
+            logger.warning(f"[VERIFY] Cannot save state: {e}")
+
+    # -- queueing -------------------------------------------------------
+
+    def enqueue(self, torrent_id, name='', reason='manual', hash_string=''):
+        """Queue a verification; a torrent already queued or checking keeps its job"""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.torrent_id == torrent_id and not job.finished:
+                    if PRIORITY.get(reason, 0) < PRIORITY.get(job.reason, 0) and job.status == 'queued':
+                        job.reason = reason
+                    return job
+            job = VerifyJob(torrent_id, name, reason, hash_string)
+            self.jobs[job.id] = job
+            self._prune()
+        logger.info(f"[VERIFY] Queued {name or torrent_id} ({reason})")
+        self._wakeup.set()
+        return job
+
+    def cancel(self, job_id):
+        """Drop a queued verification; checks already handed to Transmission run to the end"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return False
+            job.status = 'cancelled'
+            job.finished = time.time()
+        return True
+
+    def snapshot(self):
+        with self.lock:
+            jobs = [job.to_dict() for job in reversed(self.jobs.values())]
+        return {
+            "jobs": jobs,
+            "queued": sum(1 for job in jobs if job["status"] == 'queued'),
+            "running": sum(1 for job in jobs if job["status"] == 'checking'),
+            "busy": self.busy,
+            "concurrency": self.busy_concurrency if self.busy else self.concurrency
+        }
+
+    def _prune(self):
+        """Drop the oldest finished jobs beyond the retention limit (lock held)"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self.jobs[job_id]
+
+    # -- scheduling -----------------------------------------------------
+
+    def start(self, root, client_factory):
+        """Start the scheduler thread"""
+        self.root = os.path.abspath(root)
+        self.client_factory = client_factory
+        self._load_state()
+        self._thread = threading.Thread(target=self._run, name='verify-scheduler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"[VERIFY] Poll failed: {e}")
+            self._wakeup.wait(VERIFY_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def poll(self):
+        """Track running checks, then start queued ones while there are free slots"""
+        client = self.client_factory() if self.client_factory else None
+        if not client:
+            return
+
+        stats = client.session_stats()
+        self.busy = stats.get("downloadSpeed", 0) > VERIFY_BUSY_RATE
+        torrents = {torrent.id: torrent for torrent in client.list_torrents()}
+
+        with self.lock:
+            running = [job for job in self.jobs.values() if job.status == 'checking']
+        for job in running:
+            self._track(job, torrents.get(job.torrent_id))
+
+        if VERIFY_PERIODIC_DAYS > 0 and time.time() - self._last_sweep > SWEEP_INTERVAL:
+            self._sweep(torrents.values())
+
+        limit = self.busy_concurrency if self.busy else self.concurrency
+        with self.lock:
+            active = sum(1 for job in self.jobs.values() if job.status == 'checking')
+            queued = sorted((job for job in self.jobs.values() if job.status == 'queued'),
+                            key=lambda job: (PRIORITY.get(job.reason, 0), job.created))
+        for job in queued[:max(0, limit - active)]:
+            self._begin(client, job, torrents.get(job.torrent_id))
+
+    def _begin(self, client, job, torrent):
+        job.started = time.time()
+        if torrent is None:
+            self._finish(job, 'failed', "Torrent not found")
+            return
+        job.name = job.name or torrent.name
+        job.hash_string = job.hash_string or torrent.hash_string
+        if not client.verify_torrent(job.torrent_id):
+            self._finish(job, 'failed', "Transmission refused the verification")
+            return
+        job.status = 'checking'
+        logger.info(f"[VERIFY] Checking {job.name} ({job.reason})")
+
+    def _track(self, job, torrent):
+        if torrent is None:
+            self._finish(job, 'failed', "Torrent was removed")
+            return
+        if torrent.status in CHECKING:
+            job.seen_checking = True
+            job.progress = torrent.recheck_progress * 100 if torrent.status == 'checking' else 0.0
+            return
+        # Small torrents can finish between two polls without ever being seen checking
+        if job.seen_checking or time.time() - job.started > START_TIMEOUT:
+            job.progress = 100.0
+            job.complete = round(torrent.progress, 2)
+            if torrent.error:
+                self._finish(job, 'failed', torrent.error_string or "Transmission reported an error")
+            else:
+                self._finish(job, 'completed' if torrent.progress >= 100 else 'damaged')
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        if status in ('completed', 'damaged') and job.hash_string:
+            with self.lock:
+                self.verified[job.hash_string] = job.finished
+            self._save_state()
+        if status == 'damaged':
+            logger.warning(f"[VERIFY] {job.name} is only {job.complete}% intact; Transmission will re-download the rest")
+        else:
+            logger.info(f"[VERIFY] {job.name} {status}" + (f": {error}" if error else ""))
+
+    def _sweep(self, torrents):
+        """Queue complete torrents whose last check is older than the periodic interval"""
+        self._last_sweep = time.time()
+        due = self._last_sweep - VERIFY_PERIODIC_DAYS * 86400
+        changed = False
+        for torrent in torrents:
+            if torrent.progress < 100 or not torrent.hash_string or torrent.status in CHECKING:
+                continue
+            last = self.verified.get(torrent.hash_string)
+            if last is None:
+                # Seeds seen for the first time count from now, not from zero
+                with self.lock:
+                    self.verified[torrent.hash_string] = self._last_sweep
+                changed = True
+            elif last < due:
+                self.enqueue(torrent.id, torrent.name, 'periodic', torrent.hash_string)
+        if changed:
+            self._save_state()
+
+
+# Global verification scheduler instance
+verify_scheduler = VerifyScheduler()
@@ -0,0 +1,198 @@
+"""
+Streaming Zip Module
+Builds a zip archive of a folder on the fly, without temporary files and in
+constant memory. Entries are stored uncompressed with zip64 records, so the
+archive layout and total size are known up front and any byte range of the
+archive can be produced, which makes folder downloads resumable.
+"""
+import os
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+READ_SIZE = 1024 * 1024
+
+# Fixed record sizes (all entries carry zip64 extra fields)
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')          # 30 bytes
+LOCAL_ZIP64_EXTRA = struct.Struct('<HHQQ')            # 20 bytes
+DATA_DESCRIPTOR = struct.Struct('<IIQQ')              # 24 bytes
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')  # 46 bytes
+CENTRAL_ZIP64_EXTRA = struct.Struct('<HHQQQ')         # 28 bytes
+ZIP64_END = struct.Struct('<IQHHIIQQQQ')              # 56 bytes
+ZIP64_LOCATOR = struct.Struct('<IIQI')                # 20 bytes
+END_RECORD = struct.Struct('<IHHHHIIH')               # 22 bytes
+
+VERSION = 45                 # zip64
+VERSION_MADE_BY = 3 << 8 | VERSION  # Unix
+FLAGS = 0x0808               # data descriptor + UTF-8 names
+MAX32 = 0xFFFFFFFF
+MAX16 = 0xFFFF
+
+# CRCs of unchanged files, so resumed downloads do not re-read earlier files
+_crc_cache = OrderedDict()
+_crc_cache_lock = threading.Lock()
+CRC_CACHE_SIZE = 100000
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(max(mtime, 315532800))  # zip cannot represent dates before 1980
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class ZipMember:
+    """A file inside the archive and the offsets of its records"""
+
+    def __init__(self, full_path, arcname, stat, offset):
+        self.full_path = full_path
+        self.arcname = arcname.encode('utf-8')
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mode = stat.st_mode
+        self.cache_key = (full_path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        self.header_offset = offset
+        self.data_offset = offset + LOCAL_HEADER.size + len(self.arcname) + LOCAL_ZIP64_EXTRA.size
+        self.descriptor_offset = self.data_offset + self.size
+        self.end_offset = self.descriptor_offset + DATA_DESCRIPTOR.size
+
+    def local_header(self):
+        time_, date = _dos_datetime(self.mtime)
+        return (LOCAL_HEADER.pack(0x04034b50, VERSION, FLAGS, 0, time_, date, 0, MAX32, MAX32,
+                                  len(self.arcname), LOCAL_ZIP64_EXTRA.size)
+                + self.arcname
+                + LOCAL_ZIP64_EXTRA.pack(0x0001, 16, 0, 0))
+
+    def descriptor(self, crc):
+        return DATA_DESCRIPTOR.pack(0x08074b50, crc, self.size, self.size)
+
+    def central_header(self, crc):
+        time_, date = _dos_datetime(self.mtime)
+        return (CENTRAL_HEADER.pack(0x02014b50, VERSION_MADE_BY, VERSION, FLAGS, 0, time_, date, crc,
+                                    MAX32, MAX32, len(self.arcname), CENTRAL_ZIP64_EXTRA.size, 0, 0, 0,
+                                    (self.mode & 0xFFFF) << 16, MAX32)
+                + self.arcname
+                + CENTRAL_ZIP64_EXTRA.pack(0x0001, 24, self.size, self.size, self.header_offset))
+
+    def central_size(self):
+        return CENTRAL_HEADER.size + len(self.arcname) + CENTRAL_ZIP64_EXTRA.size
+
+
+class ZipStream:
+    """Deterministic store-mode zip64 archive of a list of files"""
+
+    def __init__(self, files):
+        """`files` is a list of (full_path, archive_name); entries are sorted by name"""
+        self.members = []
+        offset = 0
+        for full_path, arcname in sorted(files, key=lambda f: f[1]):
+            member = ZipMember(full_path, arcname, os.stat(full_path), offset)
+            self.members.append(member)
+            offset = member.end_offset
+        self.central_offset = offset
+        self.central_size = sum(m.central_size() for m in self.members)
+        self.zip64_end_offset = self.central_offset + self.central_size
+        self.size = self.zip64_end_offset + ZIP64_END.size + ZIP64_LOCATOR.size + END_RECORD.size
+        self.mtime = max((m.mtime for m in self.members), default=0)
+        self._crcs = {}
+
+    @property
+    def etag(self):
+        """Validator that changes whenever any member's identity, size or mtime does"""
+        digest = hashlib.sha1()
+        for member in self.members:
+            digest.update(repr((member.arcname, member.cache_key[1:])).encode())
+        return digest.hexdigest()
+
+    def _crc(self, member):
+        """CRC32 of a member's data, from the cache or by reading the file"""
+        crc = self._crcs.get(member.arcname)
+        if crc is not None:
+            return crc
+        with _crc_cache_lock:
+            crc = _crc_cache.get(member.cache_key)
+        if crc is None:
+            crc = 0
+            with open(member.full_path, 'rb') as f:
+                remaining = member.size
+                while remaining > 0:
+                    chunk = f.read(min(READ_SIZE, remaining))
+                    if not chunk:
+                        raise IOError(f"{member.full_path} shrank while being archived")
+                    crc = zlib.crc32(chunk, crc)
+                    remaining -= len(chunk)
+        self._remember_crc(member, crc)
+        return crc
+
+    def _remember_crc(self, member, crc):
+        self._crcs[member.arcname] = crc
+        with _crc_cache_lock:
+            _crc_cache[member.cache_key] = crc
+            _crc_cache.move_to_end(member.cache_key)
+            while len(_crc_cache) > CRC_CACHE_SIZE:
+                _crc_cache.popitem(last=False)
+
+    def _file_data(self, member, start, end):
+        """Yield member data between two offsets relative to the start of the data"""
+        # Only a full pass over the file yields its CRC for free
+        crc = 0 if start == 0 and member.arcname not in self._crcs else None
+        with open(member.full_path, 'rb') as f:
+            f.seek(start)
+            position = start
+            while position < end:
+                chunk = f.read(min(READ_SIZE, end - position))
+                if not chunk:
+                    raise IOError(f"{member.full_path} shrank while being archived")
+                if crc is not None:
+                    crc = zlib.crc32(chunk, crc)
+                position += len(chunk)
+                yield chunk
+        if crc is not None and end == member.size:
+            self._remember_crc(member, crc)
+
+    def _segments(self):
+        """(offset, length, producer) for every region of the archive, in order.
+
+        A producer takes (start, end) relative to its region and yields bytes.
+        """
+        def static(data_fn):
+            return lambda start, end: iter((data_fn()[start:end],))
+
+        for member in self.members:
+            header_len = member.data_offset - member.header_offset
+            yield member.header_offset, header_len, static(member.local_header)
+            yield member.data_offset, member.size, lambda s, e, m=member: self._file_data(m, s, e)
+            yield member.descriptor_offset, DATA_DESCRIPTOR.size, static(lambda m=member: m.descriptor(self._crc(m)))
+        yield self.central_offset, self.zip64_end_offset - self.central_offset, self._central_directory
+        tail_len = self.size - self.zip64_end_offset
+        yield self.zip64_end_offset, tail_len, static(self._end_records)
+
+    def _central_directory(self, start, end):
+        position = 0
+        for member in self.members:
+            length = member.central_size()
+            if position + length > start and position < end:
+                record = member.central_header(self._crc(member))
+                yield record[max(0, start - position):end - position]
+            position += length
+
+    def _end_records(self):
+        count = len(self.members)
+        return (ZIP64_END.pack(0x06064b50, ZIP64_END.size - 12, VERSION_MADE_BY, VERSION, 0, 0,
+                               count, count, self.central_size, self.central_offset)
+                + ZIP64_LOCATOR.pack(0x07064b50, 0, self.zip64_end_offset, 1)
+                + END_RECORD.pack(0x06054b50, 0, 0, min(count, MAX16), min(count, MAX16), MAX32, MAX32, 0))
+
+    def iter_bytes(self, start=0, end=None):
+        """Yield the archive bytes in [start, end)"""
+        end = self.size if end is None else end
+        for offset, length, producer in self._segments():
+            if offset + length <= start:
+                continue
+            if offset >= end:
+                break
+            for chunk in producer(max(0, start - offset), min(length, end - offset)):
+                if chunk:
+                    yield chunk
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark JSON encoding and compression of typical API responses.
+
+Compares the standard library encoder (what Flask's jsonify uses) with
+orjson, and the bytes sent raw, gzipped and brotli-compressed. orjson and
+brotli are optional; missing ones are skipped.
+
+    python benchmark_json.py [--repeat N]
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app'))
+
+import compression
+from fast_json import orjson
+
+TRACKERS = [
+    'udp://tracker.opentrackr.org:1337/announce',
+    'udp://open.stealth.si:80/announce',
+    'udp://tracker.torrent.eu.org:451/announce',
+    'udp://exodus.desync.com:6969/announce',
+    'udp://tracker.openbittorrent.com:6969/announce',
+    'udp://open.demonii.com:1337/announce',
+    'udp://tracker.moeking.me:6969/announce',
+    'udp://explodie.org:6969/announce',
+    'udp://tracker.tiny-vps.com:6969/announce',
+    'udp://tracker.theoks.net:6969/announce',
+    'http://tracker.openbittorrent.com:80/announce',
+    'udp://opentracker.i2p.rocks:6969/announce',
+]
+
+
+def sample_search(count=100):
+    """A search page as returned by /api/search for an HTML scrape site"""
+    results = []
+    for i in range(count):
+        name = f"Some.Game.Title.{i}.v1.{i % 7}.{i % 3}-REPACK [Multi {i % 12}] ({i * 37 % 90} GB)"
+        info_hash = hashlib.sha1(name.encode()).hexdigest().upper()
+        magnet = f"magnet:?xt=urn:btih:{info_hash}&dn={urllib.parse.quote(name)}"
+        magnet += ''.join(f"&tr={urllib.parse.quote(tracker, safe='')}" for tracker in TRACKERS)
+        results.append({
+            "name": name,
+            "size": f"{random.uniform(0.5, 90):.2f} GB",
+            "seeders": str(random.randint(0, 5000)),
+            "leechers": str(random.randint(0, 900)),
+            "info_hash": info_hash,
+            "magnet": magnet,
+            "added": "2024-05-17",
+            "category": "Games",
+            "detail_url": f"https://1337x.to/torrent/{5000000 + i}/{urllib.parse.quote(name)}/",
+            "site": "1337x"
+        })
+    return {"results": results, "count": count, "site": "1337x", "page": 1, "has_more": True}
+
+
+def sample_files(count=1000):
+    """A large /api/files page"""
+    files = []
+    for i in range(count):
+        folder = f"Collection {i // 40}/Season {i // 10 % 4 + 1}"
+        name = f"Episode.{i:04d}.1080p.WEB-DL.x264.mkv"
+        size = random.randint(10 ** 8, 4 * 10 ** 9)
+        files.append({
+            "name": name,
+            "path": f"{folder}/{name}",
+            "size": f"{size / 1024 ** 3:.2f} GB",
+            "size_bytes": size,
+            "modified": "2024-05-17 12:34:56",
+            "folder": folder
+        })
+    return {"files": files, "count": count, "total": 12000, "total_size": "9.1 TB",
+            "total_size_bytes": 10 ** 13, "version": 4711, "sort": "size", "order": "desc",
+            "next_cursor": "c2l6ZTo5OTk5OTk5OQ"}
+
+
+def sample_torrents(count=60):
+    """/api/current-torrents with a busy client"""
+    torrents = [{
+        "id": i,
+        "name": f"Some.Download.{i}.1080p",
+        "status": random.choice(["downloading", "seeding", "stopped"]),
+        "progress": round(random.uniform(0, 100), 2),
+        "download_dir": "/data/downloads",
+        "error": 0,
+        "error_string": "",
+        "download_rate": random.randint(0, 10 ** 7),
+        "upload_rate": random.randint(0, 10 ** 6),
+        "size": random.randint(10 ** 8, 10 ** 11)
+    } for i in range(count)]
+    return {"torrents": torrents, "count": count}
+
+
+def encoders():
+    # Flask's default provider sorts keys and uses compact separators
+    yield 'json', lambda obj: json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+    if orjson is not None:
+        yield 'orjson', lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def best_time(func, repeat):
+    """Fastest of `repeat` runs, in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50, help='runs per measurement (best is reported)')
+    args = parser.parse_args()
+    random.seed(1)
+
+    samples = [('search (100 results)', sample_search()),
+               ('files (1000 entries)', sample_files()),
+               ('torrents (60)', sample_torrents())]
+
+    print(f"{'response':<22} {'encoder':<8} {'encode ms':>10}")
+    for label, obj in samples:
+        for name, encode in encoders():
+            print(f"{label:<22} {name:<8} {best_time(lambda: encode(obj), args.repeat):>10.2f}")
+
+    print()
+    print(f"{'response':<22} {'encoding':<8} {'bytes':>10} {'ratio':>7} {'ms':>8}")
+    for label, obj in samples:
+        body = json.dumps(obj, separators=(',', ':')).encode()
+        print(f"{label:<22} {'raw':<8} {len(body):>10} {'1.00':>7} {'':>8}")
+        for encoding in reversed(compression.ENCODINGS):
+            compressed = compression.compress(body, encoding)
+            elapsed = best_time(lambda: compression.compress(body, encoding), max(args.repeat // 5, 1))
+            print(f"{label:<22} {encoding:<8} {len(compressed):>10} {len(body) / len(compressed):>7.2f} {elapsed:>8.2f}")
+
+    missing = [package for package, module in (('orjson', orjson), ('brotli', compression.brotli)) if module is None]
+    if missing:
+        print(f"\nNot installed, skipped: {', '.join(missing)}")
+
+
+if __name__ == '__main__':
+    main()
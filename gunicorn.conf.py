@@ -0,0 +1,36 @@
+"""
+Gunicorn configuration for the web app
+Every setting can be overridden through the WEB_* environment variables.
+"""
+import os
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+
+# Threaded workers: slow clients and long file or zip downloads hold a thread,
+# not a whole process. Background services run in only one worker, which the
+# others forward job requests (deletions, extractions, moves, verifications) to;
+# download tracking is shared through SQLite. One worker with many threads is
+# the default.
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_WORKERS', '1'))
+threads = int(os.environ.get('WEB_THREADS', '16'))
+
+# Pending connections queued by the kernel before new ones are refused
+backlog = int(os.environ.get('WEB_BACKLOG', '2048'))
+# Seconds an idle keep-alive connection stays open (the UI polls every few seconds)
+keepalive = int(os.environ.get('WEB_KEEPALIVE', '15'))
+# Seconds a worker may stay silent before it is restarted. Threaded workers keep
+# reporting while streaming, so this does not cut off long downloads.
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+# Seconds running requests get to finish on shutdown or restart
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+# Restart workers after this many requests to bound memory growth (0 = never)
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+# Each worker builds its own app: background threads do not survive a fork
+preload_app = False
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.environ.get('WEB_LOG_LEVEL', 'info')
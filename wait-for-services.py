@@ -5,7 +5,6 @@ Wait for services to be ready before starting the webapp
 import time
 import socket
 import requests
-import subprocess
 import sys
 import os
 
@@ -65,22 +64,24 @@ def wait_for_transmission(host, port, username, password, timeout=300):
 
 def start_flask_app():
     """Start the Flask application"""
-    print("?? Starting Flask application...")
+    server = os.environ.get('WEB_SERVER', 'gunicorn').lower()
+    print(f"?? Starting Flask application ({server})...")
     
     # Set environment variables
     os.environ['FLASK_APP'] = 'run.py'
     os.environ['FLASK_ENV'] = 'production'
     
+    if server == 'gunicorn':
+        # Production server; workers, threads and timeouts come from gunicorn.conf.py
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"]
+    else:
+        # Werkzeug development server
+        command = [sys.executable, "-m", "flask", "run", "--host=0.0.0.0", "--port=5000"]
+    
     try:
-        # Start the Flask app
-        subprocess.run([
-            "python", "-m", "flask", "run",
-            "--host=0.0.0.0",
-            "--port=5000"
-        ], check=True)
-    except KeyboardInterrupt:
-        print("\n?? Application stopped by user")
-    except subprocess.CalledProcessError as e:
+        # Replace this process so the server receives container signals directly
+        os.execv(command[0], command)
+    except OSError as e:
         print(f"? Flask app failed to start: {e}")
         sys.exit(1)
 